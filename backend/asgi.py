@@ -0,0 +1,213 @@
+"""
+Async serving mode for the API.
+
+$ uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+The generation endpoints (/api/roadmap, /api/quiz and /api/generate-resource)
+run as coroutines on the SDK's async API, so one process can keep hundreds of
+Gemini requests in flight without a thread blocked on each of them. Every
+other route, including auth, progress and streaming requests, is passed
+through unchanged to the Flask app in base.py.
+"""
+
+import asyncio
+import json
+import math
+import os
+import time
+
+from asgiref.wsgi import WsgiToAsgi
+
+import base
+import compression
+import generativeResources
+import metrics
+import prefetch
+import quiz
+import ratelimit
+import resilience
+import roadmap
+import sessions
+
+# Upper bound on generations running at once, the rest wait for a slot
+ASYNC_MAX_CONCURRENCY = int(os.environ.get("ASYNC_MAX_CONCURRENCY", 500))
+# Seconds a single generation may take before the client gets a 504
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", 120))
+
+flask_app = WsgiToAsgi(base.api)
+_slots = None
+
+
+async def generate_roadmap(req):
+    topic = req.get("topic", "Machine Learning")
+    response_body = await roadmap.create_roadmap_async(
+        topic=topic,
+        time=req.get("time", "4 weeks"),
+        knowledge_level=req.get("knowledge_level", "Absoulte Beginner"),
+    )
+    prefetch.roadmap_quizzes(topic, response_body)
+    return 200, response_body
+
+
+async def generate_quiz(req):
+    course = req.get("course")
+    topic = req.get("topic")
+    subtopic = req.get("subtopic")
+    description = req.get("description")
+
+    if not (course and topic and subtopic and description):
+        return 400, "Required Fields not provided"
+
+    return 200, await quiz.get_quiz_async(course, topic, subtopic, description)
+
+
+async def generate_resource(req):
+    req_data, missing = base.parse_resource_request(req)
+    if missing:
+        return 400, f"Required field '{missing}' not provided"
+
+    resources = await generativeResources.generate_resources_async(**req_data)
+    if req_data["request_type"] != "structured_learning":
+        return 200, resources
+    doc_id = await asyncio.to_thread(base.store_document, req_data, resources)
+    return 200, resources, [(b"x-document-id", doc_id.encode()), (b"access-control-expose-headers", b"X-Document-Id")]
+
+
+ROUTES = {
+    "/api/roadmap": generate_roadmap,
+    "/api/quiz": generate_quiz,
+    "/api/generate-resource": generate_resource,
+}
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if not message.get("more_body"):
+            return body
+
+
+async def respond(send, status, body, headers=(), encoding=None):
+    if isinstance(body, str):
+        content_type, payload = b"text/html; charset=utf-8", body.encode()
+    else:
+        content_type, payload = b"application/json", json.dumps(body).encode()
+    headers = [*headers, (b"vary", b"Accept-Encoding")]
+    if encoding and len(payload) >= compression.COMPRESS_MIN_SIZE:
+        payload = compression.compress_bytes(payload, encoding)
+        headers.append((b"content-encoding", encoding.encode()))
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [
+            (b"content-type", content_type),
+            (b"content-length", str(len(payload)).encode()),
+            (b"access-control-allow-origin", b"*"),
+            *headers,
+        ],
+    })
+    await send({"type": "http.response.body", "body": payload})
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message["type"] == "lifespan.startup":
+            await send({"type": "lifespan.startup.complete"})
+        elif message["type"] == "lifespan.shutdown":
+            await send({"type": "lifespan.shutdown.complete"})
+            return
+
+
+async def app(scope, receive, send):
+    if scope["type"] == "lifespan":
+        return await lifespan(receive, send)
+
+    handler = None
+    if scope["type"] == "http" and scope["method"] == "POST":
+        handler = ROUTES.get(scope["path"])
+    if handler is None:
+        return await flask_app(scope, receive, send)
+
+    # The same histogram as Flask's record_latency, which these routes bypass
+    start = time.perf_counter()
+    response = {"status": 500}  # if the handler fails before answering
+
+    async def send_and_record(message):
+        if message["type"] == "http.response.start":
+            response["status"] = message["status"]
+        await send(message)
+
+    served = None
+    try:
+        served = await serve(scope, receive, send_and_record, handler)
+    finally:
+        if served is not False:
+            metrics.observe(
+                "http_request_seconds", time.perf_counter() - start,
+                endpoint=scope["path"], method=scope["method"], status=response["status"],
+            )
+
+
+async def serve(scope, receive, send, handler):
+    """Answer one generation request, returns False if it was handed to Flask"""
+    global _slots
+    body = await read_body(receive)
+    try:
+        req = json.loads(body or b"{}")
+    except ValueError:
+        return await respond(send, 400, {"error": "Invalid JSON body"})
+    if not isinstance(req, dict):
+        return await respond(send, 400, {"error": "The JSON body must be an object"})
+
+    headers = dict(scope["headers"])
+    if (
+        req.get("stream") or req.get("async")
+        or b"text/event-stream" in headers.get(b"accept", b"")
+        or b"respond-async" in headers.get(b"prefer", b"")
+    ):
+        # Streaming responses and background jobs stay on the Flask
+        # implementation. The body has already been read, so hand it over again.
+        async def replay():
+            return {"type": "http.request", "body": body, "more_body": False}
+        await flask_app(scope, replay, send)
+        return False
+
+    if base.check_expiration():
+        with base.api.app_context():
+            response, status = base.before_request()
+            return await respond(send, status, response.get_json())
+
+    if _slots is None:
+        _slots = asyncio.Semaphore(ASYNC_MAX_CONCURRENCY)
+
+    try:
+        client = sessions.authenticated_email(
+            headers.get(b"authorization", b"").decode(), headers.get(b"user-email", b"").decode(),
+        ) or (scope.get("client") or ("unknown",))[0]
+        ratelimit.users.check(client)
+        # Waiting for a slot counts against the same timeout as the generation
+        deadline = asyncio.get_running_loop().time() + LLM_TIMEOUT
+        await asyncio.wait_for(_slots.acquire(), LLM_TIMEOUT)
+        try:
+            remaining = deadline - asyncio.get_running_loop().time()
+            status, result, *extra_headers = await asyncio.wait_for(handler(req), max(remaining, 0.001))
+        finally:
+            _slots.release()
+    except (ratelimit.RateLimited, resilience.UpstreamUnavailable) as e:
+        retry_after = math.ceil(e.retry_after)
+        return await respond(
+            send, 429 if isinstance(e, ratelimit.RateLimited) else 503,
+            {"error": str(e), "retry_after": retry_after},
+            [(b"retry-after", str(retry_after).encode())],
+        )
+    except asyncio.TimeoutError:
+        return await respond(send, 504, {"error": "Generation timed out"})
+    except Exception as e:
+        print(f"Generation error on {scope['path']}: {e}")
+        return await respond(send, 500, {"error": str(e)})
+
+    encoding = compression.choose_encoding(headers.get(b"accept-encoding", b"").decode())
+    await respond(send, status, result, *extra_headers, encoding=encoding)
@@ -1,21 +1,49 @@
-from flask import Flask, request, jsonify
+import config  # loads .env before the modules below read their settings
+from flask import Flask, Response, g, request, jsonify, stream_with_context, url_for
 import roadmap
 import quiz
 import generativeResources
+import jobs
+import storage
+from history import LOGIN_HISTORY_LIMIT, history, parse_time
+import cache
+import compression
+import prefetch
+import ratelimit
+import resilience
+import sessions
+import metrics
+import streaming
+import translation
+import topics
+from documents import documents
 from flask_cors import CORS
+import gemini
+import hashlib
 import json
-import os
+import math
+import time
 from datetime import datetime, date
-import google.generativeai as genai
-from dotenv import load_dotenv
-
-load_dotenv()
+from functools import wraps
 
 api = Flask(__name__)
-CORS(api)
+CORS(api, expose_headers=["X-Document-Id", "Location", "Retry-After"])
+
+# Build the model handles in the background so the first generations don't
+# pay for loading the SDK, without holding up startup
+if config.GEMINI_WARMUP != "0":
+    gemini.warm_up(
+        roadmap.get_model,
+        quiz.get_model,
+        lambda: generativeResources.get_model("basic"),
+        lambda: generativeResources.get_model("structured_learning"),
+        translation.get_model,
+        connect=config.GEMINI_WARMUP == "1",
+        background=True,
+    )
 
-# Configure Gemini for translation
-genai.configure(api_key=os.environ.get("GEMINI_API_KEY"))
+# Run the background jobs queued by this or a previous run, see jobs.py
+jobs.queue.start()
 
 # Project expiration date - app will not work after this date
 EXPIRATION_DATE = date(2025, 12, 31)  # December 31, 2025
@@ -27,6 +55,25 @@ def check_expiration():
         return True
     return False
 
+@api.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@api.after_request
+def record_latency(response):
+    # For streamed responses this is the time to the first byte
+    if "request_start" in g:
+        endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.observe(
+            "http_request_seconds", time.perf_counter() - g.request_start,
+            endpoint=endpoint, method=request.method, status=response.status_code,
+        )
+    return response
+
+@api.after_request
+def compress_response(response):
+    return compression.compress(response, request)
+
 # Add before_request hook to check expiration on every API call
 @api.before_request
 def before_request():
@@ -37,18 +84,44 @@ def before_request():
             "expired": True
         }), 403
 
-# Simple file-based user storage for demo purposes
-USERS_FILE = 'users.json'
-
-def load_users():
-    if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-def save_users(users):
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
+def current_email():
+    """Email of the signed-in user, see sessions.py"""
+    return sessions.authenticated_email(request.headers.get("Authorization"), request.headers.get("user-email"))
+
+def login_required(view):
+    """Only for requests with a valid session, see sessions.py"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not current_email():
+            return jsonify({"error": "Unauthorized"}), 401
+        return view(*args, **kwargs)
+    return wrapper
+
+def rate_limit_key():
+    return current_email() or request.remote_addr
+
+def rate_limited(view):
+    """Per-client request limit for the endpoints that call Gemini"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        ratelimit.users.check(rate_limit_key())
+        return view(*args, **kwargs)
+    return wrapper
+
+@api.errorhandler(ratelimit.RateLimited)
+def handle_rate_limited(e):
+    response = jsonify({"error": str(e), "retry_after": math.ceil(e.retry_after)})
+    response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+    return response, 429
+
+@api.errorhandler(resilience.UpstreamUnavailable)
+def handle_upstream_unavailable(e):
+    response = jsonify({"error": str(e), "retry_after": math.ceil(e.retry_after)})
+    response.headers["Retry-After"] = str(math.ceil(e.retry_after))
+    return response, 503
+
+# Per-user keyed storage, see storage.py for the available backends
+users = storage.get_store()
 
 @api.route("/api/auth/register", methods=["POST"])
 def register():
@@ -60,12 +133,7 @@ def register():
     if not email or not password:
         return jsonify({"error": "Email and password required"}), 400
     
-    users = load_users()
-    
-    if email in users:
-        return jsonify({"error": "User already exists"}), 400
-    
-    users[email] = {
+    user = {
         "name": name,
         "password": password,  # In production, hash this!
         "created_at": datetime.now().isoformat(),
@@ -76,10 +144,12 @@ def register():
         }
     }
     
-    save_users(users)
+    if not users.create(email, user):
+        return jsonify({"error": "User already exists"}), 400
     
     return jsonify({
         "message": "User registered successfully",
+        "token": sessions.issue(email),
         "user": {
             "email": email,
             "name": name
@@ -95,30 +165,22 @@ def login():
     if not email or not password:
         return jsonify({"error": "Email and password required"}), 400
     
-    users = load_users()
+    user = users.get(email)
     
-    if email not in users or users[email]["password"] != password:
+    if user is None or user["password"] != password:
         return jsonify({"error": "Invalid credentials"}), 401
     
-    # Track login history
-    user = users[email]
-    if "login_history" not in user:
-        user["login_history"] = []
-    
+    # Track login history, the history store keeps the last 50 logins
     login_record = {
         "timestamp": datetime.now().isoformat(),
         "ip": request.remote_addr,
         "user_agent": request.headers.get('User-Agent', 'Unknown')
     }
-    user["login_history"].append(login_record)
-    
-    # Keep only last 50 login records
-    user["login_history"] = user["login_history"][-50:]
-    
-    save_users(users)
+    history.add_login(email, login_record)
     
     return jsonify({
         "message": "Login successful",
+        "token": sessions.issue(email),
         "user": {
             "email": email,
             "name": user["name"],
@@ -129,35 +191,51 @@ def login():
 
 @api.route("/api/auth/profile", methods=["GET"])
 def get_profile():
-    # In a real app, you'd validate JWT token here
-    email = request.headers.get("user-email")  # Simple demo approach
+    email = current_email()
     
     if not email:
         return jsonify({"error": "Unauthorized"}), 401
     
-    users = load_users()
+    user = users.get(email)
     
-    if email not in users:
+    if user is None:
         return jsonify({"error": "User not found"}), 404
     
-    user = users[email]
-    return jsonify({
+    etag = record_etag("profile", email, user.get("version", 0))
+    cached = compression.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    
+    return compression.with_etag(jsonify({
         "email": email,
         "name": user["name"],
         "profile": user.get("profile", {})
-    })
+    }), etag)
+
+def record_etag(*parts):
+    """Strong ETag for a response built from the given versions"""
+    return hashlib.blake2b("|".join(map(str, parts)).encode(), digest_size=12).hexdigest()
 
 # Admin endpoint to check user statistics
+ADMIN_PAGE_SIZE = 100
+ADMIN_MAX_PAGE_SIZE = 1000
+EXPORT_CHUNK_SIZE = 500
+
 @api.route("/api/admin/users", methods=["GET"])
 def get_user_stats():
-    users = load_users()
-    total_users = len(users)
+    """One page of users (newest first) plus the platform totals, ?limit=&after=<cursor>"""
+    limit = min(request.args.get("limit", ADMIN_PAGE_SIZE, type=int), ADMIN_MAX_PAGE_SIZE)
+    after = request.args.get("after")
+    
+    try:
+        page, next_cursor = users.page(max(limit, 1), after)
+    except (ValueError, TypeError):
+        return jsonify({"error": "Invalid cursor"}), 400
     
-    # Calculate statistics
     user_stats = []
-    for email, user_data in users.items():
+    for user_data in page:
         user_stats.append({
-            "email": email,
+            "email": user_data["email"],
             "name": user_data.get("name", ""),
             "password": user_data.get("password", ""),
             "created_at": user_data.get("created_at", ""),
@@ -166,39 +244,152 @@ def get_user_stats():
             "achievements": len(user_data.get("profile", {}).get("achievements", []))
         })
     
-    # Sort by creation date (newest first)
-    user_stats.sort(key=lambda x: x["created_at"], reverse=True)
+    # Totals are maintained by the store on every write
+    summary = users.summary()
+    total_users = summary.pop("total_users")
     
     return jsonify({
         "total_users": total_users,
         "users": user_stats,
-        "summary": {
-            "total_learning_hours": sum(user["learning_hours"] for user in user_stats),
-            "total_courses_completed": sum(user["courses_completed"] for user in user_stats),
-            "total_achievements": sum(user["achievements"] for user in user_stats)
-        }
+        "next_cursor": next_cursor,
+        "summary": summary
     })
 
+def with_history(email, user):
+    """A user record with the history kept in history.db, as it was stored before"""
+    return dict(
+        user,
+        # Lists still in the record haven't been imported yet and are older
+        quiz_history=(user.get("quiz_history") or []) + history.quiz_history(email),
+        quiz_daily=history.quiz_daily(email),
+        login_history=((user.get("login_history") or []) + history.login_history(email))[-LOGIN_HISTORY_LIMIT:],
+    )
+
 @api.route("/api/admin/users/export", methods=["GET"])
 def export_users():
-    users = load_users()
-    return jsonify(users)
+    """
+    Stream the whole store as one JSON object without building it in memory.
+    Each user's quiz and login history is merged back in from history.db.
+    """
+    def generate():
+        yield "{"
+        chunk, separator = [], ""
+        for email, user in users.all():
+            chunk.append(f"{json.dumps(email)}: {json.dumps(with_history(email, user))}")
+            if len(chunk) == EXPORT_CHUNK_SIZE:
+                yield separator + ", ".join(chunk)
+                chunk, separator = [], ", "
+        if chunk:
+            yield separator + ", ".join(chunk)
+        yield "}"
+    
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+@api.route("/api/health", methods=["GET"])
+def health():
+    """Readiness check, answers without loading the Gemini SDK"""
+    return jsonify({
+        "status": "ok",
+        "uptime": round(time.time() - config.STARTED_AT, 3),
+        "gemini": dict(gemini.status(), circuit=resilience.breaker.get_stats()["state"]),
+    })
+
+
+@api.route("/api/metrics", methods=["GET"])
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    stats = cache.generations.get_stats()
+    for name in ("memory_hits", "disk_hits", "misses", "stores", "evictions"):
+        metrics.set_gauge(f"generation_cache_{name}", stats[name])
+    metrics.set_gauge("generation_cache_coalesced", stats["single_flight"]["coalesced"])
+    for name, value in ratelimit.scheduler.get_stats().items():
+        metrics.set_gauge(f"llm_scheduler_{name}", value)
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@api.route("/api/cache/stats", methods=["GET"])
+def get_cache_stats():
+    """Hit/miss counters for the Gemini generation cache and the quiz prefetcher"""
+    return jsonify(dict(
+        cache.generations.get_stats(),
+        prefetch=prefetch.get_stats(),
+        scheduler=ratelimit.scheduler.get_stats(),
+        circuit=resilience.breaker.get_stats(),
+        topics=topics.index.get_stats(),
+        jobs=jobs.queue.get_stats(),
+    ))
+
+
+def roadmap_events(topic, time, knowledge_level):
+    try:
+        for text in roadmap.stream_roadmap(topic, time, knowledge_level):
+            yield streaming.sse_event("chunk", {"text": text})
+    except Exception as e:
+        yield streaming.sse_event("error", {"error": str(e)})
+        return
+    yield streaming.sse_event("done", {})
+
+
+JOB_RETRY_AFTER = 2  # seconds, suggested polling interval
+
+def wants_job(req):
+    """Background generation is opted into with "async": true or a Prefer: respond-async header"""
+    return bool(req.get("async")) or "respond-async" in request.headers.get("Prefer", "")
+
+
+def submit_job(kind, params, req):
+    """Queue a generation and answer 202 with where to poll for it"""
+    callback_url = req.get("callback_url")
+    if callback_url and not jobs.callback_allowed(callback_url):
+        return jsonify({"error": "callback_url is not on the allowed callback hosts"}), 400
+    try:
+        job_id = jobs.queue.submit(kind, params, callback_url)
+    except jobs.QueueFull:
+        response = jsonify({"error": "Too many generations are waiting, please try again later"})
+        response.headers["Retry-After"] = str(JOB_RETRY_AFTER)
+        return response, 503
+    url = url_for("get_job", job_id=job_id)
+    response = jsonify({"id": job_id, "status": jobs.QUEUED, "url": url})
+    response.headers["Location"] = url
+    return response, 202
+
+
+@api.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Status of a background generation, with its result once it is done"""
+    job = jobs.queue.get(job_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    response = jsonify(job)
+    response.headers["Cache-Control"] = "no-store"
+    if job["status"] in (jobs.QUEUED, jobs.RUNNING):
+        response.headers["Retry-After"] = str(JOB_RETRY_AFTER)
+    return response
 
 
 @api.route("/api/roadmap", methods=["POST"])
+@rate_limited
 def get_roadmap():
     req = request.get_json()
+    topic = req.get("topic", "Machine Learning")
+    time = req.get("time", "4 weeks")
+    knowledge_level = req.get("knowledge_level", "Absoulte Beginner")
+
+    if streaming.wants_stream(req):
+        return streaming.sse_response(roadmap_events(topic, time, knowledge_level))
 
     response_body = roadmap.create_roadmap(
-        topic=req.get("topic", "Machine Learning"),
-        time=req.get("time", "4 weeks"),
-        knowledge_level=req.get("knowledge_level", "Absoulte Beginner"),
+        topic=topic,
+        time=time,
+        knowledge_level=knowledge_level,
     )
+    # Warm the cache with the quizzes the user is likely to open next
+    prefetch.roadmap_quizzes(topic, response_body)
 
     return response_body
 
 
 @api.route("/api/quiz", methods=["POST"])
+@rate_limited
 def get_quiz():
     req = request.get_json()
 
@@ -210,12 +401,72 @@ def get_quiz():
     if not (course and topic and subtopic and description):
         return "Required Fields not provided", 400
 
+    if wants_job(req):
+        params = {"course": course, "topic": topic, "subtopic": subtopic, "description": description}
+        return submit_job("quiz", params, req)
+
     print("getting quiz...")
     response_body = quiz.get_quiz(course, topic, subtopic, description)
     return response_body
 
 
+def quiz_batch_events(course, topic, subtopics):
+    failed = 0
+    for index, result, error in quiz.iter_quizzes(course, topic, subtopics):
+        item = {"index": index, "subtopic": subtopics[index]["subtopic"]}
+        if error is None:
+            yield streaming.sse_event("quiz", dict(item, quiz=result))
+        else:
+            failed += 1
+            yield streaming.sse_event("error", dict(item, error=str(error)))
+    yield streaming.sse_event("done", {"count": len(subtopics), "failed": failed})
+
+
+@api.route("/api/quiz/batch", methods=["POST"])
+def get_quiz_batch():
+    """
+    Quizzes for every subtopic of a roadmap week, generated concurrently.
+    Body: {course, topic, subtopics: [{subtopic, description}, ...]}.
+    Streams one "quiz" event per subtopic as it finishes when streaming is
+    requested, otherwise returns them all in subtopic order.
+    """
+    req = request.get_json()
+
+    course = req.get("course")
+    topic = req.get("topic")
+    subtopics = req.get("subtopics")
+
+    if not (course and topic and isinstance(subtopics, list) and subtopics):
+        return "Required Fields not provided", 400
+    if not all(isinstance(s, dict) and s.get("subtopic") and s.get("description") for s in subtopics):
+        return "Every subtopic needs a subtopic and a description", 400
+    if len(subtopics) > quiz.QUIZ_BATCH_MAX_SUBTOPICS:
+        return f"At most {quiz.QUIZ_BATCH_MAX_SUBTOPICS} subtopics per batch", 400
+
+    # One request fans out into a generation per subtopic, charge for each
+    ratelimit.users.check(rate_limit_key(), cost=len(subtopics))
+
+    print(f"getting {len(subtopics)} quizzes...")
+    if streaming.wants_stream(req):
+        return streaming.sse_response(quiz_batch_events(course, topic, subtopics))
+
+    quizzes = [None] * len(subtopics)
+    errors = []
+    for index, result, error in quiz.iter_quizzes(course, topic, subtopics):
+        item = {"subtopic": subtopics[index]["subtopic"]}
+        if error is None:
+            quizzes[index] = dict(item, quiz=result)
+        else:
+            errors.append(error)
+            quizzes[index] = dict(item, error=str(error))
+    if len(errors) == len(subtopics):
+        # Nothing to return, surface the failure like /api/quiz does
+        raise errors[0]
+    return jsonify({"quizzes": quizzes})
+
+
 @api.route("/api/translate", methods=["POST"])
+@rate_limited
 def get_translations():
     req = request.get_json()
 
@@ -226,46 +477,45 @@ def get_translations():
         return jsonify({"error": "Missing textArr or toLang parameters"}), 400
 
     try:
-        # Use Gemini for translation
-        model = genai.GenerativeModel(model_name="gemini-pro")
-        
-        # Join all texts with separator for batch translation
-        combined_text = "\n---SEPARATOR---\n".join(text_arr)
-        
-        prompt = f"""Translate the following text segments to {to_lang}. 
-Each segment is separated by '---SEPARATOR---'. 
-Return ONLY the translated segments, separated by the same '---SEPARATOR---' marker.
-Do not add any explanations, just the translations.
-
-Text to translate:
-{combined_text}"""
-        
-        response = model.generate_content(prompt)
-        translated_combined = response.text.strip()
-        
-        # Split back into array
-        translated_arr = translated_combined.split("---SEPARATOR---")
-        translated_arr = [t.strip() for t in translated_arr]
-        
-        # Ensure we have the same number of translations
-        if len(translated_arr) != len(text_arr):
-            # Fallback: translate individually
-            translated_arr = []
-            for text in text_arr:
-                resp = model.generate_content(f"Translate to {to_lang}: {text}")
-                translated_arr.append(resp.text.strip())
-        
-        print(f"Translated to {to_lang}: {len(translated_arr)} segments")
+        translated_arr = translation.translate(text_arr, to_lang)
         return jsonify({"translations": translated_arr})
         
+    except (ratelimit.RateLimited, resilience.UpstreamUnavailable):
+        raise
     except Exception as e:
         print(f"Translation error: {str(e)}")
         return jsonify({"error": f"Translation failed: {str(e)}"}), 500
 
 
-@api.route("/api/generate-resource", methods=["POST"])
-def generative_resource():
-    req = request.get_json()
+def resource_events(req_data):
+    chapters = streaming.ChapterDetector()
+    parts = []
+    try:
+        for text in generativeResources.stream_resources(**req_data):
+            parts.append(text)
+            yield streaming.sse_event("chunk", {"text": text})
+            if req_data["request_type"] == "structured_learning":
+                for chapter in chapters.feed(text):
+                    yield streaming.sse_event("chapter", chapter)
+    except Exception as e:
+        yield streaming.sse_event("error", {"error": str(e)})
+        return
+    done = {"chapters": chapters.count}
+    if req_data["request_type"] == "structured_learning":
+        for chapter in chapters.flush():
+            yield streaming.sse_event("chapter", chapter)
+        done = {"chapters": chapters.count, "document_id": store_document(req_data, "".join(parts))}
+    yield streaming.sse_event("done", done)
+
+
+def store_document(req_data, text):
+    return generativeResources.store_document(
+        req_data["course"], req_data["knowledge_level"], req_data["description"], req_data["time"], text,
+    )
+
+
+def parse_resource_request(req):
+    """Returns the generate_resources arguments and the first missing required field, if any"""
     req_data = {
         "course": False,
         "knowledge_level": False,
@@ -280,9 +530,24 @@ def generative_resource():
     required_fields = ["course", "knowledge_level", "description", "time"]
     for field in required_fields:
         if not req_data[field]:
-            return f"Required field '{field}' not provided", 400
+            return req_data, field
+    return req_data, None
+
+
+@api.route("/api/generate-resource", methods=["POST"])
+@rate_limited
+def generative_resource():
+    req = request.get_json()
+    req_data, missing = parse_resource_request(req)
+    if missing:
+        return f"Required field '{missing}' not provided", 400
             
     print(f"generative resources for {req_data['course']} with type {req_data['request_type']}")
+    if wants_job(req):
+        return submit_job("resource", req_data, req)
+    if streaming.wants_stream(req):
+        return streaming.sse_response(resource_events(req_data))
+
     resources = generativeResources.generate_resources(
         course=req_data['course'],
         knowledge_level=req_data['knowledge_level'],
@@ -290,7 +555,43 @@ def generative_resource():
         time=req_data['time'],
         request_type=req_data['request_type']
     )
-    return resources
+    response = api.make_response(resources)
+    if req_data['request_type'] == "structured_learning":
+        # The same document, addressable chapter by chapter under /api/resources/<id>
+        response.headers["X-Document-Id"] = store_document(req_data, resources)
+    return response
+
+
+@api.route("/api/resources/<doc_id>", methods=["GET"])
+def get_resource_document(doc_id):
+    """Table of contents of a stored structured_learning resource"""
+    document = documents.get(doc_id)
+    if document is None:
+        return jsonify({"error": "Document not found"}), 404
+    etag = "-".join(chapter["etag"][:8] for chapter in document["chapters"])
+    return compression.not_modified(request, etag) or compression.with_etag(jsonify(document), etag)
+
+
+@api.route("/api/resources/<doc_id>/chapters/<int:chapter_id>", methods=["GET"])
+def get_resource_chapter(doc_id, chapter_id):
+    """A single chapter, revalidated with If-None-Match"""
+    chapter = documents.chapter(doc_id, chapter_id)
+    if chapter is None:
+        return jsonify({"error": "Chapter not found"}), 404
+    return compression.not_modified(request, chapter["etag"]) or compression.with_etag(jsonify(chapter), chapter["etag"])
+
+
+@api.route("/api/resources/<doc_id>/chapters/<int:chapter_id>/regenerate", methods=["POST"])
+@login_required
+@rate_limited
+def regenerate_resource_chapter(doc_id, chapter_id):
+    """Generate one chapter again, leaving the rest of the document as it is"""
+    chapter = generativeResources.regenerate_chapter(doc_id, chapter_id)
+    if chapter is None:
+        return jsonify({"error": "Chapter not found"}), 404
+    response = jsonify(chapter)
+    response.set_etag(chapter["etag"])
+    return response
 
 
 # Progress Tracking Endpoints
@@ -304,14 +605,6 @@ def save_quiz_progress():
     if not email or not quiz_data:
         return jsonify({"error": "Email and quiz_data required"}), 400
     
-    users = load_users()
-    if email not in users:
-        return jsonify({"error": "User not found"}), 404
-    
-    user = users[email]
-    if "quiz_history" not in user:
-        user["quiz_history"] = []
-    
     quiz_record = {
         "timestamp": datetime.now().isoformat(),
         "course": quiz_data.get("course"),
@@ -320,14 +613,18 @@ def save_quiz_progress():
         "total": quiz_data.get("total"),
         "time_spent": quiz_data.get("time_spent", 0)
     }
-    user["quiz_history"].append(quiz_record)
     
-    # Update learning stats
-    profile = user.get("profile", {})
-    profile["learning_hours"] = profile.get("learning_hours", 0) + (quiz_record["time_spent"] / 60)
-    user["profile"] = profile
+    def record_quiz(user):
+        history.import_legacy(email, user)
+        
+        # Update learning stats
+        profile = user.get("profile", {})
+        profile["learning_hours"] = profile.get("learning_hours", 0) + (quiz_record["time_spent"] / 60)
+        user["profile"] = profile
     
-    save_users(users)
+    if users.update(email, record_quiz) is None:
+        return jsonify({"error": "User not found"}), 404
+    history.add_quiz(email, quiz_record)
     return jsonify({"message": "Quiz progress saved", "record": quiz_record})
 
 
@@ -341,16 +638,8 @@ def save_roadmap_progress():
     if not email or not roadmap_data:
         return jsonify({"error": "Email and roadmap_data required"}), 400
     
-    users = load_users()
-    if email not in users:
-        return jsonify({"error": "User not found"}), 404
-    
-    user = users[email]
-    if "roadmap_progress" not in user:
-        user["roadmap_progress"] = {}
-    
     roadmap_id = roadmap_data.get("roadmap_id", roadmap_data.get("topic", "unknown"))
-    user["roadmap_progress"][roadmap_id] = {
+    progress = {
         "updated_at": datetime.now().isoformat(),
         "topic": roadmap_data.get("topic"),
         "completed_subtopics": roadmap_data.get("completed_subtopics", []),
@@ -359,37 +648,62 @@ def save_roadmap_progress():
         "time_spent": roadmap_data.get("time_spent", 0)
     }
     
-    # Update learning stats
-    profile = user.get("profile", {})
-    profile["learning_hours"] = profile.get("learning_hours", 0) + (roadmap_data.get("time_spent", 0) / 60)
-    
-    # Check if roadmap completed
-    if roadmap_data.get("progress_percentage", 0) >= 100:
-        profile["courses_completed"] = profile.get("courses_completed", 0) + 1
-        achievements = profile.get("achievements", [])
-        if roadmap_data.get("topic") not in achievements:
-            achievements.append(roadmap_data.get("topic"))
-            profile["achievements"] = achievements
+    def record_roadmap(user):
+        user.setdefault("roadmap_progress", {})[roadmap_id] = progress
+        
+        # Update learning stats
+        profile = user.get("profile", {})
+        profile["learning_hours"] = profile.get("learning_hours", 0) + (roadmap_data.get("time_spent", 0) / 60)
+        
+        # Check if roadmap completed
+        if roadmap_data.get("progress_percentage", 0) >= 100:
+            profile["courses_completed"] = profile.get("courses_completed", 0) + 1
+            achievements = profile.get("achievements", [])
+            if roadmap_data.get("topic") not in achievements:
+                achievements.append(roadmap_data.get("topic"))
+                profile["achievements"] = achievements
+        
+        user["profile"] = profile
     
-    user["profile"] = profile
-    save_users(users)
-    return jsonify({"message": "Roadmap progress saved", "progress": user["roadmap_progress"][roadmap_id]})
+    if users.update(email, record_roadmap) is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify({"message": "Roadmap progress saved", "progress": progress})
 
 
 @api.route("/api/progress/<email>", methods=["GET"])
 def get_user_progress(email):
-    """Get all progress data for a user"""
-    users = load_users()
-    if email not in users:
+    """
+    Get all progress data for a user. Quiz history can be narrowed with
+    ?since=&until= (ISO dates or epoch seconds) and ?limit= for the latest N.
+    """
+    user = users.get(email)
+    if user is None:
         return jsonify({"error": "User not found"}), 404
     
-    user = users[email]
-    return jsonify({
-        "quiz_history": user.get("quiz_history", []),
+    if "quiz_history" in user or "login_history" in user:
+        # Records written before the history store still carry their lists
+        user = users.update(email, lambda user: history.import_legacy(email, user))
+    
+    try:
+        since = parse_time(request.args.get("since"))
+        until = parse_time(request.args.get("until"))
+    except ValueError:
+        return jsonify({"error": "since/until must be ISO dates or epoch seconds"}), 400
+    limit = request.args.get("limit", type=int)
+    
+    # Unchanged record and history: answer 304 without reading the history
+    etag = record_etag("progress", email, user.get("version", 0), *history.version(email), since, until, limit)
+    cached = compression.not_modified(request, etag)
+    if cached is not None:
+        return cached
+    
+    return compression.with_etag(jsonify({
+        "quiz_history": history.quiz_history(email, since, until, limit),
+        "quiz_daily": history.quiz_daily(email, since, until),
         "roadmap_progress": user.get("roadmap_progress", {}),
-        "login_history": user.get("login_history", [])[-10:],  # Last 10 logins
+        "login_history": history.login_history(email, 10),  # Last 10 logins
         "profile": user.get("profile", {})
-    })
+    }), etag)
 
 
 @api.route("/api/progress/update-learning-time", methods=["POST"])
@@ -402,17 +716,15 @@ def update_learning_time():
     if not email:
         return jsonify({"error": "Email required"}), 400
     
-    users = load_users()
-    if email not in users:
-        return jsonify({"error": "User not found"}), 404
+    def add_time(user):
+        profile = user.get("profile", {})
+        profile["learning_hours"] = profile.get("learning_hours", 0) + (minutes / 60)
+        user["profile"] = profile
     
-    user = users[email]
-    profile = user.get("profile", {})
-    profile["learning_hours"] = profile.get("learning_hours", 0) + (minutes / 60)
-    user["profile"] = profile
-    
-    save_users(users)
-    return jsonify({"message": "Learning time updated", "total_hours": profile["learning_hours"]})
+    user = users.update(email, add_time)
+    if user is None:
+        return jsonify({"error": "User not found"}), 404
+    return jsonify({"message": "Learning time updated", "total_hours": user["profile"]["learning_hours"]})
 
 
 if __name__ == "__main__":
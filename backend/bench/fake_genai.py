@@ -0,0 +1,127 @@
+"""
+Local stand-in for the google.generativeai SDK used by the benchmarks.
+
+install() registers a fake google.generativeai module before the backend is
+imported. Responses are shaped like the real ones (roadmap and quiz JSON,
+markdown resources, separated translations) and are returned after a
+configurable latency:
+
+FAKE_GEMINI_LATENCY       seconds per call (default 0.5)
+FAKE_GEMINI_OUTPUT_CHARS  approximate size of resource responses (default 8000)
+"""
+
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import types
+
+LATENCY = float(os.environ.get("FAKE_GEMINI_LATENCY", 0.5))
+OUTPUT_CHARS = int(os.environ.get("FAKE_GEMINI_OUTPUT_CHARS", 8000))
+STREAM_CHUNKS = 8
+
+calls = 0
+_lock = threading.Lock()
+
+
+def _roadmap():
+    return json.dumps({
+        f"week {week}": {
+            "topic": f"Topic {week}",
+            "subtopics": [
+                {"subtopic": f"Subtopic {week}.{i}", "time": "1 hour", "description": f"Learn part {i} of topic {week}"}
+                for i in range(1, 6)
+            ],
+        }
+        for week in range(1, 5)
+    })
+
+
+def _quiz():
+    return json.dumps({
+        "questions": [
+            {
+                "question": f"Question {i}?",
+                "options": ["A", "B", "C", "D"],
+                "answerIndex": str(i % 4),
+                "reason": "Because.",
+            }
+            for i in range(10)
+        ]
+    })
+
+
+def _resource():
+    chapter = "# Chapter\n" + "Lorem ipsum dolor sit amet. " * 20 + "\n"
+    return (chapter * (OUTPUT_CHARS // len(chapter) + 1))[:OUTPUT_CHARS]
+
+
+def _reply(model, prompt):
+    if "Text to translate:\n" in prompt:
+        return prompt.split("Text to translate:\n", 1)[1].upper()
+    if prompt.startswith("Translate to "):
+        return prompt.split(": ", 1)[1].upper()
+    instruction = model.system_instruction or ""
+    if "learning paths" in instruction:
+        return _roadmap()
+    if "quizzes" in instruction:
+        return _quiz()
+    return _resource()
+
+
+class _Usage:
+    def __init__(self, prompt, text):
+        self.prompt_token_count = len(prompt) // 4
+        self.candidates_token_count = len(text) // 4
+
+
+class _Response:
+    def __init__(self, prompt, text):
+        self.text = text
+        self.usage_metadata = _Usage(prompt, text)
+
+
+class GenerativeModel:
+    def __init__(self, model_name="gemini-pro", generation_config=None, safety_settings=None,
+                 system_instruction=None):
+        self.model_name = model_name
+        self.system_instruction = system_instruction
+
+    def _count(self):
+        global calls
+        with _lock:
+            calls += 1
+
+    def _stream(self, prompt, text):
+        size = len(text) // STREAM_CHUNKS + 1
+        for i in range(0, len(text), size):
+            time.sleep(LATENCY / STREAM_CHUNKS)
+            yield _Response(prompt, text[i:i + size])
+
+    def generate_content(self, prompt, stream=False, **kwargs):
+        self._count()
+        text = _reply(self, prompt)
+        if stream:
+            return self._stream(prompt, text)
+        time.sleep(LATENCY)
+        return _Response(prompt, text)
+
+    async def generate_content_async(self, prompt, **kwargs):
+        self._count()
+        await asyncio.sleep(LATENCY)
+        return _Response(prompt, _reply(self, prompt))
+
+
+def install():
+    """Register the fake SDK as google.generativeai"""
+    google = sys.modules.get("google") or types.ModuleType("google")
+    genai = types.ModuleType("google.generativeai")
+    genai.configure = lambda **kwargs: None
+    genai.get_model = lambda name: None
+    genai.GenerativeModel = GenerativeModel
+    google.generativeai = genai
+    sys.modules["google"] = google
+    sys.modules["google.generativeai"] = genai
+    os.environ.setdefault("GEMINI_API_KEY", "benchmark")
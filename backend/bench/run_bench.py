@@ -0,0 +1,297 @@
+"""
+Load test for the Flask API against a local Gemini stand-in.
+
+The app from base.py is served on a local port with the fake SDK from
+fake_genai.py and fresh databases in a temporary directory. At each
+concurrency level, client threads keep sending requests drawn from a
+weighted mix of endpoints for --duration seconds. The report shows
+p50/p95/p99 latency per endpoint, throughput, and how the size of the user
+store relates to the cost of writing to it.
+
+    cd backend
+    python bench/run_bench.py --mix mixed --levels 1,8,32 --duration 10
+    python bench/run_bench.py --store json --mix storage --levels 1,8,32,64
+
+Generation requests pick their topic from --topics distinct values, so a
+small number gives mostly cache hits and a large number mostly upstream
+calls. The client and user rate limits are lifted unless set in the
+environment. The demo expiration check is disabled for the run.
+"""
+
+import argparse
+import contextlib
+import http.client
+import io
+import json
+import os
+import random
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import date
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MIXES = {
+    "storage": {
+        "register": 10,
+        "login": 25,
+        "quiz_progress": 25,
+        "roadmap_progress": 15,
+        "learning_time": 10,
+        "progress": 15,
+    },
+    "generation": {
+        "roadmap": 35,
+        "quiz": 40,
+        "resource": 25,
+    },
+    "mixed": {
+        "register": 5,
+        "login": 15,
+        "quiz_progress": 15,
+        "roadmap_progress": 10,
+        "learning_time": 5,
+        "progress": 15,
+        "roadmap": 10,
+        "quiz": 15,
+        "resource": 10,
+    },
+}
+
+WRITE_OPS = ("register", "quiz_progress", "roadmap_progress", "learning_time")
+
+LEVELS = [1, 4, 16, 64]
+KNOWLEDGE_LEVELS = ["Absolute Beginner", "Beginner", "Intermediate", "Advanced"]
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of a sorted list"""
+    if not values:
+        return 0
+    return values[min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))]
+
+
+class Client:
+    """One simulated user with a keep-alive connection to the server"""
+
+    def __init__(self, port, topics):
+        self.port = port
+        self.topics = topics
+        self.conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+        self.email = None
+        self.password = "bench-password"
+
+    def request(self, method, path, body=None):
+        headers = {"Content-Type": "application/json"}
+        if self.email:
+            headers["user-email"] = self.email
+        try:
+            self.conn.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self.conn.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.conn.close()
+            self.conn = http.client.HTTPConnection("127.0.0.1", self.port, timeout=300)
+            return 0
+
+    def topic(self):
+        return f"Topic {random.randrange(self.topics)}"
+
+    def register(self):
+        self.email = f"bench-{uuid.uuid4().hex[:12]}@example.com"
+        return self.request("POST", "/api/auth/register", {
+            "email": self.email, "password": self.password, "name": "Bench User",
+        })
+
+    def login(self):
+        return self.request("POST", "/api/auth/login", {"email": self.email, "password": self.password})
+
+    def quiz_progress(self):
+        return self.request("POST", "/api/progress/quiz", {"email": self.email, "quiz_data": {
+            "course": self.topic(), "topic": "Basics", "score": random.randint(0, 10), "total": 10,
+            "time_spent": random.randint(1, 30),
+        }})
+
+    def roadmap_progress(self):
+        return self.request("POST", "/api/progress/roadmap", {"email": self.email, "roadmap_data": {
+            "topic": self.topic(), "completed_subtopics": ["Subtopic 1.1"], "current_week": 1,
+            "progress_percentage": random.choice([10, 50, 100]), "time_spent": random.randint(1, 60),
+        }})
+
+    def learning_time(self):
+        return self.request("POST", "/api/progress/update-learning-time", {"email": self.email, "minutes": 5})
+
+    def progress(self):
+        return self.request("GET", f"/api/progress/{self.email}")
+
+    def roadmap(self):
+        return self.request("POST", "/api/roadmap", {
+            "topic": self.topic(), "time": "4 weeks", "knowledge_level": random.choice(KNOWLEDGE_LEVELS),
+        })
+
+    def quiz(self):
+        return self.request("POST", "/api/quiz", {
+            "course": self.topic(), "topic": "Topic 1", "subtopic": "Subtopic 1.1",
+            "description": "Learn part 1 of topic 1",
+        })
+
+    def resource(self):
+        return self.request("POST", "/api/generate-resource", {
+            "course": self.topic(), "knowledge_level": random.choice(KNOWLEDGE_LEVELS),
+            "description": "Overview", "time": "2 hours",
+            "request_type": random.choice(["basic", "structured_learning"]),
+        })
+
+
+def run_level(port, concurrency, duration, mix, topics):
+    """Run one concurrency level, returns {op: [latencies]} and {op: errors}"""
+    ops, weights = zip(*mix.items())
+    latencies = {op: [] for op in ops}
+    errors = {op: 0 for op in ops}
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        client = Client(port, topics)
+        # Every simulated user starts with an account of its own
+        op = "register"
+        while True:
+            start = time.perf_counter()
+            status = getattr(client, op)()
+            elapsed = time.perf_counter() - start
+            with lock:
+                latencies.setdefault(op, []).append(elapsed)
+                if not 200 <= status < 300:
+                    errors[op] = errors.get(op, 0) + 1
+            if time.perf_counter() >= deadline:
+                break
+            op = random.choices(ops, weights)[0]
+        client.conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return latencies, errors
+
+
+def store_size(store):
+    """Bytes on disk used by the user store, including the SQLite WAL"""
+    paths = [store.path, store.path + "-wal"]
+    return sum(os.path.getsize(path) for path in paths if os.path.exists(path))
+
+
+def report(level, elapsed, latencies, errors, store, upstream_calls):
+    total = sum(len(values) for values in latencies.values())
+    writes = sorted(v for op in WRITE_OPS for v in latencies.get(op, []))
+    result = {
+        "concurrency": level,
+        "requests": total,
+        "throughput": total / elapsed,
+        "upstream_calls": upstream_calls,
+        "users": store.count(),
+        "store_bytes": store_size(store),
+        "write_mean_ms": 1000 * sum(writes) / len(writes) if writes else 0,
+        "write_p95_ms": 1000 * percentile(writes, 95),
+        "endpoints": {},
+    }
+    print(f"\nconcurrency {level}: {total} requests in {elapsed:.1f}s, {result['throughput']:.1f} req/s, "
+          f"{upstream_calls} upstream calls")
+    print(f"  {'endpoint':<18}{'count':>8}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for op, values in sorted(latencies.items()):
+        if not values:
+            continue
+        values.sort()
+        stats = {
+            "count": len(values),
+            "errors": errors.get(op, 0),
+            "p50_ms": 1000 * percentile(values, 50),
+            "p95_ms": 1000 * percentile(values, 95),
+            "p99_ms": 1000 * percentile(values, 99),
+        }
+        result["endpoints"][op] = stats
+        print(f"  {op:<18}{stats['count']:>8}{stats['errors']:>8}"
+              f"{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}{stats['p99_ms']:>10.1f}")
+    print(f"  user store: {result['users']} users, {result['store_bytes'] / 1024:.0f} KiB, "
+          f"write mean {result['write_mean_ms']:.1f} ms, p95 {result['write_p95_ms']:.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the API against a local Gemini stand-in")
+    parser.add_argument("--mix", choices=sorted(MIXES), default="mixed")
+    parser.add_argument("--levels", default=",".join(map(str, LEVELS)), help="comma separated client counts")
+    parser.add_argument("--duration", type=float, default=10, help="seconds per level")
+    parser.add_argument("--store", choices=["sqlite", "json"], default=os.environ.get("USER_STORE", "sqlite"))
+    parser.add_argument("--latency", type=float, default=0.5, help="fake Gemini seconds per call")
+    parser.add_argument("--output-chars", type=int, default=8000, help="fake resource response size")
+    parser.add_argument("--topics", type=int, default=1000, help="distinct generation topics")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--json", dest="json_path", help="also write the results to this file")
+    parser.add_argument("--verbose", action="store_true", help="show the app's output and errors")
+    parser.add_argument("--keep", action="store_true", help="keep the scratch directory with the databases")
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    json_path = os.path.abspath(args.json_path) if args.json_path else None
+
+    # Everything the app writes goes to a scratch directory
+    workdir = tempfile.mkdtemp(prefix="bench-")
+    os.chdir(workdir)
+    os.environ["USER_STORE"] = args.store
+    os.environ.setdefault("USER_REQUESTS_PER_MINUTE", "1000000000")
+    os.environ.setdefault("USER_BURST", "1000000000")
+    os.environ.setdefault("LLM_REQUESTS_PER_MINUTE", "1000000000")
+    os.environ.setdefault("LLM_TOKENS_PER_MINUTE", "1000000000000")
+    sys.path.insert(0, BACKEND_DIR)
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+    import fake_genai
+    fake_genai.LATENCY = args.latency
+    fake_genai.OUTPUT_CHARS = args.output_chars
+    fake_genai.install()
+
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    import base
+    base.EXPIRATION_DATE = date.max
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, base.api, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    print(f"store={args.store} mix={args.mix} latency={args.latency}s output={args.output_chars} chars "
+          f"topics={args.topics} workdir={workdir}")
+    results = []
+    for level in (int(level) for level in args.levels.split(",")):
+        calls = fake_genai.calls
+        start = time.perf_counter()
+        with contextlib.ExitStack() as output:
+            if not args.verbose:
+                output.enter_context(contextlib.redirect_stdout(io.StringIO()))
+                output.enter_context(contextlib.redirect_stderr(io.StringIO()))
+            latencies, errors = run_level(server.server_port, level, args.duration, MIXES[args.mix], args.topics)
+        elapsed = time.perf_counter() - start
+        results.append(report(level, elapsed, latencies, errors, base.users, fake_genai.calls - calls))
+
+    server.shutdown()
+    if not args.keep:
+        os.chdir(BACKEND_DIR)
+        shutil.rmtree(workdir, ignore_errors=True)
+    if json_path:
+        with open(json_path, "w") as f:
+            json.dump({"config": vars(args), "levels": results}, f, indent=2)
+        print(f"\nResults written to {json_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+Cold start benchmark for the API.
+
+Each run starts a fresh interpreter in an empty scratch directory, imports
+base.py and sends the first /api/health request, and with --generate the
+first roadmap request too. The median over --runs is reported for each
+GEMINI_WARMUP mode:
+
+    cd backend
+    python bench/startup_bench.py --runs 5
+    python bench/startup_bench.py --fake --generate
+
+--fake swaps in the local Gemini stand-in from fake_genai.py, which is
+needed for --generate without an API key but hides the cost of importing
+the real SDK.
+"""
+
+import argparse
+import json
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MODES = {"lazy": "0", "background": "", "connect": "1"}
+
+CHILD = """
+import time
+start = time.perf_counter()
+import json, sys
+from datetime import date
+sys.path[:0] = {paths!r}
+if {fake!r}:
+    import fake_genai
+    fake_genai.LATENCY = 0
+    fake_genai.install()
+import base
+base.EXPIRATION_DATE = date.max
+imported = time.perf_counter()
+client = base.api.test_client()
+client.get("/api/health")
+ready = time.perf_counter()
+result = {{"import": imported - start, "first_request": ready - start}}
+if {generate!r}:
+    client.post("/api/roadmap", json={{"topic": "Python", "time": "4 weeks", "knowledge_level": "Beginner"}})
+    result["first_generation"] = time.perf_counter() - start
+print(json.dumps(result))
+"""
+
+
+def run_once(mode, fake, generate):
+    workdir = tempfile.mkdtemp(prefix="startup-")
+    env = dict(os.environ, GEMINI_WARMUP=MODES[mode])
+    if fake:
+        env.setdefault("GEMINI_API_KEY", "benchmark")
+    script = CHILD.format(paths=[BACKEND_DIR, BENCH_DIR], fake=fake, generate=generate)
+    start = time.perf_counter()
+    try:
+        output = subprocess.run(
+            [sys.executable, "-c", script], cwd=workdir, env=env, capture_output=True, text=True, check=True,
+        ).stdout
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+    result = json.loads(output.strip().splitlines()[-1])
+    result["process"] = time.perf_counter() - start
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure API cold start time")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--modes", default="lazy,background", help=f"comma separated, from {', '.join(MODES)}")
+    parser.add_argument("--fake", action="store_true", help="use the local Gemini stand-in")
+    parser.add_argument("--generate", action="store_true", help="also time the first roadmap request")
+    args = parser.parse_args()
+
+    columns = ["import", "first_request"] + (["first_generation"] if args.generate else []) + ["process"]
+    print(f"{'mode':<12}" + "".join(f"{column + ' ms':>20}" for column in columns))
+    for mode in args.modes.split(","):
+        runs = [run_once(mode, args.fake, args.generate) for _ in range(args.runs)]
+        medians = [1000 * statistics.median(run[column] for run in runs) for column in columns]
+        print(f"{mode:<12}" + "".join(f"{median:>20.1f}" for median in medians))
+
+
+if __name__ == "__main__":
+    main()
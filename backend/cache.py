@@ -0,0 +1,240 @@
+"""
+Shared cache for Gemini generations.
+
+Entries are keyed on a hash of the normalized prompt inputs together with the
+model name, generation config and system instruction, so identical requests
+(e.g. "Python Programming / 4 weeks / Beginner") are answered from the cache
+instead of waiting on the API. Lookups go through a small in-process LRU
+first and then an on-disk SQLite tier that survives restarts. Concurrent
+misses for the same key are coalesced into a single upstream call. Expired
+rows stay on disk until they are replaced or trimmed, and are served when
+generating a fresh value fails, e.g. while the Gemini circuit breaker is
+open (see resilience.py).
+
+A generation whose JSON was cut back from a truncated response (see
+llmjson.py) is missing part of its content. generate() returns it wrapped
+in Partial and it is kept for CACHE_PARTIAL_TTL only, so the next request
+after that asks Gemini again instead of serving the short answer for days.
+"""
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import sqlite_util
+from singleflight import SingleFlight
+
+CACHE_TTL = int(os.environ.get("CACHE_TTL", 7 * 24 * 3600))  # seconds
+CACHE_PARTIAL_TTL = int(os.environ.get("CACHE_PARTIAL_TTL", 3600))  # seconds, for repaired truncated output
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", 1000))
+CACHE_DISK_MAX_ENTRIES = int(os.environ.get("CACHE_DISK_MAX_ENTRIES", 50000))
+CACHE_DB = os.environ.get("CACHE_DB", "cache.db")
+
+
+def normalize(value):
+    """Normalize prompt inputs so trivially different requests share a key"""
+    if isinstance(value, str):
+        return " ".join(value.split()).casefold()
+    if isinstance(value, dict):
+        return {k: normalize(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [normalize(v) for v in value]
+    return value
+
+
+def make_key(kind, model_name, generation_config, system_instruction="", **inputs):
+    """Content address for a generation request"""
+    payload = json.dumps(
+        {
+            "kind": kind,
+            "model": model_name,
+            "config": generation_config,
+            "system_instruction": hashlib.sha256(system_instruction.encode()).hexdigest(),
+            "inputs": normalize(inputs),
+        },
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+class Partial:
+    """A generated value that is incomplete, cached for CACHE_PARTIAL_TTL"""
+
+    def __init__(self, value):
+        self.value = value
+
+
+class GenerationCache:
+    """Two tier (memory + SQLite) cache with TTL and LRU eviction"""
+
+    def __init__(self, path=CACHE_DB, ttl=CACHE_TTL, max_entries=CACHE_MAX_ENTRIES,
+                 disk_max_entries=CACHE_DISK_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_max_entries = disk_max_entries
+        self.memory = OrderedDict()  # key -> (stored_at, value, ttl)
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "stale_hits": 0, "stores": 0, "evictions": 0}
+        self.flights = SingleFlight()
+        if self.path:
+            self._connect().execute(
+                """
+                CREATE TABLE IF NOT EXISTS generations (
+                    key TEXT PRIMARY KEY,
+                    value TEXT NOT NULL,
+                    stored_at REAL NOT NULL,
+                    accessed_at REAL NOT NULL,
+                    ttl REAL
+                )
+                """
+            )
+            columns = [row[1] for row in self._connect().execute("PRAGMA table_info(generations)")]
+            if "ttl" not in columns:
+                self._connect().execute("ALTER TABLE generations ADD COLUMN ttl REAL")
+
+    def _connect(self):
+        return sqlite_util.connect(self.path, self.local)
+
+    def _count(self, stat):
+        with self.lock:
+            self.stats[stat] += 1
+
+    def _remember(self, key, stored_at, value, ttl=None):
+        with self.lock:
+            self.memory[key] = (stored_at, value, ttl)
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_entries:
+                self.memory.popitem(last=False)
+                self.stats["evictions"] += 1
+
+    def get(self, key, count_miss=True):
+        """
+        Return the cached value for key, or None. count_miss=False is for
+        speculative lookups that are followed by the real one, so a single
+        request doesn't count two misses.
+        """
+        now = time.time()
+        with self.lock:
+            entry = self.memory.get(key)
+            if entry is not None:
+                if now - entry[0] < (entry[2] or self.ttl):
+                    self.memory.move_to_end(key)
+                    self.stats["memory_hits"] += 1
+                    return entry[1]
+                del self.memory[key]
+
+        if self.path:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, stored_at, ttl FROM generations WHERE key = ?", (key,)
+            ).fetchone()
+            if row is not None:
+                if now - row[1] < (row[2] or self.ttl):
+                    conn.execute("UPDATE generations SET accessed_at = ? WHERE key = ?", (now, key))
+                    value = json.loads(row[0])
+                    self._remember(key, row[1], value, row[2])
+                    self._count("disk_hits")
+                    return value
+
+        if count_miss:
+            self._count("misses")
+        return None
+
+    def get_stale(self, key):
+        """Return the value for key even if it has expired, or None"""
+        with self.lock:
+            entry = self.memory.get(key)
+        if entry is not None:
+            value = entry[1]
+        elif self.path:
+            row = self._connect().execute("SELECT value FROM generations WHERE key = ?", (key,)).fetchone()
+            value = json.loads(row[0]) if row is not None else None
+        else:
+            value = None
+        if value is not None:
+            self._count("stale_hits")
+        return value
+
+    def set(self, key, value, ttl=None):
+        """Store value for key, for ttl seconds instead of the cache's TTL if given"""
+        now = time.time()
+        self._remember(key, now, value, ttl)
+        with self.lock:
+            self.stats["stores"] += 1
+            trim = self.stats["stores"] % 100 == 0
+        if self.path:
+            conn = self._connect()
+            conn.execute(
+                "INSERT OR REPLACE INTO generations (key, value, stored_at, accessed_at, ttl) VALUES (?, ?, ?, ?, ?)",
+                (key, json.dumps(value), now, now, ttl),
+            )
+            # Trim the least recently used rows once the disk tier is full
+            if trim:
+                conn.execute(
+                    """
+                    DELETE FROM generations WHERE key IN (
+                        SELECT key FROM generations ORDER BY accessed_at DESC LIMIT -1 OFFSET ?
+                    )
+                    """,
+                    (self.disk_max_entries,),
+                )
+
+    def get_or_create(self, key, generate):
+        """
+        Return the cached value for key, calling generate() on a miss.
+        Concurrent misses for the same key share one generate() call.
+        generate() may return a Partial, which is cached for a short time.
+        """
+        value = self.get(key)
+        if value is None:
+            try:
+                value = self.flights.do(key, lambda: self._create(key, generate()))
+            except Exception:
+                value = self.get_stale(key)
+                if value is None:
+                    raise
+        return value
+
+    async def get_or_create_async(self, key, generate):
+        """
+        Same as get_or_create, generate is a coroutine function. The SQLite
+        reads and writes run on a thread so they don't block the event loop.
+        """
+        value = await asyncio.to_thread(self.get, key)
+        if value is None:
+            async def create():
+                value = await generate()
+                return await asyncio.to_thread(self._create, key, value)
+            try:
+                value = await self.flights.do_async(key, create)
+            except Exception:
+                value = await asyncio.to_thread(self.get_stale, key)
+                if value is None:
+                    raise
+        return value
+
+    def _create(self, key, value):
+        if isinstance(value, Partial):
+            self.set(key, value.value, ttl=CACHE_PARTIAL_TTL)
+            return value.value
+        self.set(key, value)
+        return value
+
+    def get_stats(self):
+        with self.lock:
+            stats = dict(self.stats)
+            stats["memory_entries"] = len(self.memory)
+        hits = stats["memory_hits"] + stats["disk_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["single_flight"] = self.flights.get_stats()
+        return stats
+
+
+generations = GenerationCache()
@@ -0,0 +1,155 @@
+"""
+Response compression and conditional requests.
+
+Progress records, the admin export and generated resources are large JSON
+bodies of repetitive text. compress() runs after every Flask request and,
+when the client accepts it, encodes bodies of at least COMPRESS_MIN_SIZE
+bytes with brotli (if the brotli package is installed) or gzip. Streamed
+JSON such as the admin export is compressed as it is sent; server-sent
+events are left alone so every event still reaches the client at once.
+
+A compressed response is a different representation, so its strong ETag
+gets the encoding appended ("<etag>-gzip"). not_modified() accepts either
+form in If-None-Match, so a client revalidates whichever one it was sent.
+"""
+
+import gzip
+import os
+import zlib
+
+from flask import Response
+
+try:
+    import brotli
+except ImportError:  # optional, smaller than gzip at the same speed
+    brotli = None
+
+COMPRESS_MIN_SIZE = int(os.environ.get("COMPRESS_MIN_SIZE", 1024))  # bytes
+COMPRESS_LEVEL = int(os.environ.get("COMPRESS_LEVEL", 6))  # gzip, 1-9
+BROTLI_QUALITY = int(os.environ.get("BROTLI_QUALITY", 5))  # 0-11, higher is slow for live responses
+
+# text/event-stream is deliberately missing, see above
+COMPRESSIBLE_TYPES = ("application/json", "text/plain", "text/markdown", "text/html", "text/csv")
+
+
+def supported_encodings():
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def choose_encoding(accept_encoding):
+    """Best supported encoding for an Accept-Encoding header, None for identity"""
+    weights = {}
+    for part in (accept_encoding or "").split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        if name:
+            weights[name.strip().lower()] = q
+    best, best_q = None, 0.0
+    # br is listed first, so it wins a tie with gzip
+    for encoding in supported_encodings():
+        q = weights.get(encoding, weights.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def compress_bytes(data, encoding):
+    if encoding == "br":
+        return brotli.compress(data, quality=BROTLI_QUALITY)
+    return gzip.compress(data, COMPRESS_LEVEL)
+
+
+class _Encoder:
+    """Incremental compressor with the same interface for gzip and brotli"""
+
+    def __init__(self, encoding):
+        if encoding == "br":
+            compressor = brotli.Compressor(quality=BROTLI_QUALITY)
+            self.compress, self.flush = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, 31)  # 31: gzip container
+            self.compress, self.flush = compressor.compress, compressor.flush
+
+
+def _compress_stream(chunks, encoding, charset="utf-8"):
+    encoder = _Encoder(encoding)
+    try:
+        for chunk in chunks:
+            data = encoder.compress(chunk.encode(charset) if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield encoder.flush()
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+
+
+def _tag_etag(response, encoding):
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+
+
+def compress(response, request):
+    """Compress a response in place if the client and the content allow it"""
+    if (
+        response.status_code < 200
+        or response.status_code in (204, 206, 304)
+        or "Content-Encoding" in response.headers
+        or "no-transform" in response.headers.get("Cache-Control", "")
+        or request.method == "HEAD"
+        or not response.mimetype.startswith(COMPRESSIBLE_TYPES)
+    ):
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = choose_encoding(request.headers.get("Accept-Encoding"))
+    if encoding is None:
+        return response
+
+    if response.is_streamed:
+        response.response = _compress_stream(response.response, encoding)
+        response.direct_passthrough = False
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < COMPRESS_MIN_SIZE:
+            return response
+        compressed = compress_bytes(data, encoding)
+        if len(compressed) >= len(data):
+            return response
+        response.set_data(compressed)
+    response.headers["Content-Encoding"] = encoding
+    _tag_etag(response, encoding)
+    return response
+
+
+def not_modified(request, etag):
+    """
+    A 304 response if If-None-Match already has this version of the
+    resource in any encoding, otherwise None.
+    """
+    if not request.if_none_match:
+        return None
+    for candidate in (etag, *(f"{etag}-{encoding}" for encoding in ("br", "gzip"))):
+        if request.if_none_match.contains(candidate):
+            response = Response(status=304)
+            response.set_etag(candidate)
+            response.vary.add("Accept-Encoding")
+            response.headers["Cache-Control"] = "no-cache"
+            return response
+    return None
+
+
+def with_etag(response, etag):
+    """Set a strong ETag, clients revalidate it on every use"""
+    response.set_etag(etag)
+    response.headers.setdefault("Cache-Control", "no-cache")
+    return response
@@ -0,0 +1,20 @@
+"""
+Process-wide configuration, imported first by every entry point.
+
+Settings are read from the environment, with a .env file in the working
+directory loaded once here. The modules that read their settings at import
+time rely on this having run first.
+"""
+
+import os
+import time
+
+from dotenv import load_dotenv
+
+STARTED_AT = time.time()
+
+load_dotenv()
+
+# "0" builds the Gemini models on first use, "1" also opens the API
+# connection ahead of time. By default the models are built in the background.
+GEMINI_WARMUP = os.environ.get("GEMINI_WARMUP", "")
@@ -0,0 +1,191 @@
+"""
+Chapter-addressable storage for structured_learning resources.
+
+A structured_learning resource is one long markdown document with a level-one
+header ("# Title") per chapter. When one is generated it is also stored here
+split into its chapters, so clients can load the table of contents, fetch a
+single chapter (with an ETag to revalidate) and regenerate one chapter
+without resending or regenerating the whole document.
+
+Document ids are derived from the resource cache key, so the same request
+always maps to the same document. Regenerating a chapter also rewrites the
+cached resource, so storing the cached text again changes nothing. Once
+the cache entry expires and the resource is generated anew, storing it
+replaces the chapters, and changed chapters get a new ETag and version.
+"""
+
+import hashlib
+import os
+import threading
+import time
+
+import sqlite_util
+from streaming import CHAPTER_HEADER
+
+DOCUMENTS_DB = os.environ.get("DOCUMENTS_DB", "documents.db")
+
+
+def document_id(resource_key):
+    return resource_key[:16]
+
+
+def chapter_etag(body):
+    return hashlib.sha256(body.encode()).hexdigest()[:32]
+
+
+def split_chapters(text):
+    """
+    Split markdown into [(title, body)] on level-one headers outside code
+    blocks. Text before the first header is kept as an untitled chapter.
+    """
+    chapters = []
+    title, lines = "", []
+    in_code_block = False
+    for line in text.split("\n"):
+        if line.startswith("```"):
+            in_code_block = not in_code_block
+        match = None if in_code_block else CHAPTER_HEADER.match(line)
+        if match:
+            if title or "".join(lines).strip():
+                chapters.append((title, "\n".join(lines).strip("\n")))
+            title, lines = match.group(1).strip(), []
+        lines.append(line)
+    if title or "".join(lines).strip():
+        chapters.append((title, "\n".join(lines).strip("\n")))
+    return chapters
+
+
+class DocumentStore:
+    """Documents and their chapters in SQLite"""
+
+    def __init__(self, path=DOCUMENTS_DB):
+        self.path = path
+        self.local = threading.local()
+        self._connect().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS documents (
+                id TEXT PRIMARY KEY,
+                course TEXT,
+                knowledge_level TEXT,
+                description TEXT,
+                time TEXT,
+                created_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS chapters (
+                document_id TEXT NOT NULL,
+                position INTEGER NOT NULL,
+                title TEXT NOT NULL,
+                body TEXT NOT NULL,
+                etag TEXT NOT NULL,
+                version INTEGER NOT NULL DEFAULT 1,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (document_id, position)
+            );
+            """
+        )
+
+    def _connect(self):
+        return sqlite_util.connect(self.path, self.local)
+
+    def save(self, resource_key, text, course, knowledge_level, description, time_):
+        """Store a generated document, replacing its chapters if the text changed, returns its id"""
+        doc_id = document_id(resource_key)
+        chapters = split_chapters(text)
+        now = time.time()
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            stored = {
+                position: (title, body, version)
+                for position, title, body, version in conn.execute(
+                    "SELECT position, title, body, version FROM chapters WHERE document_id = ?", (doc_id,),
+                )
+            }
+            unchanged = len(stored) == len(chapters) and all(
+                stored[position][:2] == chapter for position, chapter in enumerate(chapters, 1)
+            )
+            if not unchanged:
+                conn.execute(
+                    "INSERT OR REPLACE INTO documents (id, course, knowledge_level, description, time, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (doc_id, course, knowledge_level, description, time_, now),
+                )
+                conn.execute("DELETE FROM chapters WHERE document_id = ?", (doc_id,))
+                rows = []
+                for position, (title, body) in enumerate(chapters, 1):
+                    old = stored.get(position)
+                    # Keep versions increasing, so a client never sees a version number twice
+                    version = 1 if old is None else old[2] if old[:2] == (title, body) else old[2] + 1
+                    rows.append((doc_id, position, title, body, chapter_etag(body), version, now))
+                conn.executemany(
+                    "INSERT INTO chapters (document_id, position, title, body, etag, version, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    rows,
+                )
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return doc_id
+
+    def get(self, doc_id):
+        """Document metadata with its table of contents, None if unknown"""
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT course, knowledge_level, description, time, created_at FROM documents WHERE id = ?",
+            (doc_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        toc = [
+            {"id": position, "title": title, "etag": etag, "version": version, "size": size}
+            for position, title, etag, version, size in conn.execute(
+                "SELECT position, title, etag, version, length(body) FROM chapters "
+                "WHERE document_id = ? ORDER BY position",
+                (doc_id,),
+            )
+        ]
+        course, knowledge_level, description, time_, created_at = row
+        return {
+            "id": doc_id,
+            "course": course,
+            "knowledge_level": knowledge_level,
+            "description": description,
+            "time": time_,
+            "created_at": created_at,
+            "chapters": toc,
+        }
+
+    def chapter(self, doc_id, position):
+        row = self._connect().execute(
+            "SELECT title, body, etag, version, updated_at FROM chapters WHERE document_id = ? AND position = ?",
+            (doc_id, position),
+        ).fetchone()
+        if row is None:
+            return None
+        title, body, etag, version, updated_at = row
+        return {
+            "id": position, "title": title, "body": body, "etag": etag,
+            "version": version, "updated_at": updated_at,
+        }
+
+    def text(self, doc_id):
+        """The whole document as one markdown text, as the chapters are now"""
+        rows = self._connect().execute(
+            "SELECT body FROM chapters WHERE document_id = ? ORDER BY position", (doc_id,),
+        )
+        return "\n\n".join(body for body, in rows)
+
+    def replace_chapter(self, doc_id, position, title, body):
+        """Store a regenerated chapter, returns the updated chapter or None"""
+        updated = self._connect().execute(
+            "UPDATE chapters SET title = ?, body = ?, etag = ?, version = version + 1, updated_at = ? "
+            "WHERE document_id = ? AND position = ?",
+            (title, body, chapter_etag(body), time.time(), doc_id, position),
+        ).rowcount
+        if not updated:
+            return None
+        return self.chapter(doc_id, position)
+
+
+documents = DocumentStore()
@@ -0,0 +1,181 @@
+"""
+Registry of Gemini model handles.
+
+The SDK (google.generativeai with protobuf and gRPC) is only imported and
+configured when the first model is built, so the API can start and answer
+requests that don't generate anything without paying for it. Every
+generator asks for its model through get_model(), which builds a GenerativeModel the first time a
+(model name, config, safety settings, system instruction) combination is
+seen and hands back the same object afterwards. All handles share the SDK's
+default client, so requests on every thread reuse one transport and its
+connections instead of setting up a new model for each request.
+
+Calls go through generate(), generate_stream() and generate_async(), which
+admit the call with the rate limit scheduler, apply the deadlines, retries
+and circuit breaker from resilience.py and record latency and token
+metrics. A sample of raw responses can be logged at debug level with
+LLM_LOG_SAMPLE_RATE (0 to 1).
+"""
+
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+import config  # noqa: F401, loads .env
+import metrics
+import ratelimit
+import resilience
+
+LLM_LOG_SAMPLE_RATE = float(os.environ.get("LLM_LOG_SAMPLE_RATE", 0))
+
+logger = logging.getLogger("gemini")
+
+_genai = None
+_sdk_lock = threading.Lock()
+_models = {}
+_lock = threading.Lock()
+warmed_up = threading.Event()
+
+
+def sdk():
+    """The configured google.generativeai module, imported on first use"""
+    global _genai
+    if _genai is None:
+        with _sdk_lock:
+            if _genai is None:
+                start = time.perf_counter()
+                import google.generativeai as genai
+
+                if os.environ.get("GEMINI_TRANSPORT"):
+                    genai.configure(api_key=os.environ["GEMINI_API_KEY"], transport=os.environ["GEMINI_TRANSPORT"])
+                else:
+                    genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+                print(f"Gemini SDK loaded in {time.perf_counter() - start:.2f}s")
+                _genai = genai
+    return _genai
+
+
+def status():
+    """SDK and model registry state, without loading the SDK"""
+    return {"sdk_loaded": _genai is not None, "models": len(_models), "warmed_up": warmed_up.is_set()}
+
+
+def get_model(model_name, generation_config=None, safety_settings=None, system_instruction=None):
+    """Return the shared model handle for this configuration"""
+    key = json.dumps(
+        [model_name, generation_config, safety_settings, system_instruction], sort_keys=True
+    )
+    model = _models.get(key)
+    if model is None:
+        genai = sdk()
+        with _lock:
+            model = _models.get(key)
+            if model is None:
+                # See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
+                model = genai.GenerativeModel(
+                    model_name=model_name,
+                    generation_config=generation_config,
+                    safety_settings=safety_settings,
+                    system_instruction=system_instruction,
+                )
+                _models[key] = model
+    return model
+
+
+def warm_up(*factories, connect=False, background=False):
+    """
+    Build the model handles returned by each factory ahead of the first
+    request. With connect=True a cheap metadata call is made as well so the
+    TLS connection to the API is already open. With background=True this
+    happens on a daemon thread and the call returns immediately.
+    """
+    if background:
+        threading.Thread(
+            target=warm_up, args=factories, kwargs={"connect": connect}, name="gemini-warm-up", daemon=True,
+        ).start()
+        return
+    try:
+        for factory in factories:
+            factory()
+        if connect:
+            sdk().get_model("models/gemini-2.0-flash")
+    except Exception as e:
+        print(f"Gemini warm-up failed: {e}")
+    print(f"Gemini models ready: {len(_models)}")
+    warmed_up.set()
+
+
+def _record(kind, response, text):
+    usage = getattr(response, "usage_metadata", None)
+    if usage is not None:
+        metrics.observe("gemini_prompt_tokens", usage.prompt_token_count, kind=kind)
+        metrics.observe("gemini_output_tokens", usage.candidates_token_count, kind=kind)
+    if LLM_LOG_SAMPLE_RATE and random.random() < LLM_LOG_SAMPLE_RATE:
+        logger.debug("%s response (%d chars): %s", kind, len(text), text[:2000])
+
+
+def generate(kind, model, prompt):
+    """Single generate_content call, returns the response text"""
+    def attempt(timeout):
+        ratelimit.scheduler.acquire(kind)
+        response = model.generate_content(prompt, request_options={"timeout": timeout})
+        return response, response.text
+
+    start = time.perf_counter()
+    try:
+        response, text = resilience.call_with_retry(kind, attempt)
+    except Exception:
+        metrics.inc("gemini_errors_total", kind=kind)
+        raise
+    metrics.observe("gemini_request_seconds", time.perf_counter() - start, kind=kind)
+    _record(kind, response, text)
+    return text
+
+
+def generate_stream(kind, model, prompt):
+    """
+    Yield the response text chunk by chunk as it arrives. Failures are only
+    retried until the first chunk, after that the text is already on its way
+    to the client.
+    """
+    def attempt(timeout):
+        ratelimit.scheduler.acquire(kind)
+        response = model.generate_content(prompt, stream=True, request_options={"timeout": timeout})
+        chunks = iter(response)
+        return response, next(chunks, None), chunks
+
+    start = time.perf_counter()
+    try:
+        response, first, chunks = resilience.call_with_retry(kind, attempt, hedge=False)
+        metrics.observe("gemini_first_token_seconds", time.perf_counter() - start, kind=kind)
+        if first is not None:
+            yield first.text
+        for chunk in chunks:
+            yield chunk.text
+    except Exception:
+        metrics.inc("gemini_errors_total", kind=kind)
+        raise
+    metrics.observe("gemini_request_seconds", time.perf_counter() - start, kind=kind)
+    _record(kind, response, "")
+
+
+async def generate_async(kind, model, prompt):
+    """Coroutine version of generate() for the ASGI server"""
+    async def attempt(timeout):
+        await ratelimit.scheduler.acquire_async(kind)
+        response = await model.generate_content_async(prompt, request_options={"timeout": timeout})
+        return response, response.text
+
+    start = time.perf_counter()
+    try:
+        response, text = await resilience.call_with_retry_async(kind, attempt)
+    except Exception:
+        metrics.inc("gemini_errors_total", kind=kind)
+        raise
+    metrics.observe("gemini_request_seconds", time.perf_counter() - start, kind=kind)
+    _record(kind, response, text)
+    return text
+
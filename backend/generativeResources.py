@@ -7,26 +7,23 @@ See the getting started guide for more information:
 https://ai.google.dev/gemini-api/docs/get-started/python
 """
 
-import os
+import cache
+import gemini
+from documents import documents, split_chapters
 
-import google.generativeai as genai
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+MODEL_NAME = "gemini-2.0-flash"
 
+# See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "text/plain",
+}
 
-def generate_resources(course, knowledge_level, description, time, request_type="basic"):
-    # Create the model
-    # See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 8192,
-        "response_mime_type": "text/plain",
-    }
-
-    if request_type == "structured_learning":
-        system_instruction = """You are an AI tutor creating structured, interactive learning content. 
+STRUCTURED_SYSTEM_INSTRUCTION = """You are an AI tutor creating structured, interactive learning content. 
         Create comprehensive, chapter-based learning materials that include:
         - Clear learning objectives for each section
         - Step-by-step explanations with examples
@@ -37,19 +34,43 @@ def generate_resources(course, knowledge_level, description, time, request_type=
         Format your response with clear markdown headers (# ## ###) to create distinct chapters.
         Make the content engaging, practical, and suitable for the given time duration.
         Include real-world examples and hands-on activities where possible."""
-    else:
-        system_instruction = "You are an AI tutor. Maintain a modest and calm language suitable for learning. You need to provide content to user to learn in given time."
 
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        generation_config=generation_config,
+BASIC_SYSTEM_INSTRUCTION = "You are an AI tutor. Maintain a modest and calm language suitable for learning. You need to provide content to user to learn in given time."
+
+
+def resource_key(course, knowledge_level, description, time, request_type):
+    return cache.make_key(
+        "resource", MODEL_NAME, GENERATION_CONFIG, get_system_instruction(request_type),
+        course=course, knowledge_level=knowledge_level, description=description,
+        time=time, request_type=request_type,
+    )
+
+
+def generate_resources(course, knowledge_level, description, time, request_type="basic"):
+    key = resource_key(course, knowledge_level, description, time, request_type)
+    return cache.generations.get_or_create(
+        key,
+        lambda: generate_resources_uncached(course, knowledge_level, description, time, request_type),
+    )
+
+
+def get_system_instruction(request_type):
+    if request_type == "structured_learning":
+        return STRUCTURED_SYSTEM_INSTRUCTION
+    return BASIC_SYSTEM_INSTRUCTION
+
+
+def get_model(request_type="basic"):
+    return gemini.get_model(
+        MODEL_NAME,
+        generation_config=GENERATION_CONFIG,
         # safety_settings = Adjust safety settings
         # See https://ai.google.dev/gemini-api/docs/safety-settings
-        system_instruction=system_instruction,
+        system_instruction=get_system_instruction(request_type),
     )
 
-    chat_session = model.start_chat(history=[])
 
+def build_prompt(course, knowledge_level, description, time, request_type):
     if request_type == "structured_learning":
         # Enhanced prompt for structured learning
         time_in_minutes = 30  # Default
@@ -104,7 +125,92 @@ def generate_resources(course, knowledge_level, description, time, request_type=
     else:
         prompt = f"I am learning {course}. My knowledge level in this topic is {knowledge_level}. i want to {description}. I want to learn it in {time}. Teach me."
 
-    response = chat_session.send_message(prompt, stream=False)
+    return prompt
+
+
+def generate_resources_uncached(course, knowledge_level, description, time, request_type="basic"):
+    prompt = build_prompt(course, knowledge_level, description, time, request_type)
+
+    return gemini.generate("resource", get_model(request_type), prompt)
+
+
+def stream_resources(course, knowledge_level, description, time, request_type="basic"):
+    """Yield the generated text in chunks as Gemini produces them"""
+    key = resource_key(course, knowledge_level, description, time, request_type)
+    cached = cache.generations.get(key)
+    if cached is not None:
+        yield cached
+        return
+
+    prompt = build_prompt(course, knowledge_level, description, time, request_type)
+
+    parts = []
+    try:
+        for text in gemini.generate_stream("resource", get_model(request_type), prompt):
+            parts.append(text)
+            yield text
+    except Exception:
+        # Fall back to an expired entry if nothing has been sent yet
+        stale = None if parts else cache.generations.get_stale(key)
+        if stale is None:
+            raise
+        yield stale
+        return
+
+    cache.generations.set(key, "".join(parts))
+
+
+async def generate_resources_async(course, knowledge_level, description, time, request_type="basic"):
+    """Same as generate_resources, using the SDK's async API for the ASGI server"""
+    async def generate():
+        prompt = build_prompt(course, knowledge_level, description, time, request_type)
+        return await gemini.generate_async("resource", get_model(request_type), prompt)
+
+    key = resource_key(course, knowledge_level, description, time, request_type)
+    return await cache.generations.get_or_create_async(key, generate)
+
+
+def store_document(course, knowledge_level, description, time, text):
+    """Keep a structured_learning document split into chapters, returns its id"""
+    key = resource_key(course, knowledge_level, description, time, "structured_learning")
+    return documents.save(key, text, course, knowledge_level, description, time)
+
+
+def build_chapter_prompt(document, title):
+    outline = "\n".join(f"# {chapter['title']}" for chapter in document["chapters"] if chapter["title"])
+    return f"""Rewrite one chapter of a structured learning path for "{document['description']}" in the context of {document['course']}.
+
+        Student Details:
+        - Knowledge Level: {document['knowledge_level']}
+        - Available Time for the whole path: {document['time']}
+
+        The learning path has these chapters:
+        {outline}
+
+        Write only the chapter "{title}", starting with the header line "# {title}".
+        Make it substantial with detailed explanations, examples, and practical activities.
+        Use markdown formatting for better readability."""
+
+
+def regenerate_chapter(doc_id, position):
+    """Generate one chapter of a stored document again, returns the new chapter or None"""
+    document = documents.get(doc_id)
+    chapter = documents.chapter(doc_id, position)
+    if document is None or chapter is None:
+        return None
 
-    print(response.text)
-    return response.text
+    prompt = build_chapter_prompt(document, chapter["title"] or document["description"])
+    text = gemini.generate("resource", get_model("structured_learning"), prompt)
+    # Keep the first chapter in case the model wrote more than was asked for
+    chapters = [(title, body) for title, body in split_chapters(text) if title]
+    title, body = chapters[0] if chapters else (chapter["title"], text.strip())
+    updated = documents.replace_chapter(doc_id, position, title, body)
+    if updated is not None:
+        # /api/generate-resource serves the same document from the cache,
+        # so it has to include the new chapter too
+        key = resource_key(
+            document["course"], document["knowledge_level"], document["description"], document["time"],
+            "structured_learning",
+        )
+        cache.generations.set(key, documents.text(doc_id))
+    return updated
@@ -0,0 +1,539 @@
+"""
+Compact storage for quiz and login history.
+
+Histories used to live inside each user record as lists of dicts repeating
+the course/topic strings and an ISO timestamp, so every request parsed the
+user's whole history. They are now kept in their own SQLite tables: course
+and topic strings are interned to integer ids, timestamps are epoch seconds,
+and only the latest QUIZ_HISTORY_RAW_LIMIT quiz attempts per user are kept
+as raw rows. Older attempts are rolled up into one summary row per day,
+course and topic.
+
+History is sharded the same way as the user store (see storage.py): with
+USER_SHARDS=N a user's history lives in history-<i>-of-N.db, where i is
+their user shard, next to that shard's file when USER_SHARD_PATHS is set.
+While users move to a new layout (USER_SHARDS_PREVIOUS), or from the single
+history.db used before history was sharded, each user's history is moved
+over the first time it is used, and `python storage.py reshard` moves the
+rest. Remove the old files once it is done, every lookup checks them until
+then.
+"""
+
+import os
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+import sqlite_util
+import storage
+
+HISTORY_DB = os.environ.get("HISTORY_DB", "history.db")
+QUIZ_HISTORY_RAW_LIMIT = int(os.environ.get("QUIZ_HISTORY_RAW_LIMIT", 200))
+LOGIN_HISTORY_LIMIT = 50
+# Roll up in batches instead of on every write once a user is over the limit
+ROLLUP_SLACK = 50
+DAY = 24 * 3600
+
+
+def parse_time(value):
+    """Epoch seconds from an ISO date/datetime or a number, None if not given"""
+    if value is None or value == "":
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        return int(datetime.fromisoformat(value.replace("Z", "+00:00")).timestamp())
+
+
+def iso(ts):
+    return datetime.fromtimestamp(ts).isoformat()
+
+
+class HistoryStore:
+    """Quiz attempts, daily quiz rollups and logins per user in SQLite"""
+
+    def __init__(self, path=HISTORY_DB):
+        self.path = path
+        self.local = threading.local()
+        self.ids = {}
+        self.strings = {}
+        self._connect().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS strings (
+                id INTEGER PRIMARY KEY,
+                value TEXT NOT NULL UNIQUE
+            );
+            CREATE TABLE IF NOT EXISTS quiz_events (
+                email TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                course_id INTEGER,
+                topic_id INTEGER,
+                score NUMERIC,
+                total NUMERIC,
+                time_spent NUMERIC
+            );
+            CREATE INDEX IF NOT EXISTS quiz_events_email_ts ON quiz_events (email, ts);
+            CREATE TABLE IF NOT EXISTS quiz_daily (
+                email TEXT NOT NULL,
+                day INTEGER NOT NULL,
+                course_id INTEGER,
+                topic_id INTEGER,
+                attempts INTEGER NOT NULL,
+                score NUMERIC NOT NULL,
+                total NUMERIC NOT NULL,
+                time_spent NUMERIC NOT NULL,
+                UNIQUE (email, day, course_id, topic_id)
+            );
+            CREATE TABLE IF NOT EXISTS login_events (
+                email TEXT NOT NULL,
+                ts INTEGER NOT NULL,
+                ip TEXT,
+                user_agent_id INTEGER
+            );
+            CREATE INDEX IF NOT EXISTS login_events_email_ts ON login_events (email, ts);
+            CREATE TABLE IF NOT EXISTS legacy_imports (
+                email TEXT PRIMARY KEY,
+                imported_at INTEGER NOT NULL
+            );
+            """
+        )
+
+    def _connect(self):
+        return sqlite_util.connect(self.path, self.local)
+
+    @contextmanager
+    def _transaction(self):
+        """
+        A write transaction. Strings interned in it are only added to the
+        id caches once it commits, so a rollback can't leave ids behind
+        that SQLite later hands out for a different string.
+        """
+        conn = self._connect()
+        self.local.interned = {}
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            self.local.interned = None
+            raise
+        interned, self.local.interned = self.local.interned, None
+        for value, string_id in interned.items():
+            self.ids[value] = string_id
+            self.strings[string_id] = value
+
+    def _intern(self, conn, value):
+        """Id of a string, called inside _transaction()"""
+        if value is None:
+            return None
+        value = str(value)
+        string_id = self.ids.get(value) or self.local.interned.get(value)
+        if string_id is None:
+            conn.execute("INSERT OR IGNORE INTO strings (value) VALUES (?)", (value,))
+            string_id = conn.execute("SELECT id FROM strings WHERE value = ?", (value,)).fetchone()[0]
+            self.local.interned[value] = string_id
+        return string_id
+
+    def _string(self, conn, string_id):
+        if string_id is None:
+            return None
+        value = self.strings.get(string_id)
+        if value is None:
+            value = conn.execute("SELECT value FROM strings WHERE id = ?", (string_id,)).fetchone()[0]
+            self.strings[string_id] = value
+            self.ids[value] = string_id
+        return value
+
+    def add_quiz(self, email, record, ts=None):
+        """Store one quiz attempt, record has the course/topic/score/total/time_spent keys"""
+        with self._transaction() as conn:
+            self._insert_quiz(conn, email, record, ts)
+            self._rollup(conn, email)
+
+    def _insert_quiz(self, conn, email, record, ts):
+        if ts is None:
+            ts = parse_time(record.get("timestamp")) or int(datetime.now().timestamp())
+        conn.execute(
+            "INSERT INTO quiz_events VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                email,
+                ts,
+                self._intern(conn, record.get("course")),
+                self._intern(conn, record.get("topic")),
+                record.get("score"),
+                record.get("total"),
+                record.get("time_spent", 0),
+            ),
+        )
+
+    def _rollup(self, conn, email):
+        count = conn.execute(
+            "SELECT COUNT(*) FROM quiz_events WHERE email = ?", (email,)
+        ).fetchone()[0]
+        if count <= QUIZ_HISTORY_RAW_LIMIT + ROLLUP_SLACK:
+            return
+        oldest = "SELECT rowid FROM quiz_events WHERE email = ? ORDER BY ts, rowid LIMIT ?"
+        excess = count - QUIZ_HISTORY_RAW_LIMIT
+        conn.execute(
+            f"""
+            INSERT INTO quiz_daily (email, day, course_id, topic_id, attempts, score, total, time_spent)
+            SELECT email, ts / {DAY}, course_id, topic_id, COUNT(*),
+                   COALESCE(SUM(score), 0), COALESCE(SUM(total), 0), COALESCE(SUM(time_spent), 0)
+            FROM quiz_events WHERE rowid IN ({oldest})
+            GROUP BY email, ts / {DAY}, course_id, topic_id
+            ON CONFLICT (email, day, course_id, topic_id) DO UPDATE SET
+                attempts = attempts + excluded.attempts,
+                score = score + excluded.score,
+                total = total + excluded.total,
+                time_spent = time_spent + excluded.time_spent
+            """,
+            (email, excess),
+        )
+        conn.execute(f"DELETE FROM quiz_events WHERE rowid IN ({oldest})", (email, excess))
+
+    def _range(self, column, since, until):
+        clause, params = "", []
+        if since is not None:
+            clause += f" AND {column} >= ?"
+            params.append(since)
+        if until is not None:
+            clause += f" AND {column} < ?"
+            params.append(until)
+        return clause, params
+
+    def quiz_history(self, email, since=None, until=None, limit=None):
+        """Raw quiz attempts in [since, until), oldest first, optionally only the last limit"""
+        conn = self._connect()
+        clause, params = self._range("ts", since, until)
+        rows = conn.execute(
+            f"""
+            SELECT ts, course_id, topic_id, score, total, time_spent FROM quiz_events
+            WHERE email = ?{clause} ORDER BY ts DESC, rowid DESC LIMIT ?
+            """,
+            (email, *params, -1 if limit is None else limit),
+        ).fetchall()
+        return [
+            {
+                "timestamp": iso(ts),
+                "course": self._string(conn, course_id),
+                "topic": self._string(conn, topic_id),
+                "score": score,
+                "total": total,
+                "time_spent": time_spent,
+            }
+            for ts, course_id, topic_id, score, total, time_spent in reversed(rows)
+        ]
+
+    def quiz_daily(self, email, since=None, until=None):
+        """Daily rollups of attempts that fell out of the raw history"""
+        conn = self._connect()
+        clause, params = self._range(
+            "day",
+            None if since is None else since // DAY,
+            None if until is None else -(-until // DAY),
+        )
+        rows = conn.execute(
+            f"""
+            SELECT day, course_id, topic_id, attempts, score, total, time_spent FROM quiz_daily
+            WHERE email = ?{clause} ORDER BY day
+            """,
+            (email, *params),
+        )
+        return [
+            {
+                "date": datetime.fromtimestamp(day * DAY, timezone.utc).date().isoformat(),
+                "course": self._string(conn, course_id),
+                "topic": self._string(conn, topic_id),
+                "attempts": attempts,
+                "score": score,
+                "total": total,
+                "time_spent": time_spent,
+            }
+            for day, course_id, topic_id, attempts, score, total, time_spent in rows
+        ]
+
+    def add_login(self, email, record):
+        with self._transaction() as conn:
+            self._insert_login(conn, email, record)
+            conn.execute(
+                """
+                DELETE FROM login_events WHERE rowid IN (
+                    SELECT rowid FROM login_events WHERE email = ?
+                    ORDER BY ts DESC, rowid DESC LIMIT -1 OFFSET ?
+                )
+                """,
+                (email, LOGIN_HISTORY_LIMIT),
+            )
+
+    def _insert_login(self, conn, email, record):
+        conn.execute(
+            "INSERT INTO login_events VALUES (?, ?, ?, ?)",
+            (
+                email,
+                parse_time(record.get("timestamp")) or int(datetime.now().timestamp()),
+                record.get("ip"),
+                self._intern(conn, record.get("user_agent")),
+            ),
+        )
+
+    def version(self, email):
+        """Changes whenever a quiz attempt or login is recorded for email"""
+        return self._connect().execute(
+            """
+            SELECT (SELECT MAX(rowid) FROM quiz_events WHERE email = ?),
+                   (SELECT MAX(rowid) FROM login_events WHERE email = ?)
+            """,
+            (email, email),
+        ).fetchone()
+
+    def login_history(self, email, limit=LOGIN_HISTORY_LIMIT):
+        """The latest logins, oldest first"""
+        conn = self._connect()
+        rows = conn.execute(
+            "SELECT ts, ip, user_agent_id FROM login_events WHERE email = ? ORDER BY ts DESC, rowid DESC LIMIT ?",
+            (email, limit),
+        ).fetchall()
+        return [
+            {"timestamp": iso(ts), "ip": ip, "user_agent": self._string(conn, user_agent_id)}
+            for ts, ip, user_agent_id in reversed(rows)
+        ]
+
+    def import_legacy(self, email, user):
+        """
+        Move quiz_history/login_history lists still stored in a user record
+        into this store. Returns True if the record was changed.
+
+        This runs inside a user store update, which can still fail after the
+        import has committed and leave the lists in the record. The import
+        is recorded per email in the same transaction, so the next attempt
+        only drops the lists instead of importing them twice.
+        """
+        quizzes = user.pop("quiz_history", None)
+        logins = user.pop("login_history", None)
+        if quizzes is None and logins is None:
+            return False
+        with self._transaction() as conn:
+            first_import = conn.execute(
+                "INSERT OR IGNORE INTO legacy_imports VALUES (?, ?)", (email, int(datetime.now().timestamp())),
+            ).rowcount
+            if first_import:
+                for record in quizzes or []:
+                    self._insert_quiz(conn, email, record, None)
+                for record in (logins or [])[-LOGIN_HISTORY_LIMIT:]:
+                    self._insert_login(conn, email, record)
+                self._rollup(conn, email)
+        return True
+
+    def emails(self):
+        """Every email with any history here"""
+        rows = self._connect().execute(
+            """
+            SELECT email FROM quiz_events UNION SELECT email FROM quiz_daily
+            UNION SELECT email FROM login_events UNION SELECT email FROM legacy_imports
+            """
+        )
+        return [email for email, in rows]
+
+    def has(self, email):
+        return self._connect().execute(
+            """
+            SELECT EXISTS (SELECT 1 FROM quiz_events WHERE email = :e)
+                OR EXISTS (SELECT 1 FROM quiz_daily WHERE email = :e)
+                OR EXISTS (SELECT 1 FROM login_events WHERE email = :e)
+                OR EXISTS (SELECT 1 FROM legacy_imports WHERE email = :e)
+            """,
+            {"e": email},
+        ).fetchone()[0] == 1
+
+    def export(self, email):
+        """A user's rows with the interned strings resolved, for absorb() in another store"""
+        conn = self._connect()
+        quizzes = conn.execute(
+            "SELECT ts, course_id, topic_id, score, total, time_spent FROM quiz_events WHERE email = ? ORDER BY rowid",
+            (email,),
+        ).fetchall()
+        daily = conn.execute(
+            "SELECT day, course_id, topic_id, attempts, score, total, time_spent FROM quiz_daily WHERE email = ?",
+            (email,),
+        ).fetchall()
+        logins = conn.execute(
+            "SELECT ts, ip, user_agent_id FROM login_events WHERE email = ? ORDER BY rowid", (email,),
+        ).fetchall()
+        imported = conn.execute("SELECT imported_at FROM legacy_imports WHERE email = ?", (email,)).fetchone()
+        return {
+            "quizzes": [
+                (ts, self._string(conn, course), self._string(conn, topic), *rest)
+                for ts, course, topic, *rest in quizzes
+            ],
+            "daily": [
+                (day, self._string(conn, course), self._string(conn, topic), *rest)
+                for day, course, topic, *rest in daily
+            ],
+            "logins": [(ts, ip, self._string(conn, agent)) for ts, ip, agent in logins],
+            "imported_at": imported[0] if imported else None,
+        }
+
+    def absorb(self, email, rows):
+        """
+        Store a user's rows from export(), unless this store already has
+        history for them. Returns False in that case, which means an earlier
+        move got this far and only the old copy is left to delete.
+        """
+        with self._transaction() as conn:
+            if self.has(email):
+                return False
+            for ts, course, topic, score, total, time_spent in rows["quizzes"]:
+                conn.execute(
+                    "INSERT INTO quiz_events VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (email, ts, self._intern(conn, course), self._intern(conn, topic), score, total, time_spent),
+                )
+            for day, course, topic, attempts, score, total, time_spent in rows["daily"]:
+                conn.execute(
+                    "INSERT INTO quiz_daily VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (email, day, self._intern(conn, course), self._intern(conn, topic), attempts, score, total, time_spent),
+                )
+            for ts, ip, agent in rows["logins"]:
+                conn.execute(
+                    "INSERT INTO login_events VALUES (?, ?, ?, ?)", (email, ts, ip, self._intern(conn, agent)),
+                )
+            if rows["imported_at"] is not None:
+                conn.execute("INSERT INTO legacy_imports VALUES (?, ?)", (email, rows["imported_at"]))
+        return True
+
+    def delete(self, email):
+        with self._transaction() as conn:
+            for table in ("quiz_events", "quiz_daily", "login_events", "legacy_imports"):
+                conn.execute(f"DELETE FROM {table} WHERE email = ?", (email,))
+
+
+class ShardedHistory:
+    """Routes every user's history to the store of their user shard"""
+
+    def __init__(self, shards):
+        self.shards = list(shards)
+
+    def shard(self, email):
+        return self.shards[storage.shard_index(email, len(self.shards))]
+
+    def add_quiz(self, email, record, ts=None):
+        return self.shard(email).add_quiz(email, record, ts)
+
+    def quiz_history(self, email, since=None, until=None, limit=None):
+        return self.shard(email).quiz_history(email, since, until, limit)
+
+    def quiz_daily(self, email, since=None, until=None):
+        return self.shard(email).quiz_daily(email, since, until)
+
+    def add_login(self, email, record):
+        return self.shard(email).add_login(email, record)
+
+    def version(self, email):
+        return self.shard(email).version(email)
+
+    def login_history(self, email, limit=LOGIN_HISTORY_LIMIT):
+        return self.shard(email).login_history(email, limit)
+
+    def import_legacy(self, email, user):
+        return self.shard(email).import_legacy(email, user)
+
+    def emails(self):
+        return [email for shard in self.shards for email in shard.emails()]
+
+    def has(self, email):
+        return self.shard(email).has(email)
+
+    def export(self, email):
+        return self.shard(email).export(email)
+
+    def absorb(self, email, rows):
+        return self.shard(email).absorb(email, rows)
+
+    def delete(self, email):
+        return self.shard(email).delete(email)
+
+
+class ReshardingHistory:
+    """
+    Serves history while users move from the previous layout to the new
+    one, the counterpart of storage.ReshardingStore. A user's history is
+    moved before anything reads or writes it, so the new layout always has
+    all of it.
+    """
+
+    def __init__(self, current, previous):
+        self.current = current
+        self.previous = previous
+
+    def move(self, email):
+        """Move a user's history to the new layout, returns True if there was any to move"""
+        if not self.previous.has(email):
+            return False
+        self.current.absorb(email, self.previous.export(email))
+        self.previous.delete(email)
+        return True
+
+    def add_quiz(self, email, record, ts=None):
+        self.move(email)
+        return self.current.add_quiz(email, record, ts)
+
+    def quiz_history(self, email, since=None, until=None, limit=None):
+        self.move(email)
+        return self.current.quiz_history(email, since, until, limit)
+
+    def quiz_daily(self, email, since=None, until=None):
+        self.move(email)
+        return self.current.quiz_daily(email, since, until)
+
+    def add_login(self, email, record):
+        self.move(email)
+        return self.current.add_login(email, record)
+
+    def version(self, email):
+        self.move(email)
+        return self.current.version(email)
+
+    def login_history(self, email, limit=LOGIN_HISTORY_LIMIT):
+        self.move(email)
+        return self.current.login_history(email, limit)
+
+    def import_legacy(self, email, user):
+        self.move(email)
+        return self.current.import_legacy(email, user)
+
+
+def reshard(store):
+    """Move the history of every user still in the previous layout, returns how many were moved"""
+    return sum(store.move(email) for email in store.previous.emails())
+
+
+def history_paths(shards, user_paths=()):
+    """history.db, or history-<i>-of-N.db next to each user shard"""
+    paths = storage.shard_paths(HISTORY_DB, shards)
+    if user_paths:
+        paths = [os.path.join(os.path.dirname(u), os.path.basename(p)) for u, p in zip(user_paths, paths)]
+    return paths
+
+
+def open_layout(shards, user_paths=()):
+    paths = history_paths(shards, user_paths)
+    if shards == 1:
+        return HistoryStore(paths[0])
+    return ShardedHistory(HistoryStore(p) for p in paths)
+
+
+def open_history():
+    """The history store for the configured user shard layout"""
+    paths = history_paths(storage.USER_SHARDS, storage.USER_SHARD_PATHS)
+    current = open_layout(storage.USER_SHARDS, storage.USER_SHARD_PATHS)
+    if storage.USER_SHARDS_PREVIOUS:
+        previous = open_layout(storage.USER_SHARDS_PREVIOUS, storage.USER_SHARD_PATHS_PREVIOUS)
+    elif os.path.exists(HISTORY_DB) and os.path.abspath(HISTORY_DB) not in map(os.path.abspath, paths):
+        # The single history.db from before history was sharded
+        previous = HistoryStore(HISTORY_DB)
+    else:
+        return current
+    return ReshardingHistory(current, previous)
+
+
+history = open_history()
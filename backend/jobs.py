@@ -0,0 +1,268 @@
+"""
+Background jobs for long generations.
+
+A structured_learning resource or a quiz can take longer than a proxy is
+willing to hold a connection open. With "async": true in the body (or a
+"Prefer: respond-async" header) /api/generate-resource and /api/quiz answer
+202 at once with a job id. The generation runs on a pool of JOB_WORKERS
+threads, and the client polls /api/jobs/<id> for the result or names a
+callback_url that gets the finished job POSTed to it.
+
+Jobs are kept in SQLite, so they survive a restart: a worker claims a job
+by taking a lease on it, and a job whose lease ran out because its process
+died is picked up again, up to JOB_MAX_ATTEMPTS times. Several API
+processes can share jobs.db, each running its own workers. Finished jobs
+are deleted after JOB_RETENTION seconds.
+
+Callbacks are only sent to the hosts listed in JOB_CALLBACK_HOSTS, and are
+signed with HMAC-SHA256 in an X-Job-Signature header when
+JOB_CALLBACK_SECRET is set.
+"""
+
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import sqlite3
+import threading
+import time
+import urllib.request
+from urllib.parse import urlparse
+
+import generativeResources
+import metrics
+import quiz
+import sqlite_util
+
+JOBS_DB = os.environ.get("JOBS_DB", "jobs.db")
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 4))
+JOB_QUEUE_LIMIT = int(os.environ.get("JOB_QUEUE_LIMIT", 1000))  # queued jobs before submit is refused
+JOB_LEASE = float(os.environ.get("JOB_LEASE", 600))  # seconds, longer than any generation
+JOB_MAX_ATTEMPTS = int(os.environ.get("JOB_MAX_ATTEMPTS", 3))
+JOB_RETENTION = float(os.environ.get("JOB_RETENTION", 24 * 3600))
+JOB_POLL_INTERVAL = float(os.environ.get("JOB_POLL_INTERVAL", 5))
+JOB_CALLBACK_HOSTS = {h.strip().lower() for h in os.environ.get("JOB_CALLBACK_HOSTS", "").split(",") if h.strip()}
+JOB_CALLBACK_SECRET = os.environ.get("JOB_CALLBACK_SECRET", "")
+JOB_CALLBACK_TIMEOUT = float(os.environ.get("JOB_CALLBACK_TIMEOUT", 10))
+JOB_CALLBACK_RETRIES = int(os.environ.get("JOB_CALLBACK_RETRIES", 3))
+
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+
+
+class QueueFull(Exception):
+    pass
+
+
+def run_resource(params):
+    text = generativeResources.generate_resources(
+        params["course"], params["knowledge_level"], params["description"], params["time"],
+        params.get("request_type", "basic"),
+    )
+    extra = {}
+    if params.get("request_type") == "structured_learning":
+        extra["document_id"] = generativeResources.store_document(
+            params["course"], params["knowledge_level"], params["description"], params["time"], text,
+        )
+    return text, extra
+
+
+def run_quiz(params):
+    return quiz.get_quiz(params["course"], params["topic"], params["subtopic"], params["description"]), {}
+
+
+KINDS = {
+    "resource": run_resource,
+    "quiz": run_quiz,
+}
+
+
+def callback_allowed(url):
+    parsed = urlparse(url or "")
+    return parsed.scheme in ("http", "https") and (parsed.hostname or "").lower() in JOB_CALLBACK_HOSTS
+
+
+class JobQueue:
+    """Jobs persisted in SQLite and run by a pool of worker threads"""
+
+    def __init__(self, path=JOBS_DB, workers=JOB_WORKERS):
+        self.path = path
+        self.size = workers
+        self.local = threading.local()
+        self.wakeup = threading.Condition()
+        self.workers = []
+        self.lock = threading.Lock()
+        self._connect().executescript(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                params TEXT NOT NULL,
+                status TEXT NOT NULL,
+                callback_url TEXT,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_until REAL,
+                result TEXT,
+                extra TEXT,
+                error TEXT,
+                created_at REAL NOT NULL,
+                started_at REAL,
+                finished_at REAL
+            );
+            CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created_at);
+            """
+        )
+
+    def _connect(self):
+        return sqlite_util.connect(self.path, self.local)
+
+    def start(self):
+        """Start the workers, which also pick up jobs left over from a previous run"""
+        with self.lock:
+            while len(self.workers) < self.size:
+                worker = threading.Thread(target=self._work, name=f"job-{len(self.workers)}", daemon=True)
+                worker.start()
+                self.workers.append(worker)
+
+    def submit(self, kind, params, callback_url=None):
+        """Queue a job and return its id, raises QueueFull past JOB_QUEUE_LIMIT"""
+        conn = self._connect()
+        queued = conn.execute("SELECT COUNT(*) FROM jobs WHERE status = ?", (QUEUED,)).fetchone()[0]
+        if queued >= JOB_QUEUE_LIMIT:
+            metrics.inc("jobs_total", kind=kind, status="rejected")
+            raise QueueFull(f"{queued} jobs are already waiting")
+        job_id = secrets.token_urlsafe(12)
+        conn.execute(
+            "INSERT INTO jobs (id, kind, params, status, callback_url, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (job_id, kind, json.dumps(params), QUEUED, callback_url, time.time()),
+        )
+        metrics.inc("jobs_total", kind=kind, status=QUEUED)
+        self.start()
+        with self.wakeup:
+            self.wakeup.notify()
+        return job_id
+
+    def get(self, job_id):
+        """The job as returned by /api/jobs/<id>, or None"""
+        row = self._connect().execute(
+            """
+            SELECT id, kind, status, attempts, result, extra, error, created_at, started_at, finished_at
+            FROM jobs WHERE id = ?
+            """,
+            (job_id,),
+        ).fetchone()
+        if row is None:
+            return None
+        job_id, kind, status, attempts, result, extra, error, created_at, started_at, finished_at = row
+        job = {
+            "id": job_id,
+            "kind": kind,
+            "status": status,
+            "attempts": attempts,
+            "created_at": created_at,
+            "started_at": started_at,
+            "finished_at": finished_at,
+        }
+        if status == DONE:
+            job["result"] = json.loads(result)
+            job.update(json.loads(extra or "{}"))
+        elif status == FAILED:
+            job["error"] = error
+        return job
+
+    def _claim(self):
+        """Take the oldest queued job, or one whose worker died, returns (id, kind, params, callback_url)"""
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Jobs that were running in a process that has since died
+            conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, finished_at = ? WHERE status = ? AND lease_until < ? AND attempts >= ?",
+                (FAILED, "The job was interrupted too many times", now, RUNNING, now, JOB_MAX_ATTEMPTS),
+            )
+            row = conn.execute(
+                """
+                SELECT id, kind, params, callback_url FROM jobs
+                WHERE status = ? OR (status = ? AND lease_until < ?)
+                ORDER BY created_at LIMIT 1
+                """,
+                (QUEUED, RUNNING, now),
+            ).fetchone()
+            if row is not None:
+                conn.execute(
+                    "UPDATE jobs SET status = ?, attempts = attempts + 1, lease_until = ?, started_at = ? WHERE id = ?",
+                    (RUNNING, now + JOB_LEASE, now, row[0]),
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return row
+
+    def _finish(self, job_id, status, result=None, extra=None, error=None):
+        self._connect().execute(
+            "UPDATE jobs SET status = ?, result = ?, extra = ?, error = ?, finished_at = ?, lease_until = NULL WHERE id = ?",
+            (status, result, extra, error, time.time(), job_id),
+        )
+
+    def _cleanup(self):
+        self._connect().execute(
+            "DELETE FROM jobs WHERE status IN (?, ?) AND finished_at < ?",
+            (DONE, FAILED, time.time() - JOB_RETENTION),
+        )
+
+    def _work(self):
+        while True:
+            try:
+                job = self._claim()
+            except sqlite3.Error as e:
+                print(f"Could not claim a job: {e}")
+                job = None
+            if job is None:
+                with self.wakeup:
+                    self.wakeup.wait(JOB_POLL_INTERVAL)
+                self._cleanup()
+                continue
+            self._run(*job)
+
+    def _run(self, job_id, kind, params, callback_url):
+        start = time.perf_counter()
+        try:
+            result, extra = KINDS[kind](json.loads(params))
+            self._finish(job_id, DONE, json.dumps(result), json.dumps(extra))
+            status = DONE
+        except Exception as e:
+            print(f"Job {job_id} ({kind}) failed: {e}")
+            self._finish(job_id, FAILED, error=str(e))
+            status = FAILED
+        metrics.inc("jobs_total", kind=kind, status=status)
+        metrics.observe("job_seconds", time.perf_counter() - start, kind=kind)
+        if callback_url:
+            self._callback(callback_url, self.get(job_id))
+
+    def _callback(self, url, job):
+        body = json.dumps(job).encode()
+        headers = {"Content-Type": "application/json"}
+        if JOB_CALLBACK_SECRET:
+            signature = hmac.new(JOB_CALLBACK_SECRET.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Job-Signature"] = f"sha256={signature}"
+        error = None
+        for attempt in range(JOB_CALLBACK_RETRIES + 1):
+            if attempt:
+                time.sleep(min(2 ** attempt, 30))
+            try:
+                request = urllib.request.Request(url, data=body, headers=headers, method="POST")
+                with urllib.request.urlopen(request, timeout=JOB_CALLBACK_TIMEOUT):
+                    return
+            except Exception as e:
+                error = e
+        print(f"Callback for job {job['id']} to {url} failed: {error}")
+        metrics.inc("job_callback_failures_total", kind=job["kind"])
+
+    def get_stats(self):
+        rows = self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status")
+        return dict({QUEUED: 0, RUNNING: 0, DONE: 0, FAILED: 0}, **dict(rows), workers=len(self.workers))
+
+
+queue = JobQueue()
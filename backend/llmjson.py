@@ -0,0 +1,237 @@
+"""
+Parsing, repair and validation of the JSON that Gemini returns.
+
+Roadmap and quiz responses run to thousands of tokens, and a malformed one
+used to fail the request after the whole generation had been paid for.
+parse() decodes with orjson when it is installed, and repairs the usual
+defects before giving up:
+
+- markdown code fences and text around the JSON document
+- trailing commas before a closing bracket
+- truncated output, cut back to the last complete element and closed
+- keys in the wrong case ("Week 1", "Subtopics", "answerindex")
+
+The result is then checked against the expected shape. Entries that can't
+be used (a question without options, a subtopic without a name) are dropped,
+and InvalidOutput is raised only when nothing usable is left.
+
+parse_with_repair() also reports whether the output was cut back from a
+truncated response, so callers can cache it for a short time only.
+"""
+
+import json
+import re
+
+import metrics
+
+try:
+    import orjson
+except ImportError:  # optional, about 2-3x faster on large responses
+    orjson = None
+
+WEEK_KEY = re.compile(r"^\s*week\s*(\d+)\s*$", re.IGNORECASE)
+ROADMAP_KEYS = ("topic", "subtopics")
+SUBTOPIC_KEYS = ("subtopic", "time", "description")
+QUESTION_KEYS = ("question", "options", "answerIndex", "reason")
+
+
+class InvalidOutput(ValueError):
+    pass
+
+
+def loads(text):
+    if orjson is not None:
+        return orjson.loads(text)
+    return json.loads(text)
+
+
+def _scan(text):
+    """Yield (index, char) for every character outside string literals"""
+    in_string = escape = False
+    for i, ch in enumerate(text):
+        if in_string:
+            if escape:
+                escape = False
+            elif ch == "\\":
+                escape = True
+            elif ch == '"':
+                in_string = False
+            continue
+        if ch == '"':
+            in_string = True
+        yield i, ch
+
+
+def extract(text):
+    """The JSON document without code fences or surrounding prose"""
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        return text.strip()
+    start = min(starts)
+    end = max(text.rfind("}"), text.rfind("]"))
+    if end < start:
+        return text[start:]
+    # For truncated output this also drops the incomplete tail
+    return text[start:end + 1]
+
+
+def remove_trailing_commas(text):
+    drop = set()
+    comma = None
+    for i, ch in _scan(text):
+        if ch == ",":
+            comma = i
+        elif ch in "}]" and comma is not None:
+            drop.add(comma)
+            comma = None
+        elif not ch.isspace():
+            comma = None
+    return "".join(ch for i, ch in enumerate(text) if i not in drop)
+
+
+def close_truncated(text):
+    """Cut unbalanced JSON back to its last complete element and close it"""
+    stack = []
+    safe = None
+    for i, ch in _scan(text):
+        if ch in "{[":
+            stack.append(ch)
+        elif ch in "}]":
+            if stack:
+                stack.pop()
+            safe = (i + 1, list(stack))
+        elif ch == ",":
+            safe = (i, list(stack))
+    if not stack or safe is None:
+        return text
+    cut, still_open = safe
+    return text[:cut] + "".join("}" if ch == "{" else "]" for ch in reversed(still_open))
+
+
+def decode(kind, text):
+    """Decode model output, applying repairs only when plain decoding fails"""
+    return decode_with_repair(kind, text)[0]
+
+
+def decode_with_repair(kind, text):
+    """decode() that also returns the name of the repair that worked, or None"""
+    try:
+        return loads(text), None
+    except ValueError:
+        pass
+    repaired = extract(text)
+    for name, fix in (
+        ("extract", lambda t: t),
+        ("trailing_comma", remove_trailing_commas),
+        ("truncated", close_truncated),
+    ):
+        repaired = fix(repaired)
+        try:
+            value = loads(repaired)
+        except ValueError:
+            continue
+        metrics.inc("json_repairs_total", kind=kind, repair=name)
+        return value, name
+    raise InvalidOutput(f"Could not decode {kind} output as JSON")
+
+
+def _keys(value, names):
+    """Copy of a dict with keys matched case-insensitively to names"""
+    canonical = {name.lower(): name for name in names}
+    return {canonical.get(str(k).strip().lower(), k): v for k, v in value.items()}
+
+
+def _text(value):
+    return value.strip() if isinstance(value, str) else "" if value is None else str(value)
+
+
+def validate_roadmap(value):
+    """{"week N": {"topic", "subtopics": [{"subtopic", "time", "description"}]}}"""
+    if isinstance(value, dict) and len(value) == 1:
+        inner = next(iter(value.values()))
+        if isinstance(inner, dict) and not any(WEEK_KEY.match(str(k)) for k in value):
+            value = inner  # {"roadmap": {"week 1": ...}}
+    if not isinstance(value, dict):
+        raise InvalidOutput("Roadmap is not an object")
+
+    weeks = {}
+    for key, week in value.items():
+        match = WEEK_KEY.match(str(key))
+        if not match or not isinstance(week, dict):
+            continue
+        week = _keys(week, ROADMAP_KEYS)
+        subtopics = []
+        for subtopic in week.get("subtopics") or []:
+            if not isinstance(subtopic, dict):
+                continue
+            subtopic = _keys(subtopic, SUBTOPIC_KEYS)
+            if not _text(subtopic.get("subtopic")):
+                continue
+            subtopics.append(dict(subtopic, **{k: _text(subtopic.get(k)) for k in SUBTOPIC_KEYS}))
+        if subtopics:
+            weeks[f"week {int(match.group(1))}"] = dict(week, topic=_text(week.get("topic")), subtopics=subtopics)
+    if not weeks:
+        raise InvalidOutput("Roadmap has no weeks with subtopics")
+    return dict(sorted(weeks.items(), key=lambda item: int(item[0].split()[1])))
+
+
+def _answer_index(answer, options):
+    text = _text(answer)
+    if text.isdigit() and int(text) < len(options):
+        return text
+    # Some answers name the option instead of its index
+    lowered = [_text(option).lower() for option in options]
+    if text.lower() in lowered:
+        return str(lowered.index(text.lower()))
+    return None
+
+
+def validate_quiz(value):
+    """{"questions": [{"question", "options": [...], "answerIndex", "reason"}]}"""
+    if isinstance(value, list):
+        value = {"questions": value}
+    if not isinstance(value, dict):
+        raise InvalidOutput("Quiz is not an object")
+    value = _keys(value, ("questions",))
+
+    questions = []
+    for question in value.get("questions") or []:
+        if not isinstance(question, dict):
+            continue
+        question = _keys(question, QUESTION_KEYS)
+        options = question.get("options")
+        if not _text(question.get("question")) or not isinstance(options, list) or len(options) < 2:
+            continue
+        answer = _answer_index(question.get("answerIndex"), options)
+        if answer is None:
+            continue
+        questions.append(dict(question, answerIndex=answer, reason=_text(question.get("reason"))))
+    if not questions:
+        raise InvalidOutput("Quiz has no usable questions")
+    return dict(value, questions=questions)
+
+
+VALIDATORS = {
+    "roadmap": validate_roadmap,
+    "quiz": validate_quiz,
+}
+
+
+def parse(kind, text):
+    """Decoded, repaired and validated model output for kind"""
+    return parse_with_repair(kind, text)[0]
+
+
+def parse_with_repair(kind, text):
+    """
+    parse() that also says whether the output had to be cut back from a
+    truncated response, in which case it is missing whatever came after.
+    """
+    with metrics.timer("json_parse_seconds", kind=kind):
+        try:
+            value, repair = decode_with_repair(kind, text)
+            validator = VALIDATORS.get(kind)
+            return (validator(value) if validator else value), repair == "truncated"
+        except InvalidOutput:
+            metrics.inc("json_invalid_total", kind=kind)
+            raise
@@ -0,0 +1,119 @@
+"""
+In-process metrics, exported in the Prometheus text format at /api/metrics.
+
+Counters, gauges and histograms are identified by name plus labels:
+
+    metrics.inc("gemini_errors_total", kind="quiz")
+    with metrics.timer("user_store_seconds", operation="update"):
+        ...
+"""
+
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+HELP = {
+    "http_request_seconds": "API request latency by endpoint",
+    "user_store_seconds": "Time spent reading and writing user records",
+    "gemini_request_seconds": "Gemini latency until the full response is received",
+    "gemini_first_token_seconds": "Gemini time to first streamed chunk",
+    "gemini_prompt_tokens": "Prompt tokens per Gemini call",
+    "gemini_output_tokens": "Output tokens per Gemini call",
+    "gemini_errors_total": "Failed Gemini calls",
+    "gemini_retries_total": "Gemini calls retried after a transient failure",
+    "gemini_hedged_total": "Gemini calls that got a hedged second request",
+    "gemini_circuit_open": "1 while the Gemini circuit breaker is open",
+    "json_parse_seconds": "Time spent parsing model output as JSON",
+    "json_repairs_total": "Model outputs that needed a repair to decode",
+    "json_invalid_total": "Model outputs that could not be decoded or validated",
+    "jobs_total": "Background generation jobs by kind and status",
+    "job_seconds": "Time a background job took to run",
+    "job_callback_failures_total": "Job callbacks that could not be delivered",
+}
+
+_lock = threading.Lock()
+_counters = {}
+_gauges = {}
+_histograms = {}  # (name, labels) -> [bucket counts..., sum, count]
+_buckets = {
+    "gemini_prompt_tokens": TOKEN_BUCKETS,
+    "gemini_output_tokens": TOKEN_BUCKETS,
+}
+
+
+def _key(name, labels):
+    return name, tuple(sorted(labels.items()))
+
+
+def inc(name, value=1, **labels):
+    key = _key(name, labels)
+    with _lock:
+        _counters[key] = _counters.get(key, 0) + value
+
+
+def set_gauge(name, value, **labels):
+    with _lock:
+        _gauges[_key(name, labels)] = value
+
+
+def observe(name, value, **labels):
+    buckets = _buckets.get(name, LATENCY_BUCKETS)
+    key = _key(name, labels)
+    with _lock:
+        histogram = _histograms.get(key)
+        if histogram is None:
+            histogram = _histograms[key] = [0] * (len(buckets) + 2)
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram[i] += 1
+        histogram[-2] += value
+        histogram[-1] += 1
+
+
+@contextmanager
+def timer(name, **labels):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(name, time.perf_counter() - start, **labels)
+
+
+def _labels(labels, extra=()):
+    pairs = [*labels, *extra]
+    if not pairs:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for _, v in pairs)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + "}"
+
+
+def _header(lines, seen, name, kind):
+    if name not in seen:
+        seen.add(name)
+        if name in HELP:
+            lines.append(f"# HELP {name} {HELP[name]}")
+        lines.append(f"# TYPE {name} {kind}")
+
+
+def render():
+    """All metrics in the Prometheus text exposition format"""
+    lines, seen = [], set()
+    with _lock:
+        for (name, labels), value in sorted(_counters.items()):
+            _header(lines, seen, name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), value in sorted(_gauges.items()):
+            _header(lines, seen, name, "gauge")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), histogram in sorted(_histograms.items()):
+            _header(lines, seen, name, "histogram")
+            buckets = _buckets.get(name, LATENCY_BUCKETS)
+            for bound, count in zip(buckets, histogram):
+                lines.append(f"{name}_bucket{_labels(labels, [('le', bound)])} {count}")
+            lines.append(f"{name}_bucket{_labels(labels, [('le', '+Inf')])} {histogram[-1]}")
+            lines.append(f"{name}_sum{_labels(labels)} {histogram[-2]}")
+            lines.append(f"{name}_count{_labels(labels)} {histogram[-1]}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,108 @@
+"""
+Background pre-generation of roadmap quizzes.
+
+After a roadmap is returned, users almost always open the quizzes of its
+first subtopics next. With PREFETCH_QUIZZES=N the quizzes for the first N
+subtopics are generated on a small worker pool and land in the generation
+cache (see cache.py), so opening them is instant. Jobs are dropped rather
+than queued when the pool is busy, and prefetching pauses for a while after
+an upstream error such as an exhausted quota. Prefetch calls are scheduled
+behind interactive requests (see ratelimit.py).
+"""
+
+import os
+import queue
+import threading
+import time
+
+import quiz
+import ratelimit
+
+PREFETCH_QUIZZES = int(os.environ.get("PREFETCH_QUIZZES", 0))  # 0 disables prefetching
+PREFETCH_WORKERS = int(os.environ.get("PREFETCH_WORKERS", 2))
+PREFETCH_QUEUE_SIZE = int(os.environ.get("PREFETCH_QUEUE_SIZE", 50))
+PREFETCH_BACKOFF = int(os.environ.get("PREFETCH_BACKOFF", 60))  # seconds
+
+_queue = queue.Queue(maxsize=PREFETCH_QUEUE_SIZE)
+_lock = threading.Lock()
+_pending = set()
+_workers = []
+_paused_until = 0
+stats = {"queued": 0, "completed": 0, "dropped": 0, "failed": 0}
+
+
+def _count(stat):
+    with _lock:
+        stats[stat] += 1
+
+
+def _start_workers():
+    with _lock:
+        while len(_workers) < PREFETCH_WORKERS:
+            worker = threading.Thread(target=_work, name=f"prefetch-{len(_workers)}", daemon=True)
+            worker.start()
+            _workers.append(worker)
+
+
+def _work():
+    global _paused_until
+    ratelimit.priority.set(ratelimit.BACKGROUND)
+    while True:
+        job = _queue.get()
+        try:
+            if time.time() < _paused_until:
+                _count("dropped")
+                continue
+            quiz.get_quiz(*job)
+            _count("completed")
+        except Exception as e:
+            print(f"Quiz prefetch failed, pausing for {PREFETCH_BACKOFF}s: {e}")
+            _paused_until = time.time() + PREFETCH_BACKOFF
+            _count("failed")
+        finally:
+            with _lock:
+                _pending.discard(job)
+            _queue.task_done()
+
+
+def submit(course, topic, subtopic, description):
+    """Queue one quiz generation, returns False if the job was dropped"""
+    job = (course, topic, subtopic, description)
+    if not all(job) or time.time() < _paused_until:
+        _count("dropped")
+        return False
+    with _lock:
+        if job in _pending:
+            return False
+        _pending.add(job)
+    try:
+        _queue.put_nowait(job)
+    except queue.Full:
+        with _lock:
+            _pending.discard(job)
+        _count("dropped")
+        return False
+    _count("queued")
+    _start_workers()
+    return True
+
+
+def roadmap_quizzes(course, roadmap):
+    """Queue quizzes for the first PREFETCH_QUIZZES subtopics of a generated roadmap"""
+    if PREFETCH_QUIZZES <= 0 or not isinstance(roadmap, dict) or "error" in roadmap:
+        return
+    remaining = PREFETCH_QUIZZES
+    for week in roadmap.values():
+        if not isinstance(week, dict):
+            continue
+        for subtopic in week.get("subtopics", []):
+            if remaining <= 0:
+                return
+            if isinstance(subtopic, dict):
+                submit(course, week.get("topic"), subtopic.get("subtopic"), subtopic.get("description"))
+                remaining -= 1
+
+
+def get_stats():
+    with _lock:
+        return dict(stats, pending=len(_pending), paused=time.time() < _paused_until)
@@ -8,56 +8,102 @@ https://ai.google.dev/gemini-api/docs/get-started/python
 """
 
 import os
-import google.generativeai as genai
-from dotenv import load_dotenv
-import json
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+import cache
+import gemini
+import llmjson
 
-load_dotenv()
 
+MODEL_NAME = "gemini-2.0-flash"
 
-def get_quiz(course, topic, subtopic, description):
-    # Create the model
-    # See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 20000,
-        "response_mime_type": "application/json",
-    }
-    safety_settings = [
-        {
-            "category": "HARM_CATEGORY_HARASSMENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_HATE_SPEECH",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-    ]
-
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        safety_settings=safety_settings,
-        generation_config=generation_config,
-        system_instruction="""You are an AI agent who provides quizzes to test understanding of user on a topic. The quiz will be based on topic, subtopic and the description of subtopic which describes what exactly to learn. Output questions in JSON format. The questions must be Multiple Choice Questions, can include calculation if necessary. Decide the number of questions based on description of the subtopic. Try to make as many questions as possible. Include questions that require deep thinking. output in format {questions:[ {question: "...", options:[...], answerIndex:"...", reason:"..."}]""",
+# See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 20000,
+    "response_mime_type": "application/json",
+}
+# Quizzes of a roadmap week are generated on a shared pool of this many threads
+QUIZ_BATCH_WORKERS = int(os.environ.get("QUIZ_BATCH_WORKERS", 8))
+QUIZ_BATCH_MAX_SUBTOPICS = int(os.environ.get("QUIZ_BATCH_MAX_SUBTOPICS", 20))
+
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+]
+
+SYSTEM_INSTRUCTION = """You are an AI agent who provides quizzes to test understanding of user on a topic. The quiz will be based on topic, subtopic and the description of subtopic which describes what exactly to learn. Output questions in JSON format. The questions must be Multiple Choice Questions, can include calculation if necessary. Decide the number of questions based on description of the subtopic. Try to make as many questions as possible. Include questions that require deep thinking. output in format {questions:[ {question: "...", options:[...], answerIndex:"...", reason:"..."}]"""
+
+
+def quiz_key(course, topic, subtopic, description):
+    return cache.make_key(
+        "quiz", MODEL_NAME, GENERATION_CONFIG, SYSTEM_INSTRUCTION,
+        course=course, topic=topic, subtopic=subtopic, description=description,
     )
 
-    chat_session = model.start_chat(history=[])
 
-    response = chat_session.send_message(
-        f'The user is learning the course {course}. In the course the user is learning topic "{topic}". Create quiz on subtopic "{subtopic}". The description of the subtopic is "{description}".',
-        stream=False,
+def get_quiz(course, topic, subtopic, description):
+    return cache.generations.get_or_create(
+        quiz_key(course, topic, subtopic, description),
+        lambda: generate_quiz(course, topic, subtopic, description),
     )
-    print(response.text)
-    return json.loads(response.text)
+
+
+_pool = ThreadPoolExecutor(max_workers=QUIZ_BATCH_WORKERS, thread_name_prefix="quiz")
+
+
+def iter_quizzes(course, topic, subtopics):
+    """
+    Generate the quizzes for a list of {"subtopic", "description"} dicts,
+    yields (index, quiz, error) as each one finishes. Every quiz is cached on
+    its own, so it is shared with /api/quiz and the prefetcher.
+    """
+    futures = {
+        _pool.submit(get_quiz, course, topic, item["subtopic"], item["description"]): index
+        for index, item in enumerate(subtopics)
+    }
+    for future in as_completed(futures):
+        try:
+            yield futures[future], future.result(), None
+        except Exception as e:
+            yield futures[future], None, e
+
+
+def build_prompt(course, topic, subtopic, description):
+    return f'The user is learning the course {course}. In the course the user is learning topic "{topic}". Create quiz on subtopic "{subtopic}". The description of the subtopic is "{description}".'
+
+
+def get_model():
+    return gemini.get_model(MODEL_NAME, GENERATION_CONFIG, SAFETY_SETTINGS, SYSTEM_INSTRUCTION)
+
+
+def generate_quiz(course, topic, subtopic, description):
+    text = gemini.generate("quiz", get_model(), build_prompt(course, topic, subtopic, description))
+    quiz, truncated = llmjson.parse_with_repair("quiz", text)
+    return cache.Partial(quiz) if truncated else quiz
+
+
+async def get_quiz_async(course, topic, subtopic, description):
+    """Same as get_quiz, using the SDK's async API for the ASGI server"""
+    async def generate():
+        text = await gemini.generate_async("quiz", get_model(), build_prompt(course, topic, subtopic, description))
+        quiz, truncated = llmjson.parse_with_repair("quiz", text)
+        return cache.Partial(quiz) if truncated else quiz
+
+    return await cache.generations.get_or_create_async(quiz_key(course, topic, subtopic, description), generate)
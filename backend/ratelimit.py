@@ -0,0 +1,217 @@
+"""
+Rate limiting for the generation endpoints.
+
+Two layers protect the Gemini quota:
+
+- every client has a token bucket of generation requests, checked when
+  the request comes in. A client is the user of the bearer session token
+  (see sessions.py), or the IP address without one. The legacy user-email
+  header only counts while SESSION_ALLOW_EMAIL_HEADER=1
+- every upstream call goes through the scheduler, which enforces the global
+  requests-per-minute and tokens-per-minute budgets of the API key. Calls
+  that don't fit wait in a priority queue, so interactive requests are
+  served before background prefetch jobs. An interactive request that
+  joins a background call already in flight (see singleflight.py) raises
+  that call's priority, so it never waits in the background tier
+
+When a request can't be served within SCHEDULER_MAX_WAIT seconds,
+RateLimited is raised and the API answers 429 with a Retry-After header.
+"""
+
+import asyncio
+import contextvars
+import heapq
+import itertools
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+USER_REQUESTS_PER_MINUTE = float(os.environ.get("USER_REQUESTS_PER_MINUTE", 20))
+USER_BURST = float(os.environ.get("USER_BURST", 10))
+LLM_REQUESTS_PER_MINUTE = float(os.environ.get("LLM_REQUESTS_PER_MINUTE", 2000))
+LLM_TOKENS_PER_MINUTE = float(os.environ.get("LLM_TOKENS_PER_MINUTE", 4000000))
+SCHEDULER_MAX_WAIT = float(os.environ.get("SCHEDULER_MAX_WAIT", 10))
+
+# Expected output tokens per call, charged against the tokens-per-minute budget
+ESTIMATED_TOKENS = {
+    "roadmap": 4000,
+    "quiz": 6000,
+    "resource": 4000,
+    "translate": 1000,
+}
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+# Priority of the upstream calls made by the current thread or task
+priority = contextvars.ContextVar("priority", default=INTERACTIVE)
+_shared = contextvars.ContextVar("shared_priority", default=None)
+
+
+class SharedPriority:
+    """The priority of one call that several requests are waiting for"""
+
+    def __init__(self, level):
+        self.level = level
+        self.tickets = []  # the call's tickets in the scheduler queue
+
+
+@contextmanager
+def sharing(shared):
+    """Upstream calls made inside use shared's priority, which promote() can raise"""
+    token = _shared.set(shared)
+    try:
+        yield
+    finally:
+        _shared.reset(token)
+
+
+class RateLimited(Exception):
+    def __init__(self, retry_after, message="Rate limit exceeded"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class TokenBucket:
+    def __init__(self, per_minute, capacity):
+        self.rate = per_minute / 60
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, amount, now):
+        """Seconds until amount tokens are available"""
+        self._refill(now)
+        amount = min(amount, self.capacity)
+        if self.tokens >= amount:
+            return 0
+        return (amount - self.tokens) / self.rate
+
+    def take(self, amount):
+        self.tokens -= min(amount, self.capacity)
+
+
+class UserLimiter:
+    """One token bucket of requests per client"""
+
+    def __init__(self, per_minute=USER_REQUESTS_PER_MINUTE, burst=USER_BURST, max_clients=100000):
+        self.per_minute = per_minute
+        self.burst = burst
+        self.max_clients = max_clients
+        self.buckets = {}
+        self.lock = threading.Lock()
+
+    def check(self, client, cost=1):
+        """Charge cost requests to client, raises RateLimited if it is over its limit"""
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(client)
+            if bucket is None:
+                if len(self.buckets) >= self.max_clients:
+                    # Forget clients whose buckets have refilled completely
+                    self.buckets = {
+                        k: b for k, b in self.buckets.items() if b.wait_time(b.capacity, now) > 0
+                    }
+                bucket = self.buckets[client] = TokenBucket(self.per_minute, self.burst)
+            wait = bucket.wait_time(cost, now)
+            if wait > 0:
+                raise RateLimited(wait, "Too many requests, please slow down")
+            # A cost above the burst needs a full bucket and leaves it in debt
+            bucket.tokens -= cost
+
+
+class Scheduler:
+    """Admits upstream calls within the global request and token budgets"""
+
+    def __init__(self, requests_per_minute=LLM_REQUESTS_PER_MINUTE, tokens_per_minute=LLM_TOKENS_PER_MINUTE):
+        self.requests = TokenBucket(requests_per_minute, max(1, requests_per_minute / 60))
+        self.tokens = TokenBucket(tokens_per_minute, max(1, tokens_per_minute / 60))
+        self.cond = threading.Condition()
+        self.waiting = []
+        self.sequence = itertools.count()
+        self.stats = {"admitted": 0, "waited": 0, "rejected": 0}
+
+    def _wait_time(self, tokens):
+        now = time.monotonic()
+        return max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+
+    def _take(self, tokens):
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.stats["admitted"] += 1
+
+    def acquire(self, kind, max_wait=SCHEDULER_MAX_WAIT):
+        """Block until the call fits the budget, raises RateLimited past max_wait"""
+        tokens = ESTIMATED_TOKENS.get(kind, 1000)
+        shared = _shared.get()
+        deadline = time.monotonic() + max_wait
+        with self.cond:
+            # A list, so promote() can raise the priority while it waits
+            ticket = [shared.level if shared else priority.get(), next(self.sequence)]
+            heapq.heappush(self.waiting, ticket)
+            if shared:
+                shared.tickets.append(ticket)
+            try:
+                waited = False
+                while True:
+                    if self.waiting[0] is ticket:
+                        wait = self._wait_time(tokens)
+                        if wait == 0:
+                            self._take(tokens)
+                            if waited:
+                                self.stats["waited"] += 1
+                            return
+                    else:
+                        # Someone with a higher priority or an earlier ticket goes first
+                        wait = self._wait_time(tokens) or 0.05
+                    remaining = deadline - time.monotonic()
+                    if wait > remaining:
+                        self.stats["rejected"] += 1
+                        raise RateLimited(wait, "Generation quota exhausted, please retry later")
+                    waited = True
+                    self.cond.wait(wait)
+            finally:
+                self.waiting.remove(ticket)
+                heapq.heapify(self.waiting)
+                if shared:
+                    shared.tickets.remove(ticket)
+                self.cond.notify_all()
+
+    def promote(self, shared, level):
+        """Raise a shared call's priority to level, including tickets already queued"""
+        with self.cond:
+            if level >= shared.level:
+                return
+            shared.level = level
+            for ticket in shared.tickets:
+                ticket[0] = level
+            heapq.heapify(self.waiting)
+            self.cond.notify_all()
+
+    async def acquire_async(self, kind, max_wait=SCHEDULER_MAX_WAIT):
+        """Coroutine version of acquire, polls instead of blocking the event loop"""
+        tokens = ESTIMATED_TOKENS.get(kind, 1000)
+        deadline = time.monotonic() + max_wait
+        while True:
+            with self.cond:
+                wait = self._wait_time(tokens) if not self.waiting else 0.05
+                if wait == 0:
+                    self._take(tokens)
+                    return
+                if wait > deadline - time.monotonic():
+                    self.stats["rejected"] += 1
+                    raise RateLimited(wait, "Generation quota exhausted, please retry later")
+            await asyncio.sleep(wait)
+
+    def get_stats(self):
+        with self.cond:
+            return dict(self.stats, queued=len(self.waiting))
+
+
+users = UserLimiter()
+scheduler = Scheduler()
@@ -0,0 +1,255 @@
+"""
+Fault handling for upstream Gemini calls.
+
+gemini.generate() and generate_async() run every call through
+call_with_retry():
+
+- each attempt gets a deadline of LLM_DEADLINE seconds, and no retry is
+  started past LLM_TOTAL_DEADLINE
+- transient failures (timeouts, 429/5xx responses, dropped connections)
+  are retried up to LLM_RETRIES times with jittered exponential backoff
+- with LLM_HEDGE_AFTER set, an interactive call that hasn't answered after
+  that many seconds gets a second identical request, and whichever finishes
+  first is used
+
+A circuit breaker counts consecutive transient failures. After
+CIRCUIT_FAILURE_THRESHOLD of them, calls fail fast with UpstreamUnavailable
+for CIRCUIT_RESET_TIMEOUT seconds, then a single probe call decides whether
+the circuit closes again. Meanwhile the generation cache answers with
+expired entries where it has them (see cache.py).
+"""
+
+import asyncio
+import contextvars
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import TimeoutError as FuturesTimeout
+
+import metrics
+import ratelimit
+
+LLM_DEADLINE = float(os.environ.get("LLM_DEADLINE", 60))  # seconds per attempt
+LLM_TOTAL_DEADLINE = float(os.environ.get("LLM_TOTAL_DEADLINE", 120))
+LLM_RETRIES = int(os.environ.get("LLM_RETRIES", 2))
+LLM_RETRY_BASE = float(os.environ.get("LLM_RETRY_BASE", 0.5))
+LLM_RETRY_MAX = float(os.environ.get("LLM_RETRY_MAX", 8))
+LLM_HEDGE_AFTER = float(os.environ.get("LLM_HEDGE_AFTER", 0))  # 0 disables hedging
+CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get("CIRCUIT_FAILURE_THRESHOLD", 5))
+CIRCUIT_RESET_TIMEOUT = float(os.environ.get("CIRCUIT_RESET_TIMEOUT", 30))
+
+# google.api_core exception names, matched by name so the SDK stays the only import
+TRANSIENT_ERRORS = {
+    "DeadlineExceeded",
+    "ServiceUnavailable",
+    "InternalServerError",
+    "BadGateway",
+    "GatewayTimeout",
+    "TooManyRequests",
+    "ResourceExhausted",
+    "RetryError",
+}
+TRANSIENT_STATUS = {408, 429, 500, 502, 503, 504}
+
+_hedge_pool = ThreadPoolExecutor(max_workers=64, thread_name_prefix="hedge")
+
+
+class UpstreamUnavailable(Exception):
+    def __init__(self, retry_after, message="The generation service is unavailable, please try again later"):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def is_transient(error):
+    """Whether a failed call is worth retrying"""
+    if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+        return True
+    if type(error).__name__ in TRANSIENT_ERRORS:
+        return True
+    return getattr(error, "code", None) in TRANSIENT_STATUS
+
+
+class CircuitBreaker:
+    """Fails fast after repeated upstream failures, closed again by a probe call"""
+
+    def __init__(self, threshold=CIRCUIT_FAILURE_THRESHOLD, reset_timeout=CIRCUIT_RESET_TIMEOUT):
+        self.threshold = threshold
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+        self.lock = threading.Lock()
+        self.stats = {"opened": 0, "rejected": 0}
+
+    def before_call(self):
+        """Raises UpstreamUnavailable while open, lets one probe through after the reset timeout"""
+        with self.lock:
+            if self.opened_at is None:
+                return
+            wait = self.opened_at + self.reset_timeout - time.monotonic()
+            if wait > 0 or self.probing:
+                self.stats["rejected"] += 1
+                raise UpstreamUnavailable(max(wait, 1))
+            self.probing = True
+
+    def record_success(self):
+        with self.lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probing = False
+        metrics.set_gauge("gemini_circuit_open", 0)
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            if self.probing or (self.opened_at is None and self.failures >= self.threshold):
+                self.opened_at = time.monotonic()
+                self.probing = False
+                self.stats["opened"] += 1
+                print(f"Gemini circuit open for {self.reset_timeout}s after {self.failures} failures")
+                metrics.set_gauge("gemini_circuit_open", 1)
+
+    def release(self):
+        """The call never reached the upstream, let another probe through"""
+        with self.lock:
+            self.probing = False
+
+    def get_stats(self):
+        with self.lock:
+            if self.opened_at is None:
+                state = "closed"
+            elif self.probing or time.monotonic() >= self.opened_at + self.reset_timeout:
+                state = "half_open"
+            else:
+                state = "open"
+            return dict(self.stats, state=state, failures=self.failures)
+
+
+breaker = CircuitBreaker()
+
+
+def _backoff(attempt, deadline):
+    """Seconds to wait before retry number attempt, None if no retry should be made"""
+    if attempt > LLM_RETRIES:
+        return None
+    delay = random.uniform(0, min(LLM_RETRY_MAX, LLM_RETRY_BASE * 2 ** (attempt - 1)))
+    if time.monotonic() + delay >= deadline:
+        return None
+    return delay
+
+
+def _should_hedge():
+    return LLM_HEDGE_AFTER > 0 and ratelimit.priority.get() == ratelimit.INTERACTIVE
+
+
+def _hedged(kind, attempt_fn, timeout):
+    if LLM_HEDGE_AFTER >= timeout:
+        return attempt_fn(timeout)
+    # Run in a copy of the caller's context so the scheduling priority carries over
+    first = _hedge_pool.submit(contextvars.copy_context().run, attempt_fn, timeout)
+    try:
+        return first.result(timeout=LLM_HEDGE_AFTER)
+    except FuturesTimeout:
+        if first.done():
+            raise
+    metrics.inc("gemini_hedged_total", kind=kind)
+    second = _hedge_pool.submit(contextvars.copy_context().run, attempt_fn, timeout - LLM_HEDGE_AFTER)
+    error = None
+    for future in as_completed([first, second]):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
+
+
+def call_with_retry(kind, attempt_fn, hedge=True):
+    """Run attempt_fn(timeout) under the retry policy and the circuit breaker"""
+    deadline = time.monotonic() + LLM_TOTAL_DEADLINE
+    attempt = 0
+    while True:
+        breaker.before_call()
+        timeout = max(0.001, min(LLM_DEADLINE, deadline - time.monotonic()))
+        try:
+            if hedge and _should_hedge():
+                result = _hedged(kind, attempt_fn, timeout)
+            else:
+                result = attempt_fn(timeout)
+        except ratelimit.RateLimited:
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_transient(e):
+                # The upstream answered, the request itself was bad
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            attempt += 1
+            delay = _backoff(attempt, deadline)
+            if delay is None:
+                raise
+            print(f"Gemini {kind} call failed ({type(e).__name__}), retry {attempt} in {delay:.1f}s")
+            metrics.inc("gemini_retries_total", kind=kind)
+            time.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
+
+
+async def _hedged_async(kind, attempt_fn, timeout):
+    if LLM_HEDGE_AFTER >= timeout:
+        return await asyncio.wait_for(attempt_fn(timeout), timeout)
+    first = asyncio.ensure_future(asyncio.wait_for(attempt_fn(timeout), timeout))
+    done, _ = await asyncio.wait({first}, timeout=LLM_HEDGE_AFTER)
+    if done:
+        return first.result()
+    metrics.inc("gemini_hedged_total", kind=kind)
+    remaining = timeout - LLM_HEDGE_AFTER
+    second = asyncio.ensure_future(asyncio.wait_for(attempt_fn(remaining), remaining))
+    pending = {first, second}
+    error = None
+    try:
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in pending:
+            task.cancel()
+
+
+async def call_with_retry_async(kind, attempt_fn):
+    """Coroutine version of call_with_retry, attempt_fn(timeout) returns a coroutine"""
+    deadline = time.monotonic() + LLM_TOTAL_DEADLINE
+    attempt = 0
+    while True:
+        breaker.before_call()
+        timeout = max(0.001, min(LLM_DEADLINE, deadline - time.monotonic()))
+        try:
+            if _should_hedge():
+                result = await _hedged_async(kind, attempt_fn, timeout)
+            else:
+                result = await asyncio.wait_for(attempt_fn(timeout), timeout)
+        except ratelimit.RateLimited:
+            breaker.release()
+            raise
+        except Exception as e:
+            if not is_transient(e):
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            attempt += 1
+            delay = _backoff(attempt, deadline)
+            if delay is None:
+                raise
+            print(f"Gemini {kind} call failed ({type(e).__name__}), retry {attempt} in {delay:.1f}s")
+            metrics.inc("gemini_retries_total", kind=kind)
+            await asyncio.sleep(delay)
+            continue
+        breaker.record_success()
+        return result
@@ -1,13 +1,45 @@
-import os
-import google.generativeai as genai
+import asyncio
 import json
 import re
-from dotenv import load_dotenv
 
+import cache
+import gemini
+import llmjson
+import topics
 
-load_dotenv()
 
-genai.configure(api_key=os.environ["GEMINI_API_KEY"])
+MODEL_NAME = "gemini-2.0-flash"
+
+# See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
+GENERATION_CONFIG = {
+    "temperature": 1,
+    "top_p": 0.95,
+    "top_k": 64,
+    "max_output_tokens": 8192,
+    "response_mime_type": "application/json",
+}
+SAFETY_SETTINGS = [
+    {
+        "category": "HARM_CATEGORY_HARASSMENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_HATE_SPEECH",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+    {
+        "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
+        "threshold": "BLOCK_MEDIUM_AND_ABOVE",
+    },
+]
+
+INVALID_TOPIC_ERROR = "Please enter a valid learning topic. For example: 'Python Programming', 'Data Science', 'Machine Learning', etc."
+
+SYSTEM_INSTRUCTION = 'You are an AI agent who provides good personalized learning paths based on user input. You have to provide subtopics to learn with a small description of the subtopic telling what exactly to learn and how much time each subtopic will take. Give more time to subtopics that require more understanding. One more important thing, make sure to keep every key lowercase \nExample output:\n{\n  "week 1": {\n    "topic":"Introduction to Python",\n    "subtopics":[\n      {\n        "subtopic":"Getting Started with Python",\n        "time":"10 minute",\n        "description":"Learn Hello world in python"\n      },\n      {\n        "subtopic":"Data types in Python",\n        "time":"1 hour",\n        "description":"Learn about int, string, boolean, array, dict and casting data types"\n      },\n     {\n        "subtopic":"Conditionals in Python",\n        "time":"30 minutes",\n        "description":"Learn about comparison operators, if elif else statements"\n      },\n      {\n        "subtopic":"Loops",\n        "time":"30 minutes",\n        "description":"Learn about for loop, while loop, continue and break"\n      },\n      {\n        "subtopic":"OOPs in Python",\n        "time":"4 hours",\n        "description":"Learn about classes, objects, inheritance, polymorphism and OOPs concepts"\n      },\n    ]\n  }\n}\n Make sure to keep every key lowercase like subtopics, topic, time, etc.'
 
 
 def is_valid_topic(topic):
@@ -49,52 +81,96 @@ def create_roadmap(topic, time, knowledge_level):
     # Validate input topic
     if not is_valid_topic(topic):
         print(f"Topic validation failed for: '{topic}'")
-        return {
-            "error": "Please enter a valid learning topic. For example: 'Python Programming', 'Data Science', 'Machine Learning', etc."
-        }
+        return {"error": INVALID_TOPIC_ERROR}
     
     print(f"Topic validation passed for: '{topic}'")
     
-    # Create the model
-    # See https://ai.google.dev/api/python/google/generativeai/GenerativeModel
-    generation_config = {
-        "temperature": 1,
-        "top_p": 0.95,
-        "top_k": 64,
-        "max_output_tokens": 8192,
-        "response_mime_type": "application/json",
-    }
-    safety_settings = [
-        {
-            "category": "HARM_CATEGORY_HARASSMENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_HATE_SPEECH",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_SEXUALLY_EXPLICIT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-        {
-            "category": "HARM_CATEGORY_DANGEROUS_CONTENT",
-            "threshold": "BLOCK_MEDIUM_AND_ABOVE",
-        },
-    ]
-
-    model = genai.GenerativeModel(
-        model_name="gemini-2.0-flash",
-        safety_settings=safety_settings,
-        generation_config=generation_config,
-        system_instruction='You are an AI agent who provides good personalized learning paths based on user input. You have to provide subtopics to learn with a small description of the subtopic telling what exactly to learn and how much time each subtopic will take. Give more time to subtopics that require more understanding. One more important thing, make sure to keep every key lowercase \nExample output:\n{\n  "week 1": {\n    "topic":"Introduction to Python",\n    "subtopics":[\n      {\n        "subtopic":"Getting Started with Python",\n        "time":"10 minute",\n        "description":"Learn Hello world in python"\n      },\n      {\n        "subtopic":"Data types in Python",\n        "time":"1 hour",\n        "description":"Learn about int, string, boolean, array, dict and casting data types"\n      },\n     {\n        "subtopic":"Conditionals in Python",\n        "time":"30 minutes",\n        "description":"Learn about comparison operators, if elif else statements"\n      },\n      {\n        "subtopic":"Loops",\n        "time":"30 minutes",\n        "description":"Learn about for loop, while loop, continue and break"\n      },\n      {\n        "subtopic":"OOPs in Python",\n        "time":"4 hours",\n        "description":"Learn about classes, objects, inheritance, polymorphism and OOPs concepts"\n      },\n    ]\n  }\n}\n Make sure to keep every key lowercase like subtopics, topic, time, etc.',
+    similar = near_duplicate(topic, time, knowledge_level)
+    if similar is not None:
+        return similar
+    return cache.generations.get_or_create(
+        roadmap_key(topic, time, knowledge_level),
+        lambda: generate_roadmap(topic, time, knowledge_level),
     )
 
-    chat_session = model.start_chat(history=[])
 
-    response = chat_session.send_message(
-        f"Suggest a roadmap for learning {topic} in {time}. My Knowledge level is {knowledge_level}. I can spend total of 16 hours every week.",
-        stream=False,
+def near_duplicate(topic, time, knowledge_level):
+    """Cached roadmap of an earlier topic with the same canonical form, or None"""
+    key = topics.index.match(topic, time, knowledge_level)
+    if key is None or key == roadmap_key(topic, time, knowledge_level):
+        return None
+    # The exact key is looked up next, which counts the miss
+    return cache.generations.get(key, count_miss=False)
+
+
+def roadmap_key(topic, time, knowledge_level):
+    return cache.make_key(
+        "roadmap", MODEL_NAME, GENERATION_CONFIG, SYSTEM_INSTRUCTION,
+        topic=topic, time=time, knowledge_level=knowledge_level,
     )
-    print(response.text)
-    return json.loads(response.text)
+
+
+def get_model():
+    return gemini.get_model(MODEL_NAME, GENERATION_CONFIG, SAFETY_SETTINGS, SYSTEM_INSTRUCTION)
+
+
+def build_prompt(topic, time, knowledge_level):
+    return f"Suggest a roadmap for learning {topic} in {time}. My Knowledge level is {knowledge_level}. I can spend total of 16 hours every week."
+
+
+def generate_roadmap(topic, time, knowledge_level):
+    text = gemini.generate("roadmap", get_model(), build_prompt(topic, time, knowledge_level))
+    roadmap, truncated = llmjson.parse_with_repair("roadmap", text)
+    topics.index.add(topic, time, knowledge_level, roadmap_key(topic, time, knowledge_level))
+    return cache.Partial(roadmap) if truncated else roadmap
+
+
+def stream_roadmap(topic, time, knowledge_level):
+    """
+    Yield the raw JSON text of the roadmap as Gemini produces it. The parsed
+    roadmap is cached once the stream completes, invalid topics raise ValueError.
+    """
+    if not is_valid_topic(topic):
+        raise ValueError(INVALID_TOPIC_ERROR)
+
+    key = roadmap_key(topic, time, knowledge_level)
+    cached = near_duplicate(topic, time, knowledge_level) or cache.generations.get(key)
+    if cached is not None:
+        yield json.dumps(cached)
+        return
+
+    parts = []
+    try:
+        for text in gemini.generate_stream("roadmap", get_model(), build_prompt(topic, time, knowledge_level)):
+            parts.append(text)
+            yield text
+    except Exception:
+        # Fall back to an expired entry if nothing has been sent yet
+        stale = None if parts else cache.generations.get_stale(key)
+        if stale is None:
+            raise
+        yield json.dumps(stale)
+        return
+
+    roadmap, truncated = llmjson.parse_with_repair("roadmap", "".join(parts))
+    cache.generations.set(key, roadmap, ttl=cache.CACHE_PARTIAL_TTL if truncated else None)
+    topics.index.add(topic, time, knowledge_level, key)
+
+
+async def create_roadmap_async(topic, time, knowledge_level):
+    """Same as create_roadmap, using the SDK's async API for the ASGI server"""
+    if not is_valid_topic(topic):
+        return {"error": INVALID_TOPIC_ERROR}
+
+    # The topic index and the cache are SQLite backed, keep them off the event loop
+    similar = await asyncio.to_thread(near_duplicate, topic, time, knowledge_level)
+    if similar is not None:
+        return similar
+
+    async def generate():
+        text = await gemini.generate_async("roadmap", get_model(), build_prompt(topic, time, knowledge_level))
+        roadmap, truncated = llmjson.parse_with_repair("roadmap", text)
+        await asyncio.to_thread(topics.index.add, topic, time, knowledge_level, roadmap_key(topic, time, knowledge_level))
+        return cache.Partial(roadmap) if truncated else roadmap
+
+    return await cache.generations.get_or_create_async(roadmap_key(topic, time, knowledge_level), generate)
@@ -0,0 +1,84 @@
+"""
+Signed session tokens.
+
+login() hands out a token of the form <payload>.<signature>, where the
+payload is the base64url JSON {"sub": email, "exp": epoch seconds} and the
+signature is its HMAC-SHA256 under SESSION_SECRET. Checking a token needs
+no storage lookup, so any worker that shares the secret can verify it.
+
+Without SESSION_SECRET a random secret is generated at startup, which
+means tokens stop working on restart and aren't shared between worker
+processes. Set it in .env for anything beyond a single local server.
+
+Only the bearer token identifies a user. The user-email header that clients
+sent before tokens existed can be spoofed by anyone, so it is ignored unless
+SESSION_ALLOW_EMAIL_HEADER=1 is set as a temporary migration flag while those
+clients log in again. It applies everywhere authenticated_email() is used:
+the profile endpoint, the regenerate endpoint and the per-user rate limit key
+in both servers.
+"""
+
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import time
+
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 7 * 24 * 3600))  # seconds
+SESSION_SECRET = os.environ.get("SESSION_SECRET", "")
+# Migration only: trust the user-email header from clients logged in before tokens existed
+SESSION_ALLOW_EMAIL_HEADER = os.environ.get("SESSION_ALLOW_EMAIL_HEADER", "0") == "1"
+
+if SESSION_SECRET:
+    _secret = SESSION_SECRET.encode()
+else:
+    print("SESSION_SECRET is not set, session tokens won't survive a restart")
+    _secret = secrets.token_bytes(32)
+
+
+def _b64encode(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+
+def _b64decode(text):
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+
+def _sign(payload):
+    return _b64encode(hmac.new(_secret, payload.encode(), hashlib.sha256).digest())
+
+
+def issue(email, ttl=SESSION_TTL):
+    """A session token for email, valid for ttl seconds"""
+    payload = _b64encode(json.dumps({"sub": email, "exp": int(time.time()) + ttl}).encode())
+    return f"{payload}.{_sign(payload)}"
+
+
+def verify(token):
+    """The email a token was issued for, or None if it is invalid or expired"""
+    try:
+        payload, signature = token.split(".")
+        if not hmac.compare_digest(signature, _sign(payload)):
+            return None
+        claims = json.loads(_b64decode(payload))
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(claims, dict) or not isinstance(claims.get("exp"), int) or claims["exp"] < time.time():
+        return None
+    return claims.get("sub")
+
+
+def authenticated_email(authorization, email_header=None):
+    """
+    The email of the user making a request, from the Authorization header's
+    bearer token, or from the legacy user-email header if
+    SESSION_ALLOW_EMAIL_HEADER is on.
+    """
+    scheme, _, token = (authorization or "").partition(" ")
+    if scheme.lower() == "bearer" and token.strip():
+        return verify(token.strip())
+    if SESSION_ALLOW_EMAIL_HEADER:
+        return email_header or None
+    return None
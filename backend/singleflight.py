@@ -0,0 +1,81 @@
+"""
+Request coalescing for identical in-flight generations.
+
+When a class of students opens the same quiz at once, only the first request
+calls Gemini; the others wait for that call and share its result.
+
+The call runs with the leader's scheduler priority (see ratelimit.py). When
+an interactive request joins a call started by a background prefetch, the
+call is promoted to the interactive tier, so the request isn't queued
+behind other background work or rejected after SCHEDULER_MAX_WAIT.
+"""
+
+import asyncio
+import threading
+
+import ratelimit
+
+
+class _Call:
+    def __init__(self):
+        self.priority = ratelimit.SharedPriority(ratelimit.priority.get())
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Runs at most one call per key at a time and shares its result"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+        self.tasks = {}
+        self.stats = {"leaders": 0, "coalesced": 0}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = _Call()
+                self.stats["leaders"] += 1
+            else:
+                self.stats["coalesced"] += 1
+
+        if not leader:
+            ratelimit.scheduler.promote(call.priority, ratelimit.priority.get())
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.value
+
+        try:
+            with ratelimit.sharing(call.priority):
+                call.value = fn()
+            return call.value
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call.done.set()
+
+    async def do_async(self, key, coro_fn):
+        """Coroutine version of do() for the ASGI server, shares one task per key"""
+        task = self.tasks.get(key)
+        if task is None:
+            task = self.tasks[key] = asyncio.ensure_future(coro_fn())
+            task.add_done_callback(lambda _: self.tasks.pop(key, None))
+            with self.lock:
+                self.stats["leaders"] += 1
+        else:
+            with self.lock:
+                self.stats["coalesced"] += 1
+        # shield() so one waiter timing out doesn't cancel the call for the rest
+        return await asyncio.shield(task)
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, in_flight=len(self.calls) + len(self.tasks))
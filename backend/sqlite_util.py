@@ -0,0 +1,24 @@
+"""
+The SQLite connection setup shared by every store.
+
+sqlite3 connections can't be shared between threads, so each store keeps one
+per thread in a threading.local. They run in autocommit mode (transactions
+are opened explicitly with BEGIN IMMEDIATE) and in WAL mode with
+synchronous=NORMAL, so readers never block the writer and a commit doesn't
+wait for an fsync of the database file.
+"""
+
+import sqlite3
+
+SQLITE_TIMEOUT = 30  # seconds to wait for another connection's write lock
+
+
+def connect(path, local):
+    """This thread's connection to the database at path, kept in local"""
+    conn = getattr(local, "conn", None)
+    if conn is None:
+        conn = sqlite3.connect(path, timeout=SQLITE_TIMEOUT, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        local.conn = conn
+    return conn
@@ -0,0 +1,680 @@
+"""
+User storage backends for the API.
+
+The default backend keeps one row per user in a SQLite database running in
+WAL mode, so a request only reads and writes the record for the email it is
+working on instead of parsing and rewriting the whole users.json file.
+The old single-file backend is still available with USER_STORE=json. It
+commits writes by writing a temporary file and renaming it over users.json,
+under a file lock shared with other worker processes, and groups the writes
+that arrive within USERS_COMMIT_WINDOW_MS of each other into one commit.
+Reads are served from an in-memory copy of the file that is reloaded only
+when users.json has been replaced, by this process or another one.
+
+With USER_SHARDS=N users are spread over N stores of the configured
+backend by a hash of their email (users-0-of-N.db, ...), or over the
+comma-separated paths in USER_SHARD_PATHS, so writes for different users
+take different locks and the shards can live on different volumes.
+Each user's quiz and login history is sharded along with them (see
+history.py).
+
+Shards are SQLite files in WAL mode, which only works when every process
+using them runs on the same machine: WAL relies on shared memory, and
+SQLite's file locks are not reliable over NFS or SMB. Sharding spreads the
+write load of one node over several files and disks, it does not let
+several API nodes share users. For that, the store has to move to a
+networked database server.
+
+Migrate an existing users.json with:
+
+$ python storage.py import users.json
+
+To change the number of shards while the API keeps running, restart every
+API process with the new USER_SHARDS and the old count in USER_SHARDS_PREVIOUS
+(and USER_SHARD_PATHS_PREVIOUS if the old shards had explicit paths), then
+copy the remaining users over with:
+
+$ python storage.py reshard
+
+Once it is done, drop USER_SHARDS_PREVIOUS and remove the old shard files,
+users and history alike. The same command moves the history of a server
+that was sharded before history was, after which history.db can go.
+"""
+
+import base64
+import copy
+import hashlib
+import heapq
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from functools import wraps
+
+try:
+    import fcntl
+except ImportError:  # Windows, writes are only serialized within one process
+    fcntl = None
+
+import config  # noqa: F401, loads .env, also when run as the import/reshard tool
+import metrics
+import sqlite_util
+
+USER_STORE = os.environ.get("USER_STORE", "sqlite")
+USERS_FILE = os.environ.get("USERS_FILE", "users.json")
+USERS_DB = os.environ.get("USERS_DB", "users.db")
+USERS_COMMIT_WINDOW_MS = float(os.environ.get("USERS_COMMIT_WINDOW_MS", 5))
+# Local files only, every process using them has to run on this machine (see above)
+USER_SHARDS = int(os.environ.get("USER_SHARDS", 1))
+USER_SHARD_PATHS = [p.strip() for p in os.environ.get("USER_SHARD_PATHS", "").split(",") if p.strip()]
+# Set while resharding, the layout users are being moved away from
+USER_SHARDS_PREVIOUS = int(os.environ.get("USER_SHARDS_PREVIOUS", 0))
+USER_SHARD_PATHS_PREVIOUS = [
+    p.strip() for p in os.environ.get("USER_SHARD_PATHS_PREVIOUS", "").split(",") if p.strip()
+]
+
+
+def timed(operation):
+    """Record the method's latency in the user_store_seconds histogram"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(*args, **kwargs):
+            with metrics.timer("user_store_seconds", operation=operation):
+                return method(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def user_totals(user):
+    """The per-user numbers that feed the admin summary"""
+    profile = user.get("profile", {})
+    return (
+        profile.get("learning_hours", 0),
+        profile.get("courses_completed", 0),
+        len(profile.get("achievements", [])),
+    )
+
+
+def bump_version(user):
+    """Every committed update gives the record a new version, used for ETags"""
+    user["version"] = user.get("version", 0) + 1
+
+
+def encode_cursor(user):
+    """Opaque pagination cursor pointing just past user in created_at order"""
+    raw = json.dumps([user.get("created_at", ""), user["email"]])
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor):
+    created_at, email = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    return created_at, email
+
+
+class UserStore:
+    """Interface shared by every storage backend"""
+
+    def get(self, email):
+        """Return the user record for email, or None"""
+        raise NotImplementedError
+
+    def create(self, email, user):
+        """Insert a new user, returns False if the email is already taken"""
+        raise NotImplementedError
+
+    def update(self, email, fn):
+        """
+        Apply fn(user) to one record and persist it with its "version"
+        incremented, returns the updated user or None.
+        """
+        raise NotImplementedError
+
+    def all(self):
+        """Iterate over (email, user) pairs"""
+        raise NotImplementedError
+
+    def count(self):
+        raise NotImplementedError
+
+    def summary(self):
+        """Platform totals: users, learning hours, completed courses and achievements"""
+        raise NotImplementedError
+
+    def page(self, limit, after=None):
+        """
+        Return up to limit users, newest first, as dicts with an "email" key,
+        starting after the given cursor, and the cursor for the next page.
+        """
+        raise NotImplementedError
+
+
+class _Write:
+    """A create or update waiting for the next group commit"""
+
+    def __init__(self, email, fn=None, user=None):
+        self.email = email
+        self.fn = fn
+        self.user = user
+        self.lead = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class JsonFileStore(UserStore):
+    """Legacy backend keeping every user in a single JSON document"""
+
+    def __init__(self, path=USERS_FILE, commit_window=USERS_COMMIT_WINDOW_MS / 1000):
+        self.path = path
+        self.commit_window = commit_window
+        self.lock = threading.Lock()
+        self.pending = []
+        self.committing = False
+        # email -> record, valid while users.json has index_signature
+        self.index = None
+        self.index_signature = None
+        self.index_lock = threading.Lock()
+
+    def _signature(self):
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        # Every commit renames a new file into place, so the inode changes too
+        return st.st_ino, st.st_mtime_ns, st.st_size
+
+    def _index(self):
+        """The parsed users.json, only reloaded after the file was replaced"""
+        signature = self._signature()
+        with self.index_lock:
+            if self.index is None or signature != self.index_signature:
+                # A commit landing between stat() and the load only costs a reload
+                self.index, self.index_signature = self._load(), signature
+            return self.index
+
+    def _load(self):
+        if os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                return json.load(f)
+        return {}
+
+    def _save(self, users):
+        # Readers see either the old or the new file, never a partial one
+        fd, tmp = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(self.path)), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as f:
+                json.dump(users, f, indent=2)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp, self.path)
+        except BaseException:
+            os.unlink(tmp)
+            raise
+
+    @contextmanager
+    def _file_lock(self):
+        """Exclusive lock on users.json across worker processes"""
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _apply(self, batch):
+        """Apply a batch of writes in arrival order and commit them in one write"""
+        with self._file_lock():
+            users = self._load()
+            changed = []
+            for write in batch:
+                try:
+                    if write.fn is None:
+                        write.result = write.email not in users
+                        if write.result:
+                            users[write.email] = write.user
+                            changed.append(write)
+                    elif write.email in users:
+                        # Work on a copy so a failing fn leaves the record untouched
+                        user = copy.deepcopy(users[write.email])
+                        write.fn(user)
+                        bump_version(user)
+                        users[write.email] = write.result = user
+                        changed.append(write)
+                except Exception as e:
+                    write.error = e
+            if changed:
+                try:
+                    self._save(users)
+                except Exception as e:
+                    for write in changed:
+                        write.error = e
+                    return
+                with self.index_lock:
+                    self.index, self.index_signature = users, self._signature()
+
+    def _commit(self, write):
+        """
+        Group commit: the first writer to arrive waits commit_window for
+        others to join, then applies the whole batch. Leadership then passes
+        to the next waiting writer, so nobody commits a batch after their own.
+        """
+        with self.lock:
+            self.pending.append(write)
+            if not self.committing:
+                self.committing = write.lead = True
+        if not write.lead:
+            write.done.wait()
+        if write.lead:
+            if self.commit_window:
+                time.sleep(self.commit_window)
+            with self.lock:
+                batch, self.pending = self.pending, []
+            try:
+                self._apply(batch)
+            finally:
+                with self.lock:
+                    if self.pending:
+                        self.pending[0].lead = True
+                        self.pending[0].done.set()
+                    else:
+                        self.committing = False
+                for other in batch:
+                    other.done.set()
+        if write.error is not None:
+            raise write.error
+        return write.result
+
+    @timed("get")
+    def get(self, email):
+        user = self._index().get(email)
+        # Callers may modify what they get, the index must stay as committed
+        return copy.deepcopy(user) if user is not None else None
+
+    @timed("create")
+    def create(self, email, user):
+        return self._commit(_Write(email, user=user))
+
+    @timed("update")
+    def update(self, email, fn):
+        return self._commit(_Write(email, fn=fn))
+
+    def all(self):
+        return ((email, copy.deepcopy(user)) for email, user in list(self._index().items()))
+
+    def count(self):
+        return len(self._index())
+
+    # The legacy backend has no indexes, so these scan every user
+
+    @timed("summary")
+    def summary(self):
+        users = self._index()
+        totals = [user_totals(user) for user in users.values()]
+        return {
+            "total_users": len(users),
+            "total_learning_hours": sum(t[0] for t in totals),
+            "total_courses_completed": sum(t[1] for t in totals),
+            "total_achievements": sum(t[2] for t in totals),
+        }
+
+    @timed("page")
+    def page(self, limit, after=None):
+        users = [dict(copy.deepcopy(user), email=email) for email, user in self._index().items()]
+        users.sort(key=lambda u: (u.get("created_at", ""), u["email"]), reverse=True)
+        if after:
+            position = decode_cursor(after)
+            users = [u for u in users if (u.get("created_at", ""), u["email"]) < position]
+        users = users[:limit]
+        next_cursor = encode_cursor(users[-1]) if len(users) == limit else None
+        return users, next_cursor
+
+
+class SQLiteStore(UserStore):
+    """
+    One row per user, keyed by email, in a WAL-mode SQLite database.
+    Platform totals live in a single-row stats table that every write
+    adjusts in the same transaction, and users are indexed by created_at
+    for the admin listing.
+
+    Unlike JsonFileStore there is no in-memory email index: a lookup is one
+    read through the email primary key's B-tree, and pages that are read
+    often stay in SQLite's page cache, so it doesn't grow with the number
+    of users and can't go stale when another process writes.
+    """
+
+    def __init__(self, path=USERS_DB):
+        self.path = path
+        self.local = threading.local()
+        conn = self._connect()
+        conn.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS users (
+                email TEXT PRIMARY KEY,
+                created_at TEXT,
+                data TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS users_created_at ON users (created_at, email);
+            CREATE TABLE IF NOT EXISTS stats (
+                id INTEGER PRIMARY KEY CHECK (id = 0),
+                users INTEGER NOT NULL,
+                learning_hours REAL NOT NULL,
+                courses_completed INTEGER NOT NULL,
+                achievements INTEGER NOT NULL
+            );
+            """
+        )
+        conn.execute("BEGIN IMMEDIATE")
+        if conn.execute("SELECT 1 FROM stats").fetchone() is None:
+            # Databases created before the stats table get it backfilled once
+            totals = [user_totals(user) for _, user in self.all()]
+            conn.execute(
+                "INSERT INTO stats VALUES (0, ?, ?, ?, ?)",
+                (len(totals), sum(t[0] for t in totals), sum(t[1] for t in totals), sum(t[2] for t in totals)),
+            )
+        conn.execute("COMMIT")
+
+    def _connect(self):
+        return sqlite_util.connect(self.path, self.local)
+
+    @timed("get")
+    def get(self, email):
+        row = self._connect().execute(
+            "SELECT data FROM users WHERE email = ?", (email,)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _add_totals(self, conn, users, old, new):
+        conn.execute(
+            """
+            UPDATE stats SET users = users + ?, learning_hours = learning_hours + ?,
+                courses_completed = courses_completed + ?, achievements = achievements + ?
+            """,
+            (users, *(n - o for o, n in zip(old, new))),
+        )
+
+    @timed("create")
+    def create(self, email, user):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO users (email, created_at, data) VALUES (?, ?, ?)",
+                (email, user.get("created_at", ""), json.dumps(user)),
+            )
+            self._add_totals(conn, 1, (0, 0, 0), user_totals(user))
+            conn.execute("COMMIT")
+        except sqlite3.IntegrityError:
+            conn.execute("ROLLBACK")
+            return False
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return True
+
+    @timed("update")
+    def update(self, email, fn):
+        conn = self._connect()
+        # BEGIN IMMEDIATE takes the write lock before reading, so two workers
+        # updating the same user can't overwrite each other's changes.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data FROM users WHERE email = ?", (email,)
+            ).fetchone()
+            if row is None:
+                conn.execute("ROLLBACK")
+                return None
+            user = json.loads(row[0])
+            before = user_totals(user)
+            fn(user)
+            bump_version(user)
+            conn.execute(
+                "UPDATE users SET data = ? WHERE email = ?", (json.dumps(user), email)
+            )
+            self._add_totals(conn, 0, before, user_totals(user))
+            conn.execute("COMMIT")
+            return user
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def all(self):
+        for email, data in self._connect().execute("SELECT email, data FROM users"):
+            yield email, json.loads(data)
+
+    def count(self):
+        return self._connect().execute("SELECT users FROM stats").fetchone()[0]
+
+    @timed("summary")
+    def summary(self):
+        users, hours, courses, achievements = self._connect().execute(
+            "SELECT users, learning_hours, courses_completed, achievements FROM stats"
+        ).fetchone()
+        return {
+            "total_users": users,
+            "total_learning_hours": hours,
+            "total_courses_completed": courses,
+            "total_achievements": achievements,
+        }
+
+    @timed("page")
+    def page(self, limit, after=None):
+        conn = self._connect()
+        if after:
+            rows = conn.execute(
+                """
+                SELECT email, data FROM users WHERE (created_at, email) < (?, ?)
+                ORDER BY created_at DESC, email DESC LIMIT ?
+                """,
+                (*decode_cursor(after), limit),
+            )
+        else:
+            rows = conn.execute(
+                "SELECT email, data FROM users ORDER BY created_at DESC, email DESC LIMIT ?",
+                (limit,),
+            )
+        users = [dict(json.loads(data), email=email) for email, data in rows]
+        next_cursor = encode_cursor(users[-1]) if len(users) == limit else None
+        return users, next_cursor
+
+
+def shard_index(email, shards):
+    """The shard an email belongs to, stable across processes and restarts"""
+    digest = hashlib.blake2b(email.encode(), digest_size=8).digest()
+    return int.from_bytes(digest, "big") % shards
+
+
+def shard_paths(path, shards):
+    """users.db stays unsharded, otherwise users-0-of-4.db, users-1-of-4.db, ..."""
+    if shards == 1:
+        return [path]
+    root, ext = os.path.splitext(path)
+    return [f"{root}-{i}-of-{shards}{ext}" for i in range(shards)]
+
+
+class ShardedStore(UserStore):
+    """Routes every user to one of several stores by a hash of the email"""
+
+    def __init__(self, shards):
+        self.shards = list(shards)
+
+    def shard(self, email):
+        return self.shards[shard_index(email, len(self.shards))]
+
+    def get(self, email):
+        return self.shard(email).get(email)
+
+    def create(self, email, user):
+        return self.shard(email).create(email, user)
+
+    def update(self, email, fn):
+        return self.shard(email).update(email, fn)
+
+    def all(self):
+        for shard in self.shards:
+            yield from shard.all()
+
+    def count(self):
+        return sum(shard.count() for shard in self.shards)
+
+    def summary(self):
+        summaries = [shard.summary() for shard in self.shards]
+        return {key: sum(s[key] for s in summaries) for key in summaries[0]}
+
+    def page(self, limit, after=None):
+        # Each shard's first page after the cursor holds every user that can
+        # make the merged page, since the cursor is a position, not an offset
+        pages = [shard.page(limit, after)[0] for shard in self.shards]
+        users = heapq.nlargest(
+            limit, (u for page in pages for u in page), key=lambda u: (u.get("created_at", ""), u["email"]),
+        )
+        next_cursor = encode_cursor(users[-1]) if len(users) == limit else None
+        return users, next_cursor
+
+
+class ReshardingStore(UserStore):
+    """
+    Serves users while they move from the previous shard layout to the new
+    one. Reads prefer the new layout, an update first moves the user over,
+    and new users are only created in the new layout. Totals and listings
+    have to merge both layouts, so they scan every user until the move is done.
+    """
+
+    def __init__(self, current, previous):
+        self.current = current
+        self.previous = previous
+
+    def move(self, email):
+        """Copy a user to the new layout unless it is already there"""
+        user = self.previous.get(email)
+        if user is not None:
+            self.current.create(email, user)  # False if someone else moved it first
+        return user
+
+    def get(self, email):
+        user = self.current.get(email)
+        return user if user is not None else self.previous.get(email)
+
+    def create(self, email, user):
+        if self.previous.get(email) is not None:
+            return False
+        return self.current.create(email, user)
+
+    def update(self, email, fn):
+        if self.current.get(email) is None and self.move(email) is None:
+            return None
+        return self.current.update(email, fn)
+
+    def all(self):
+        moved = set()
+        for email, user in self.current.all():
+            moved.add(email)
+            yield email, user
+        for email, user in self.previous.all():
+            if email not in moved:
+                yield email, user
+
+    def count(self):
+        return sum(1 for _ in self.all())
+
+    def summary(self):
+        totals = [user_totals(user) for _, user in self.all()]
+        return {
+            "total_users": len(totals),
+            "total_learning_hours": sum(t[0] for t in totals),
+            "total_courses_completed": sum(t[1] for t in totals),
+            "total_achievements": sum(t[2] for t in totals),
+        }
+
+    def page(self, limit, after=None):
+        users = {}
+        for store in (self.previous, self.current):
+            for user in store.page(limit, after)[0]:
+                users[user["email"]] = user  # the new layout's copy wins
+        users = heapq.nlargest(limit, users.values(), key=lambda u: (u.get("created_at", ""), u["email"]))
+        next_cursor = encode_cursor(users[-1]) if len(users) == limit else None
+        return users, next_cursor
+
+
+def reshard(store):
+    """Move every user still in the previous layout, returns how many were copied"""
+    moved = 0
+    for email, user in store.previous.all():
+        if store.current.create(email, user):
+            moved += 1
+    return moved
+
+
+def import_json(store, path):
+    """Copy every user from a users.json file into store, skipping existing emails"""
+    with open(path, "r") as f:
+        users = json.load(f)
+    imported = 0
+    for email, user in users.items():
+        if store.create(email, user):
+            imported += 1
+    return imported
+
+
+def open_layout(shards, paths=()):
+    """The configured backend over shards stores, at paths if given"""
+    if USER_STORE == "json":
+        backend, path = JsonFileStore, USERS_FILE
+    else:
+        backend, path = SQLiteStore, USERS_DB
+    paths = list(paths) or shard_paths(path, shards)
+    if len(paths) != shards:
+        raise ValueError(f"USER_SHARD_PATHS lists {len(paths)} paths for {shards} shards")
+    if shards == 1:
+        return backend(paths[0])
+    return ShardedStore(backend(p) for p in paths)
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    """Return the configured user store, creating it on first use"""
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = open_layout(USER_SHARDS, USER_SHARD_PATHS)
+                if USER_SHARDS_PREVIOUS:
+                    _store = ReshardingStore(_store, open_layout(USER_SHARDS_PREVIOUS, USER_SHARD_PATHS_PREVIOUS))
+                if USER_STORE != "json":
+                    # Pick up the existing users the first time the database is created
+                    if _store.count() == 0 and os.path.exists(USERS_FILE):
+                        count = import_json(_store, USERS_FILE)
+                        print(f"Imported {count} users from {USERS_FILE} into the user store")
+    return _store
+
+
+if __name__ == "__main__":
+    if len(sys.argv) == 3 and sys.argv[1] == "import":
+        count = import_json(open_layout(USER_SHARDS, USER_SHARD_PATHS), sys.argv[2])
+        print(f"Imported {count} users from {sys.argv[2]} into {USER_SHARDS} shard(s)")
+    elif len(sys.argv) == 2 and sys.argv[1] == "reshard":
+        import history  # imports this file again as the storage module, which is fine here
+        if not USER_SHARDS_PREVIOUS and not isinstance(history.history, history.ReshardingHistory):
+            print("Set USER_SHARDS_PREVIOUS to the shard count being moved away from")
+            sys.exit(1)
+        if USER_SHARDS_PREVIOUS:
+            store = ReshardingStore(open_layout(USER_SHARDS, USER_SHARD_PATHS), open_layout(USER_SHARDS_PREVIOUS, USER_SHARD_PATHS_PREVIOUS))
+            count = reshard(store)
+            print(f"Moved {count} users from {USER_SHARDS_PREVIOUS} to {USER_SHARDS} shard(s)")
+        if isinstance(history.history, history.ReshardingHistory):
+            count = history.reshard(history.history)
+            print(f"Moved the history of {count} users to {USER_SHARDS} shard(s)")
+    else:
+        print("Usage: python storage.py import <users.json>")
+        print("       python storage.py reshard")
+        sys.exit(1)
@@ -0,0 +1,64 @@
+"""
+Helpers for streaming generations to the client as Server-Sent Events.
+"""
+
+import json
+import re
+
+from flask import Response, request, stream_with_context
+
+CHAPTER_HEADER = re.compile(r"^# (.+)")
+
+
+def wants_stream(req_data):
+    """Streaming is opted into with "stream": true in the body or an SSE Accept header"""
+    if req_data.get("stream"):
+        return True
+    return "text/event-stream" in request.headers.get("Accept", "")
+
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events):
+    """Wrap a generator of SSE strings in an unbuffered streaming response"""
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            # Stop nginx style proxies from buffering the stream
+            "X-Accel-Buffering": "no",
+        },
+    )
+
+
+class ChapterDetector:
+    """Spots level-one markdown headers ("# Title") as text streams in"""
+
+    def __init__(self):
+        self.pending = ""
+        self.in_code_block = False
+        self.count = 0
+
+    def _check(self, line):
+        if line.startswith("```"):
+            self.in_code_block = not self.in_code_block
+            return None
+        match = None if self.in_code_block else CHAPTER_HEADER.match(line)
+        if match:
+            self.count += 1
+            return {"index": self.count, "title": match.group(1).strip()}
+        return None
+
+    def feed(self, text):
+        """Return the chapters whose header line was completed by text"""
+        self.pending += text
+        *lines, self.pending = self.pending.split("\n")
+        return [chapter for chapter in map(self._check, lines) if chapter]
+
+    def flush(self):
+        line, self.pending = self.pending, ""
+        chapter = self._check(line)
+        return [chapter] if chapter else []
@@ -0,0 +1,151 @@
+"""
+Near-duplicate matching of roadmap topics.
+
+"ML", "machine learning", "Machine Learning basics" and "intro to
+machine-learning" should all get the same roadmap. Topics are canonicalized
+(case, punctuation, filler words, plurals, common abbreviations), and a
+topic with the same canonical form as one generated before, within the same
+time and knowledge level, is served that topic's cached roadmap (see
+roadmap.py).
+
+There is deliberately no fuzzy or typo matching: "Microeconomics" and
+"Macroeconomics", or "Flask" and "Flash", are one letter apart and still
+different subjects.
+
+The index is kept in memory and persisted in SQLite, so it needs no network
+and survives restarts.
+"""
+
+import os
+import re
+import threading
+import time
+from collections import defaultdict
+
+import sqlite_util
+from cache import normalize
+
+TOPICS_DB = os.environ.get("TOPICS_DB", "topics.db")
+
+TOKEN = re.compile(r"[a-z0-9+#]+")
+TRAILING_VERSION = re.compile(r"^([a-z]+)(\d+)$")  # "python3" -> "python 3"
+
+# Words that don't change what the roadmap is about
+STOPWORDS = {
+    "a", "an", "the", "to", "of", "for", "in", "on", "with", "and", "&",
+    "intro", "introduction", "basic", "basics", "fundamental", "fundamentals",
+    "beginner", "beginners", "course", "tutorial", "learn", "learning", "how",
+    "101", "getting", "started", "essentials", "overview", "crash",
+}
+
+SYNONYMS = {
+    "ml": "machine learning",
+    "ai": "artificial intelligence",
+    "dl": "deep learning",
+    "nlp": "natural language processing",
+    "cv": "computer vision",
+    "ds": "data science",
+    "dsa": "data structures algorithms",
+    "oop": "object oriented programming",
+    "oops": "object oriented programming",
+    "js": "javascript",
+    "ts": "typescript",
+    "py": "python",
+    "k8s": "kubernetes",
+    "db": "database",
+    "dbms": "database management systems",
+    "os": "operating systems",
+    "c++": "cpp",
+    "c#": "csharp",
+    "golang": "go",
+    "reactjs": "react",
+    "nodejs": "node",
+    "vuejs": "vue",
+}
+
+# "learning" is filler in "learning python" but not in "machine learning"
+KEEP_AFTER = {"learning": {"machine", "deep", "reinforcement", "supervised", "unsupervised", "transfer"}}
+
+
+def singular(word):
+    """"databases" -> "database", "libraries" -> "library", leaves "css" and "analysis" alone"""
+    if len(word) <= 3 or not word.endswith("s") or word.endswith(("ss", "us", "is")):
+        return word
+    if word.endswith("ies"):
+        return word[:-3] + "y"
+    return word[:-1]
+
+
+def canonicalize(topic):
+    """Canonical form of a topic, e.g. "Intro to Machine-Learning!" -> "machine learning" """
+    words = []
+    for token in TOKEN.findall(topic.lower().replace("-", " ").replace(".js", "js")):
+        token = SYNONYMS.get(token, token)
+        words.extend(TRAILING_VERSION.sub(r"\1 \2", token).split())
+    canonical = []
+    for word in words:
+        if word in STOPWORDS and not (canonical and canonical[-1] in KEEP_AFTER.get(word, ())):
+            continue
+        canonical.append(singular(word))
+    # A topic made only of filler words is kept as it was typed
+    return " ".join(canonical or words)
+
+
+class TopicIndex:
+    """Canonical topics of generated roadmaps, per time and knowledge level"""
+
+    def __init__(self, path=TOPICS_DB):
+        self.path = path
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.entries = defaultdict(dict)  # bucket -> {canonical: key}
+        self.stats = {"matches": 0, "misses": 0}
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS topics (
+                bucket TEXT NOT NULL,
+                canonical TEXT NOT NULL,
+                key TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (bucket, canonical)
+            )
+            """
+        )
+        for bucket, canonical, key in conn.execute("SELECT bucket, canonical, key FROM topics"):
+            self._remember(bucket, canonical, key)
+
+    def _connect(self):
+        return sqlite_util.connect(self.path, self.local)
+
+    @staticmethod
+    def bucket(time_, knowledge_level):
+        return f"{normalize(time_)}|{normalize(knowledge_level)}"
+
+    def _remember(self, bucket, canonical, key):
+        self.entries[bucket][canonical] = key
+
+    def add(self, topic, time_, knowledge_level, key):
+        """Record the cache key of a roadmap generated for topic"""
+        bucket, canonical = self.bucket(time_, knowledge_level), canonicalize(topic)
+        with self.lock:
+            self._remember(bucket, canonical, key)
+        self._connect().execute(
+            "INSERT OR REPLACE INTO topics (bucket, canonical, key, created_at) VALUES (?, ?, ?, ?)",
+            (bucket, canonical, key, time.time()),
+        )
+
+    def match(self, topic, time_, knowledge_level):
+        """Cache key of the known topic with the same canonical form in the bucket, or None"""
+        bucket, canonical = self.bucket(time_, knowledge_level), canonicalize(topic)
+        with self.lock:
+            key = self.entries.get(bucket, {}).get(canonical)
+            self.stats["matches" if key is not None else "misses"] += 1
+            return key
+
+    def get_stats(self):
+        with self.lock:
+            return dict(self.stats, topics=sum(len(entries) for entries in self.entries.values()))
+
+
+index = TopicIndex()
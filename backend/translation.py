@@ -0,0 +1,146 @@
+"""
+UI translation through Gemini with a persistent translation memory.
+
+Every translated segment is stored by (segment hash, target language), so
+the UI strings the frontend sends for each user are only translated once.
+Segments missing from the memory are sent upstream in size-bounded batches
+that run in parallel.
+"""
+
+import hashlib
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import gemini
+import sqlite_util
+
+MODEL_NAME = "gemini-pro"
+SEPARATOR = "---SEPARATOR---"
+
+TRANSLATIONS_DB = os.environ.get("TRANSLATIONS_DB", "translations.db")
+# Limits for a single upstream request
+TRANSLATION_BATCH_SIZE = int(os.environ.get("TRANSLATION_BATCH_SIZE", 50))
+TRANSLATION_BATCH_CHARS = int(os.environ.get("TRANSLATION_BATCH_CHARS", 6000))
+TRANSLATION_WORKERS = int(os.environ.get("TRANSLATION_WORKERS", 8))
+
+_pool = ThreadPoolExecutor(max_workers=TRANSLATION_WORKERS, thread_name_prefix="translate")
+
+
+def get_model():
+    return gemini.get_model(MODEL_NAME)
+
+
+def segment_hash(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+class TranslationMemory:
+    """Translated segments in SQLite, keyed by (segment hash, language)"""
+
+    def __init__(self, path=TRANSLATIONS_DB):
+        self.path = path
+        self.local = threading.local()
+        self._connect().execute(
+            """
+            CREATE TABLE IF NOT EXISTS translations (
+                hash TEXT NOT NULL,
+                lang TEXT NOT NULL,
+                translation TEXT NOT NULL,
+                PRIMARY KEY (hash, lang)
+            )
+            """
+        )
+
+    def _connect(self):
+        return sqlite_util.connect(self.path, self.local)
+
+    def lookup(self, texts, lang):
+        """Return {text: translation} for the texts already in the memory"""
+        hashes = {segment_hash(text): text for text in texts}
+        found = {}
+        keys = list(hashes)
+        conn = self._connect()
+        # Stay under SQLite's bound parameter limit
+        for i in range(0, len(keys), 500):
+            chunk = keys[i:i + 500]
+            rows = conn.execute(
+                f"SELECT hash, translation FROM translations WHERE lang = ? AND hash IN ({','.join('?' * len(chunk))})",
+                [lang, *chunk],
+            )
+            for h, translation in rows:
+                found[hashes[h]] = translation
+        return found
+
+    def store(self, translations, lang):
+        self._connect().executemany(
+            "INSERT OR REPLACE INTO translations (hash, lang, translation) VALUES (?, ?, ?)",
+            [(segment_hash(text), lang, translated) for text, translated in translations.items()],
+        )
+
+
+memory = TranslationMemory()
+
+
+def make_batches(texts):
+    """Split texts into batches bounded by segment count and prompt size"""
+    batches, batch, size = [], [], 0
+    for text in texts:
+        if batch and (len(batch) >= TRANSLATION_BATCH_SIZE or size + len(text) > TRANSLATION_BATCH_CHARS):
+            batches.append(batch)
+            batch, size = [], 0
+        batch.append(text)
+        size += len(text)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def translate_batch(texts, to_lang):
+    """Translate texts in one request, returns None if the reply can't be split back up"""
+    combined_text = f"\n{SEPARATOR}\n".join(texts)
+
+    prompt = f"""Translate the following text segments to {to_lang}.
+Each segment is separated by '{SEPARATOR}'.
+Return ONLY the translated segments, separated by the same '{SEPARATOR}' marker.
+Do not add any explanations, just the translations.
+
+Text to translate:
+{combined_text}"""
+
+    translated = gemini.generate("translate", get_model(), prompt)
+    translated_arr = [t.strip() for t in translated.strip().split(SEPARATOR)]
+
+    # Ensure we have the same number of translations
+    if len(translated_arr) != len(texts):
+        return None
+    return translated_arr
+
+
+def translate_segment(text, to_lang):
+    return gemini.generate("translate", get_model(), f"Translate to {to_lang}: {text}").strip()
+
+
+def translate(text_arr, to_lang):
+    """Translate a list of strings, only cache misses are sent to Gemini"""
+    lang = to_lang.strip().lower()
+    translations = memory.lookup(text_arr, lang)
+
+    missing = list(dict.fromkeys(t for t in text_arr if t not in translations and t.strip()))
+    if missing:
+        new = {}
+        batches = make_batches(missing)
+        retry = []
+        for batch, result in zip(batches, _pool.map(lambda b: translate_batch(b, to_lang), batches)):
+            if result is None:
+                # Fallback: translate the batch's segments individually
+                retry.extend(batch)
+            else:
+                new.update(zip(batch, result))
+        new.update(zip(retry, _pool.map(lambda t: translate_segment(t, to_lang), retry)))
+
+        memory.store(new, lang)
+        translations.update(new)
+
+    print(f"Translated to {to_lang}: {len(text_arr)} segments, {len(missing)} sent upstream")
+    return [translations.get(text, text) for text in text_arr]
@@ -2,19 +2,273 @@
 """
 AI Learning Platform - User Statistics Script
 This script shows statistics about registered users.
+
+Without arguments it runs the interactive menu. For large stores use the
+non-interactive mode, which streams users one at a time instead of loading
+the whole store into memory:
+
+    python check_users.py --stats
+    python check_users.py --stats --workers 4 --json backend/users.db
+    python check_users.py --export --format csv --output users.csv.gz
+
+Inputs can be users.json files (optionally .gz) or SQLite user databases
+(.db). With --workers the totals are computed in a process pool, one task
+per input file, and SQLite databases are also split into rowid ranges.
+Exports are written as they are read, gzip compressed when the output name
+ends in .gz. JSON exports include each user's quiz and login history from
+the history.db (or history-<i>-of-N.db shard) next to the user store.
+
+Without input files the API's store in backend/ is read: its shard files
+(users-0-of-N.db, ...) for USER_SHARDS=N, users.db, or users.json, in that
+order. Shards kept elsewhere with USER_SHARD_PATHS have to be named.
 """
 
+import argparse
+import csv
+import gzip
 import json
 import os
-from datetime import datetime
+import re
+import sqlite3
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timezone
+
+try:
+    import ijson
+except ImportError:  # optional, a faster C-backed streaming parser
+    ijson = None
+
+USERS_FILE = 'backend/users.json'
+USERS_DB = 'backend/users.db'
+USER_SHARD_FILE = re.compile(r'^users-(\d+)-of-(\d+)\.db$')
+CHUNK_SIZE = 1 << 20
+CSV_COLUMNS = ['email', 'name', 'created_at', 'learning_hours', 'courses_completed', 'achievements']
+
+
+def shard_layouts(directory):
+    """{N: [paths]} for every complete set of users-<i>-of-N.db files in directory"""
+    layouts = {}
+    for name in os.listdir(directory or '.'):
+        match = USER_SHARD_FILE.match(name)
+        if match:
+            layouts.setdefault(int(match.group(2)), {})[int(match.group(1))] = os.path.join(directory, name)
+    return {
+        shards: [files[i] for i in range(shards)]
+        for shards, files in layouts.items()
+        if all(i in files for i in range(shards))
+    }
+
+
+def default_inputs():
+    """The API's user shards or SQLite store if they exist, the legacy users.json otherwise"""
+    layouts = shard_layouts(os.path.dirname(USERS_DB))
+    shards = int(os.environ.get('USER_SHARDS', 0))
+    if shards > 1 and shards in layouts:
+        return layouts[shards]
+    if len(layouts) == 1:
+        return next(iter(layouts.values()))
+    if layouts:
+        # Old shards are left behind by a reshard until they are removed
+        shards = max(layouts, key=lambda n: max(os.path.getmtime(p) for p in layouts[n]))
+        print(f"Found shard files for {sorted(layouts)} shards, reading the {shards} most recently written to "
+              f"(set USER_SHARDS to choose)", file=sys.stderr)
+        return layouts[shards]
+    return [USERS_DB if os.path.exists(USERS_DB) else USERS_FILE]
+
+
+def open_text(path, mode='r'):
+    if path.endswith('.gz'):
+        return gzip.open(path, mode + 't', encoding='utf-8', newline='')
+    return open(path, mode, encoding='utf-8', newline='')
+
+
+def iter_json_object(f, chunk_size=CHUNK_SIZE):
+    """Yield the (key, value) pairs of a top-level JSON object, reading f in chunks"""
+    decoder = json.JSONDecoder()
+    buf, pos, eof = '', 0, False
+
+    def fill():
+        nonlocal buf, pos, eof
+        # Read at least as much as is buffered, so a value spanning many
+        # chunks is decoded a logarithmic number of times
+        chunk = f.read(max(chunk_size, len(buf) - pos))
+        eof = not chunk
+        buf, pos = buf[pos:] + chunk, 0
+
+    def peek():
+        nonlocal pos
+        while True:
+            while pos < len(buf) and buf[pos].isspace():
+                pos += 1
+            if pos < len(buf):
+                return buf[pos]
+            if eof:
+                raise ValueError('Unexpected end of JSON input')
+            fill()
+
+    def expect(chars):
+        nonlocal pos
+        ch = peek()
+        if ch not in chars:
+            raise ValueError(f'Expected one of {chars!r} but found {ch!r}')
+        pos += 1
+        return ch
+
+    def value():
+        nonlocal pos
+        peek()
+        while True:
+            try:
+                result, end = decoder.raw_decode(buf, pos)
+                # A number at the end of the buffer may continue in the next chunk
+                if end < len(buf) or eof:
+                    pos = end
+                    return result
+            except ValueError:
+                if eof:
+                    raise
+            fill()
+
+    expect('{')
+    if peek() == '}':
+        return
+    while True:
+        key = value()
+        if not isinstance(key, str):
+            raise ValueError('Expected a string key')
+        expect(':')
+        yield key, value()
+        if expect(',}') == '}':
+            return
+
+
+def iter_json_users(path):
+    if not os.path.exists(path):
+        return
+    if ijson is not None:
+        opener = gzip.open if path.endswith('.gz') else open
+        with opener(path, 'rb') as f:
+            yield from ijson.kvitems(f, '', use_float=True)
+        return
+    with open_text(path) as f:
+        yield from iter_json_object(f)
+
+
+def rowid_ranges(path, parts):
+    """Split the users table of a SQLite store into up to parts rowid ranges"""
+    conn = sqlite3.connect(path)
+    try:
+        low, high = conn.execute('SELECT MIN(rowid), MAX(rowid) FROM users').fetchone()
+    finally:
+        conn.close()
+    if low is None:
+        return []
+    step = -(-(high - low + 1) // parts)
+    return [(start, min(start + step - 1, high)) for start in range(low, high + 1, step)]
+
+
+def iter_db_users(path, rows=None):
+    if not os.path.exists(path):
+        return
+    # Read-only, so a running API server is never blocked by the scan
+    conn = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+    try:
+        if rows is None:
+            cursor = conn.execute('SELECT email, data FROM users')
+        else:
+            cursor = conn.execute('SELECT email, data FROM users WHERE rowid BETWEEN ? AND ?', rows)
+        for email, data in cursor:
+            yield email, json.loads(data)
+    finally:
+        conn.close()
+
+
+def iter_users(path, rows=None):
+    """Stream (email, user) pairs from a users.json file or a SQLite store"""
+    if path.endswith('.db'):
+        return iter_db_users(path, rows)
+    return iter_json_users(path)
+
+
+def history_path(users_path):
+    """history.db, or history-<i>-of-N.db, next to the user store it belongs to"""
+    directory, name = os.path.split(users_path)
+    match = USER_SHARD_FILE.match(name)
+    return os.path.join(directory, f'history-{match.group(1)}-of-{match.group(2)}.db' if match else 'history.db')
+
+
+class HistoryReader:
+    """Quiz and login history kept by the API outside the user records, read-only"""
+
+    def __init__(self, path):
+        self.conn = None
+        if os.path.exists(path):
+            self.conn = sqlite3.connect(f'file:{os.path.abspath(path)}?mode=ro', uri=True)
+        self.strings = {}
+
+    def _string(self, string_id):
+        if string_id is None:
+            return None
+        if string_id not in self.strings:
+            row = self.conn.execute('SELECT value FROM strings WHERE id = ?', (string_id,)).fetchone()
+            self.strings[string_id] = row[0] if row else None
+        return self.strings[string_id]
+
+    def merge(self, email, user):
+        """The user record with its quiz_history, quiz_daily and login_history lists"""
+        if self.conn is None:
+            return user
+        quizzes = [
+            {
+                'timestamp': datetime.fromtimestamp(ts).isoformat(),
+                'course': self._string(course_id),
+                'topic': self._string(topic_id),
+                'score': score,
+                'total': total,
+                'time_spent': time_spent,
+            }
+            for ts, course_id, topic_id, score, total, time_spent in self.conn.execute(
+                'SELECT ts, course_id, topic_id, score, total, time_spent FROM quiz_events '
+                'WHERE email = ? ORDER BY ts, rowid', (email,))
+        ]
+        daily = [
+            {
+                'date': datetime.fromtimestamp(day * 86400, timezone.utc).date().isoformat(),
+                'course': self._string(course_id),
+                'topic': self._string(topic_id),
+                'attempts': attempts,
+                'score': score,
+                'total': total,
+                'time_spent': time_spent,
+            }
+            for day, course_id, topic_id, attempts, score, total, time_spent in self.conn.execute(
+                'SELECT day, course_id, topic_id, attempts, score, total, time_spent FROM quiz_daily '
+                'WHERE email = ? ORDER BY day', (email,))
+        ]
+        logins = [
+            {'timestamp': datetime.fromtimestamp(ts).isoformat(), 'ip': ip, 'user_agent': self._string(agent_id)}
+            for ts, ip, agent_id in self.conn.execute(
+                'SELECT ts, ip, user_agent_id FROM login_events WHERE email = ? ORDER BY ts, rowid', (email,))
+        ]
+        # Lists still in the record haven't been moved to history.db yet and are older
+        return dict(
+            user,
+            quiz_history=(user.get('quiz_history') or []) + quizzes,
+            quiz_daily=daily,
+            login_history=(user.get('login_history') or []) + logins,
+        )
+
+    def close(self):
+        if self.conn is not None:
+            self.conn.close()
+
 
 def load_users():
-    """Load users from the JSON file"""
-    users_file = 'backend/users.json'
-    if os.path.exists(users_file):
-        with open(users_file, 'r') as f:
-            return json.load(f)
-    return {}
+    """Load users from the API's store, every shard of it"""
+    return {email: user for path in default_inputs() for email, user in iter_users(path)}
+
 
 def format_date(date_string):
     """Format ISO date string to readable format"""
@@ -26,76 +280,184 @@ def format_date(date_string):
     except:
         return date_string
 
-def display_user_stats():
+
+def user_row(email, user):
+    profile = user.get('profile', {})
+    return {
+        'email': email,
+        'name': user.get('name', ''),
+        'created_at': user.get('created_at', ''),
+        'learning_hours': profile.get('learning_hours', 0),
+        'courses_completed': profile.get('courses_completed', 0),
+        'achievements': len(profile.get('achievements', [])),
+    }
+
+
+class Totals:
+    """Platform aggregates, built in one pass and mergeable across workers"""
+
+    def __init__(self):
+        self.users = 0
+        self.learning_hours = 0
+        self.courses_completed = 0
+        self.achievements = 0
+        self.active_users = 0
+        self.first_signup = None
+        self.last_signup = None
+        self.signups_by_month = Counter()
+
+    def add(self, email, user):
+        row = user_row(email, user)
+        self.users += 1
+        self.learning_hours += row['learning_hours']
+        self.courses_completed += row['courses_completed']
+        self.achievements += row['achievements']
+        if row['learning_hours'] or row['courses_completed']:
+            self.active_users += 1
+        created_at = row['created_at']
+        if created_at:
+            self.signups_by_month[created_at[:7]] += 1
+            self.first_signup = min(self.first_signup or created_at, created_at)
+            self.last_signup = max(self.last_signup or created_at, created_at)
+
+    def merge(self, other):
+        self.users += other.users
+        self.learning_hours += other.learning_hours
+        self.courses_completed += other.courses_completed
+        self.achievements += other.achievements
+        self.active_users += other.active_users
+        self.signups_by_month.update(other.signups_by_month)
+        for signup in (other.first_signup, other.last_signup):
+            if signup:
+                self.first_signup = min(self.first_signup or signup, signup)
+                self.last_signup = max(self.last_signup or signup, signup)
+        return self
+
+    def to_dict(self):
+        return {
+            'total_users': self.users,
+            'active_users': self.active_users,
+            'total_learning_hours': self.learning_hours,
+            'total_courses_completed': self.courses_completed,
+            'total_achievements': self.achievements,
+            'average_hours_per_user': self.learning_hours / self.users if self.users else 0,
+            'first_signup': self.first_signup,
+            'last_signup': self.last_signup,
+            'signups_by_month': dict(sorted(self.signups_by_month.items())),
+        }
+
+
+def scan(task):
+    """Totals for one input file, or one rowid range of a SQLite store"""
+    path, rows = task
+    totals = Totals()
+    for email, user in iter_users(path, rows):
+        totals.add(email, user)
+    return totals
+
+
+def compute_stats(paths, workers=1):
+    tasks = []
+    for path in paths:
+        if workers > 1 and path.endswith('.db') and os.path.exists(path):
+            tasks.extend((path, rows) for rows in rowid_ranges(path, workers))
+        else:
+            tasks.append((path, None))
+    totals = Totals()
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            for partial in pool.map(scan, tasks):
+                totals.merge(partial)
+    else:
+        for task in tasks:
+            totals.merge(scan(task))
+    return totals
+
+
+def print_totals(totals, paths):
+    stats = totals.to_dict()
+    print(f"\n🎯 PLATFORM TOTALS:")
+    print(f"   👥 Total Registered Users: {stats['total_users']}")
+    print(f"   🔥 Active Users: {stats['active_users']}")
+    print(f"   📊 Total Learning Hours: {stats['total_learning_hours']}")
+    print(f"   📚 Total Courses Completed: {stats['total_courses_completed']}")
+    print(f"   🏆 Total Achievements: {stats['total_achievements']}")
+    print(f"   📈 Average Hours per User: {stats['average_hours_per_user']:.1f}")
+    if stats['signups_by_month']:
+        print(f"\n📅 SIGNUPS:")
+        print(f"   First: {format_date(stats['first_signup'])}")
+        print(f"   Last: {format_date(stats['last_signup'])}")
+        for month, count in stats['signups_by_month'].items():
+            print(f"   {month}: {count}")
+
+    print(f"\n💾 DATA LOCATION:")
+    for path in paths:
+        print(f"   File: {path}")
+        print(f"   Size: {os.path.getsize(path) if os.path.exists(path) else 0} bytes")
+
+
+def display_user_stats(paths=None):
     """Display comprehensive user statistics"""
+    paths = paths or default_inputs()
     print("=" * 60)
     print("🚀 AI PERSONALIZED LEARNING PLATFORM")
     print("📊 USER STATISTICS DASHBOARD")
     print("=" * 60)
-    
-    users = load_users()
-    
-    if not users:
-        print("❌ No users found!")
-        print("   Make sure users.json exists in the backend folder.")
-        return
-    
-    total_users = len(users)
-    total_learning_hours = 0
-    total_courses = 0
-    total_achievements = 0
-    
-    print(f"\n📈 SUMMARY:")
-    print(f"   Total Registered Users: {total_users}")
-    
+
+    totals = Totals()
     print(f"\n👥 USER DETAILS:")
     print("-" * 60)
-    
-    for i, (email, user_data) in enumerate(users.items(), 1):
-        name = user_data.get('name', 'No name provided')
-        created_at = user_data.get('created_at', '')
-        profile = user_data.get('profile', {})
-        
-        learning_hours = profile.get('learning_hours', 0)
-        courses_completed = profile.get('courses_completed', 0)
-        achievements = len(profile.get('achievements', []))
-        
-        total_learning_hours += learning_hours
-        total_courses += courses_completed
-        total_achievements += achievements
-        
-        print(f"{i}. 📧 Email: {email}")
-        print(f"   👤 Name: {name}")
-        print(f"   📅 Joined: {format_date(created_at)}")
-        print(f"   ⏱️  Learning Hours: {learning_hours}")
-        print(f"   📚 Courses Completed: {courses_completed}")
-        print(f"   🏆 Achievements: {achievements}")
-        print("-" * 60)
-    
-    print(f"\n🎯 PLATFORM TOTALS:")
-    print(f"   📊 Total Learning Hours: {total_learning_hours}")
-    print(f"   📚 Total Courses Completed: {total_courses}")
-    print(f"   🏆 Total Achievements: {total_achievements}")
-    print(f"   📈 Average Hours per User: {total_learning_hours/total_users:.1f}")
-    
-    print(f"\n💾 DATA LOCATION:")
-    print(f"   File: backend/users.json")
-    print(f"   Size: {os.path.getsize('backend/users.json') if os.path.exists('backend/users.json') else 0} bytes")
-    
+
+    for path in paths:
+        for email, user_data in iter_users(path):
+            totals.add(email, user_data)
+            row = user_row(email, user_data)
+            print(f"{totals.users}. 📧 Email: {email}")
+            print(f"   👤 Name: {row['name'] or 'No name provided'}")
+            print(f"   📅 Joined: {format_date(row['created_at'])}")
+            print(f"   ⏱️  Learning Hours: {row['learning_hours']}")
+            print(f"   📚 Courses Completed: {row['courses_completed']}")
+            print(f"   🏆 Achievements: {row['achievements']}")
+            print("-" * 60)
+
+    if not totals.users:
+        print("❌ No users found!")
+        print("   Make sure users.db or users.json exists in the backend folder.")
+        return
+
+    print_totals(totals, paths)
     print("\n" + "=" * 60)
 
-def export_user_data():
-    """Export user data to a formatted file"""
-    users = load_users()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"user_export_{timestamp}.json"
-    
-    with open(filename, 'w') as f:
-        json.dump(users, f, indent=2)
-    
-    print(f"✅ User data exported to: {filename}")
 
-def main():
+def export_user_data(paths=None, output=None, fmt='jsonl'):
+    """Export user data, one user at a time, as JSON lines or CSV"""
+    paths = paths or default_inputs()
+    if output is None:
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = f"user_export_{timestamp}.{fmt}.gz"
+
+    count = 0
+    with open_text(output, 'w') as f:
+        if fmt == 'csv':
+            writer = csv.DictWriter(f, fieldnames=CSV_COLUMNS)
+            writer.writeheader()
+        for path in paths:
+            history = HistoryReader(history_path(path))
+            try:
+                for email, user in iter_users(path):
+                    if fmt == 'csv':
+                        writer.writerow(user_row(email, user))
+                    else:
+                        f.write(json.dumps(dict(history.merge(email, user), email=email)) + '\n')
+                    count += 1
+            finally:
+                history.close()
+
+    print(f"✅ {count} users exported to: {output}")
+    return output
+
+
+def interactive():
     """Main function"""
     while True:
         print("\n🔧 AI Learning Platform - Admin Tools")
@@ -103,9 +465,9 @@ def main():
         print("2. 💾 Export User Data")
         print("3. 🔄 Refresh Data")
         print("4. ❌ Exit")
-        
+
         choice = input("\nSelect an option (1-4): ").strip()
-        
+
         if choice == '1':
             display_user_stats()
         elif choice == '2':
@@ -119,5 +481,37 @@ def main():
         else:
             print("❌ Invalid option. Please try again.")
 
+
+def main():
+    parser = argparse.ArgumentParser(description="User statistics and exports for the learning platform")
+    parser.add_argument("inputs", nargs="*", help="users.json files or SQLite stores (.db), default: the API's store")
+    parser.add_argument("--stats", action="store_true", help="print platform totals")
+    parser.add_argument("--export", action="store_true", help="export every user")
+    parser.add_argument("--format", choices=["jsonl", "csv"], default="jsonl", help="export format")
+    parser.add_argument("--output", help="export file, gzip compressed if it ends in .gz")
+    parser.add_argument("--workers", type=int, default=1, help="processes used for --stats")
+    parser.add_argument("--json", action="store_true", help="print --stats as JSON")
+    args = parser.parse_args()
+
+    if not args.stats and not args.export:
+        interactive()
+        return
+
+    paths = args.inputs or default_inputs()
+    missing = [path for path in paths if not os.path.exists(path)]
+    if missing:
+        print(f"❌ Not found: {', '.join(missing)}", file=sys.stderr)
+        sys.exit(1)
+
+    if args.stats:
+        totals = compute_stats(paths, max(args.workers, 1))
+        if args.json:
+            print(json.dumps(totals.to_dict(), indent=2))
+        else:
+            print_totals(totals, paths)
+    if args.export:
+        export_user_data(paths, args.output, args.format)
+
+
 if __name__ == "__main__":
     main()
@@ -36,6 +36,7 @@ const Header = ({ showBackButton = false, onBackClick }) => {
   const confirmLogout = () => {
     localStorage.removeItem('userLoggedIn');
     localStorage.removeItem('userEmail');
+    localStorage.removeItem('sessionToken');
     localStorage.removeItem('userName');
     // Also clear any session storage
     sessionStorage.removeItem('previousPage');
@@ -4,6 +4,7 @@ import './admin.css';
 const AdminPage = () => {
     const [stats, setStats] = useState(null);
     const [users, setUsers] = useState([]);
+    const [nextCursor, setNextCursor] = useState(null);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState(null);
 
@@ -26,6 +27,7 @@ const AdminPage = () => {
                     summary: data.summary
                 });
                 setUsers(data.users);
+                setNextCursor(data.next_cursor);
                 setError(null);
             } else {
                 throw new Error('Failed to load data');
@@ -38,6 +40,25 @@ const AdminPage = () => {
         }
     };
 
+    const loadMoreUsers = async () => {
+        try {
+            setLoading(true);
+            const response = await fetch(`/api/admin/users?after=${encodeURIComponent(nextCursor)}`);
+            
+            if (response.ok) {
+                const data = await response.json();
+                setUsers((current) => [...current, ...data.users]);
+                setNextCursor(data.next_cursor);
+            } else {
+                throw new Error('Failed to load data');
+            }
+        } catch (err) {
+            console.error('Error:', err);
+        } finally {
+            setLoading(false);
+        }
+    };
+
     const exportUsers = async () => {
         try {
             const response = await fetch('/api/admin/users/export');
@@ -164,6 +185,15 @@ const AdminPage = () => {
                                 ))}
                             </tbody>
                         </table>
+                        {nextCursor && (
+                            <button
+                                className="refresh-btn"
+                                onClick={loadMoreUsers}
+                                disabled={loading}
+                            >
+                                {loading ? '⏳ Loading...' : '⬇️ Load more'}
+                            </button>
+                        )}
                     </div>
                 )}
             </div>
@@ -48,6 +48,7 @@ const LoginPage = () => {
         // Store user session
         localStorage.setItem('userLoggedIn', 'true');
         localStorage.setItem('userEmail', response.data.user.email);
+        localStorage.setItem('sessionToken', response.data.token);
         localStorage.setItem('userName', response.data.user.name || formData.email.split('@')[0]);
         
         navigate('/topic');
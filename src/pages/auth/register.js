@@ -71,6 +71,7 @@ const RegisterPage = () => {
         // Store user session
         localStorage.setItem('userLoggedIn', 'true');
         localStorage.setItem('userEmail', response.data.user.email);
+        localStorage.setItem('sessionToken', response.data.token);
         localStorage.setItem('userName', response.data.user.name);
         
         navigate('/topic');
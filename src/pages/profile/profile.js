@@ -546,20 +546,29 @@ const ProfilePage = (props) => {
     const fetchUserProfile = async () => {
       if (isLoggedIn && userEmail) {
         try {
+          const token = localStorage.getItem('sessionToken');
           const response = await axios.get('http://localhost:5000/api/auth/profile', {
-            headers: {
-              'user-email': userEmail
-            }
+            // Sessions from before tokens were issued still send the email, which the
+            // backend only accepts while SESSION_ALLOW_EMAIL_HEADER=1
+            headers: token ? { Authorization: `Bearer ${token}` } : { 'user-email': userEmail }
           });
           setUserProfile(response.data);
         } catch (error) {
+          if (error.response && error.response.status === 401) {
+            // Expired token or a pre-token session, log in again
+            localStorage.removeItem('userLoggedIn');
+            localStorage.removeItem('userEmail');
+            localStorage.removeItem('sessionToken');
+            navigate('/login');
+            return;
+          }
           console.error('Error fetching user profile:', error);
         }
       }
     };
     
     fetchUserProfile();
-  }, [isLoggedIn, userEmail]);
+  }, [isLoggedIn, userEmail, navigate]);
 
   useEffect(() => {
     const roadmaps = JSON.parse(localStorage.getItem("roadmaps")) || {};